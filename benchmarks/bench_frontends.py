@@ -0,0 +1,83 @@
+"""
+Keypoint frontends of frontends.py on the same KITTI drive, each run through the stages of src/main.py
+with the main.py options given after the benchmark options.
+
+Reports per frontend the p50 and p95 latency of a frame (the frontend run, without reading the image), the
+mean keypoints per frame, the tracks seen in at least two frames with their mean and median length in
+frames, and the ATE of the VIO solution. The perturbed initial estimate is reseeded for every frontend.
+
+    python benchmarks/bench_frontends.py --frontends superpoint sift orb --basedir /data/kitti --date 2011_09_26 \
+        --drive 0022 --n_skip 10 --n_frames 701
+"""
+
+import argparse
+
+import numpy as np
+
+import common
+import landmark_selection
+import main
+import profiling
+import solve
+
+
+def run(args):
+    profiling.timers.enable()
+    try:
+        drive = main.load_drive(args)
+        keypoints = []
+
+        def counted(features):
+            for i, pts, desc in features:
+                keypoints.append(pts.shape[1])
+                yield i, pts, desc
+
+        vision_data, track_scores = main.track_features(args, drive, counted(main.extract_features(args, drive)))
+        latency = np.array(profiling.timers.durations['features'])
+    finally:
+        profiling.timers.disable()
+
+    lengths = landmark_selection.track_lengths(vision_data)
+    lengths = lengths[lengths > 1]
+
+    np.random.seed(0)
+    keyframe_frames, imu_only, vio_full = main.build_graphs(args, drive, vision_data, track_scores)
+    result_imu, result_full = solve.solve(imu_only, vio_full, args, drive.time[keyframe_frames])
+    result = main.evaluate_results(args, drive, keyframe_frames, imu_only.initial_estimate, result_imu, result_full)
+    return {
+        'p50_ms': 1.e3 * np.percentile(latency, 50),
+        'p95_ms': 1.e3 * np.percentile(latency, 95),
+        'keypoints': np.mean(keypoints),
+        'tracks': lengths.shape[0],
+        'mean_length': np.mean(lengths) if lengths.shape[0] else 0.,
+        'median_length': np.median(lengths) if lengths.shape[0] else 0.,
+        'ate_m': result['metrics']['VIO']['ate_rmse'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the keypoint frontends on one KITTI drive.', allow_abbrev=False)
+    parser.add_argument('--frontends', dest='frontends', type=str, nargs='+', default=['superpoint', 'sift', 'orb'],
+                        help='Frontends to compare, by name or module:loader as for main.py --frontend.')
+    args, main_options = parser.parse_known_args()
+
+    main_parser = main.build_parser()
+    main_args = main_parser.parse_args(main_options)
+    if main_args.synthetic:
+        parser.error('the frontends need the KITTI images and cannot run on a --synthetic drive')
+    main_args.viz_tracking = False
+    main_args.feature_cache = None
+    main_args.export = None
+
+    stats = {}
+    for name in args.frontends:
+        main_args.frontend = name
+        main.check_arguments(main_parser, main_args)
+        stats[name] = run(main_args)
+
+    print('%-12s %9s %9s %10s %8s %12s %12s %8s' % ('frontend', 'p50 (ms)', 'p95 (ms)', 'keypoints', 'tracks',
+                                                    'mean length', 'median len.', 'ATE (m)'))
+    for name in args.frontends:
+        s = stats[name]
+        print('%-12s %9.1f %9.1f %10.0f %8d %12.2f %12.1f %8.3f' % (name[-12:], s['p50_ms'], s['p95_ms'], s['keypoints'],
+              s['tracks'], s['mean_length'], s['median_length'], s['ate_m']))
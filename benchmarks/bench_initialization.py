@@ -0,0 +1,72 @@
+"""
+Initial estimate of the keyframe states: ground truth composed with random offsets (perturbed) against
+IMU dead reckoning, with the propagated velocity or the measured one, on a synthetic drive.
+
+Reports the ATE of the initial estimate, and the LM iterations, solve time and ATE of the IMU-only and
+VIO solves. With dead reckoning the landmarks are initialized from the initial keyframe poses too.
+
+    python benchmarks/bench_initialization.py --n_frames 1000 --n_landmarks 10000 --n_skip 10 --imu_stream
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import common
+import evaluation
+import synthetic
+import trajectory
+import VisualInertialOdometry as vio
+
+CONFIGURATIONS = (('perturbed', True), ('imu', False), ('imu', True))
+
+
+def ate(values, measured_poses, n_skip):
+    traj = trajectory.Trajectory.from_values(values)
+    return evaluation.ate(traj.poses, measured_poses[::n_skip][traj.index], 'se3')['rmse']
+
+
+def solve(drive_id, n_frames, n_skip, initialization, measured_velocity, use_imu_stream):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+
+    np.random.seed(0)
+    imu_only = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    imu_only.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip,
+                                  imu_stream=drive.imu_stream() if use_imu_stream else None,
+                                  initialization=initialization, measured_velocity=measured_velocity)
+    vio_full = imu_only.copy()
+    vio_full.add_keypoints(drive.vision_data(n_skip, n_frames), None if initialization == 'imu' else measured_poses,
+                           n_skip, drive.depth(n_frames), None)
+
+    stats = {'init_ate_m': ate(imu_only.initial_estimate, measured_poses, n_skip)}
+    for name, graph, params in (('imu', imu_only, common.imu_solver_params()), ('vio', vio_full, common.vio_solver_params())):
+        start = time.perf_counter()
+        result = graph.estimate(params)
+        stats[name + '_s'] = time.perf_counter() - start
+        stats[name + '_iterations'] = graph.optimizer.iterations()
+        stats[name + '_ate_m'] = ate(result, measured_poses, n_skip)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the initial estimate of the keyframe states.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    parser.add_argument('--imu_stream', dest='imu_stream', action='store_true',
+                        help='Integrate the 100 Hz IMU stream instead of one measurement per frame.')
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks)
+
+    print('%-22s %9s | %6s %8s %8s | %6s %8s %8s' % ('initialization', 'init ATE', 'iters', 'IMU (s)', 'ATE (m)',
+                                                    'iters', 'VIO (s)', 'ATE (m)'))
+    for initialization, measured_velocity in CONFIGURATIONS:
+        stats = solve(drive_id, args.n_frames, args.n_skip, initialization, measured_velocity, args.imu_stream)
+        name = initialization if initialization == 'perturbed' else 'imu, %s velocity' % ('measured' if measured_velocity else 'predicted')
+        print('%-22s %9.3f | %6d %8.2f %8.3f | %6d %8.2f %8.3f' % (name, stats['init_ate_m'],
+              stats['imu_iterations'], stats['imu_s'], stats['imu_ate_m'],
+              stats['vio_iterations'], stats['vio_s'], stats['vio_ate_m']))
@@ -0,0 +1,83 @@
+"""
+Keyframe policies on a synthetic drive with stops: fixed strides against the adaptive selection of
+keyframe_selection, which picks keyframes among all frames by parallax, track survival and IMU motion and
+drops the frames while the vehicle stands still.
+
+Reports the keyframes and the keyframes taken while stationary, the landmarks and factors of the VIO graph,
+its LM iterations and solve time within a fixed iteration budget, and the ATE of the keyframes.
+
+    python benchmarks/bench_keyframes.py --n_frames 1000 --n_landmarks 10000 --stop_probability 0.3 --strides 5 10 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+import gtsam
+
+import common
+import evaluation
+import keyframe_selection
+import synthetic
+import trajectory
+import VisualInertialOdometry as vio
+
+
+def solve(drive_id, n_frames, policy, n_skip, max_iterations):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+
+    start = time.perf_counter()
+    vision_data = drive.vision_data(n_skip, n_frames)
+    keyframes = keyframe_selection.keyframe_frames(n_skip, n_frames)
+    if policy == 'adaptive':
+        rotations, positions = keyframe_selection.imu_motion(measured_vel, measured_omega, delta_t)
+        selected = keyframe_selection.select_keyframes(vision_data, rotations[keyframes], positions[keyframes])
+        vision_data = keyframe_selection.keyframe_tracks(vision_data, selected)
+        keyframes = keyframes[selected]
+    select = time.perf_counter() - start
+
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, keyframes)
+    graph.add_keypoints(vision_data, measured_poses, keyframes, drive.depth(n_frames), None)
+    n_landmarks = sum(1 for key in graph.initial_estimate.keys() if gtsam.symbolChr(key) == ord('l'))
+
+    start = time.perf_counter()
+    result = graph.estimate(common.vio_solver_params(max_iterations))
+    solve = time.perf_counter() - start
+
+    traj = trajectory.Trajectory.from_values(result)
+    return {
+        'keyframes': keyframes.shape[0],
+        'stationary': int(np.sum(np.linalg.norm(measured_vel[keyframes], axis=1) < 0.1)),
+        'landmarks': n_landmarks,
+        'factors': graph.graph.size(),
+        'select_s': select,
+        'iterations': graph.optimizer.iterations(),
+        'solve_s': solve,
+        'ate_m': evaluation.ate(traj.poses, measured_poses[keyframes][traj.index], 'se3')['rmse'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark fixed and adaptive keyframe selection.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--stop_probability', dest='stop_probability', type=float, default=0.3)
+    parser.add_argument('--strides', dest='strides', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--max_iterations', dest='max_iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks, stop_probability=args.stop_probability)
+
+    configurations = [('stride', n_skip) for n_skip in args.strides] + [('adaptive', 1)]
+    print('%-12s %9s %10s %9s %8s %10s %6s %9s %8s' % ('keyframes', 'keyframes', 'stationary', 'landmarks', 'factors',
+                                                      'select (s)', 'iters', 'solve (s)', 'ATE (m)'))
+    for policy, n_skip in configurations:
+        stats = solve(drive_id, args.n_frames, policy, n_skip, args.max_iterations)
+        name = 'adaptive' if policy == 'adaptive' else 'stride %d' % n_skip
+        print('%-12s %9d %10d %9d %8d %10.2f %6d %9.2f %8.3f' % (name, stats['keyframes'], stats['stationary'],
+              stats['landmarks'], stats['factors'], stats['select_s'], stats['iterations'], stats['solve_s'],
+              stats['ate_m']))
@@ -0,0 +1,67 @@
+"""
+Linear solver and elimination ordering of the batch VIO solve: every combination of
+VisualInertialOdometry.LINEAR_SOLVERS and VisualInertialOdometry.ORDERINGS on the same graph and
+initial estimate of a synthetic drive, each in a fresh process.
+
+Reports solve time, iterations, peak memory, final error and the position RMSE of the keyframes.
+
+    python benchmarks/bench_linear_solver.py --n_frames 1000 --n_landmarks 10000 --n_skip 10
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import common
+import synthetic
+import VisualInertialOdometry as vio
+
+
+def solve(drive_id, n_frames, n_skip, linear_solver, ordering):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+
+    # Same perturbed initial estimate for every combination
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip)
+    graph.add_keypoints(drive.vision_data(n_skip, n_frames), measured_poses, n_skip, drive.depth(n_frames), None)
+
+    start = time.perf_counter()
+    try:
+        result = graph.estimate(common.vio_solver_params(), linear_solver=linear_solver, ordering=ordering)
+    except RuntimeError as e:
+        return {'error': str(e).splitlines()[0]}
+    solve = time.perf_counter() - start
+
+    return {
+        'solve_s': solve,
+        'iterations': graph.optimizer.iterations(),
+        'final_error': graph.optimizer.error(),
+        'rmse_m': common.translation_rmse(result, measured_poses, n_skip),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark linear solvers and elimination orderings of the VIO solve.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    parser.add_argument('--linear_solvers', dest='linear_solvers', type=str, nargs='+', default=list(vio.LINEAR_SOLVERS))
+    parser.add_argument('--orderings', dest='orderings', type=str, nargs='+', default=list(vio.ORDERINGS))
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks)
+
+    print('%-22s %-16s %9s %6s %9s %12s %8s' % ('linear solver', 'ordering', 'solve (s)', 'iters', 'peak (MB)',
+                                                'final error', 'RMSE (m)'))
+    for linear_solver in args.linear_solvers:
+        for ordering in args.orderings:
+            stats, peak = common.run_isolated(solve, drive_id, args.n_frames, args.n_skip, linear_solver, ordering)
+            if 'error' in stats:
+                print('%-22s %-16s failed: %s' % (linear_solver, ordering, stats['error']))
+                continue
+            print('%-22s %-16s %9.2f %6d %9.1f %12.4g %8.3f' % (linear_solver, ordering, stats['solve_s'],
+                  stats['iterations'], peak, stats['final_error'], stats['rmse_m']))
@@ -0,0 +1,314 @@
+"""
+Microbenchmarks of the hot functions of the pipeline on synthetic inputs, with stored baselines:
+
+    SuperPointFrontend.nms_fast      keypoints (NMS candidates in a KITTI-sized image)
+    SuperPointFrontend.run           a textured KITTI-sized image, on the CPU
+    PointTracker.nn_match_two_way    keypoints (descriptors per frame)
+    PointTracker.update              keypoints per frame, over a sequence of frames
+    main.get_vision_data             tracks of ten frames, over a sequence of frames
+    add_imu_measurements             frames of a synthetic drive
+    add_keypoints                    tracks (landmarks of the synthetic drive, every --landmark_stride-th
+                                     valid track becoming a landmark) and frames
+    estimate                         the same, with a fixed iteration budget
+
+Each benchmark runs for every combination of the sizes it depends on. The setup of every repeat is not
+timed, and the minimum and the median over the repeats are reported. --save stores the results as a
+baseline; --baseline compares against one, by default benchmarks/baseline.json of the repository, and
+exits with status 1 if the minimum time of a case grew by more than --threshold, so that every
+optimization of these functions is measured against the same inputs. The committed baseline was measured
+on one machine, so on another one a baseline of that machine gives the meaningful comparison:
+
+    python benchmarks/bench_micro.py --threshold 0.2 --only tracker_update get_vision_data
+    python benchmarks/bench_micro.py --baseline '' --save /tmp/baseline.json
+    python benchmarks/bench_micro.py --baseline /tmp/baseline.json
+
+The SuperPoint and tracker benchmarks need torch, OpenCV and the network weights of the
+SuperPointPretrainedNetwork submodule; the graph benchmarks only need GTSAM.
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+import common
+import landmark_selection
+import synthetic
+import VisualInertialOdometry as vio
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+IMAGE_SIZE = (375, 1242)
+DESCRIPTOR_SIZE = 256
+# Frames a synthetic keypoint or track is observed in
+LIFETIME = 10
+
+
+def superpoint():
+    """ The SuperPoint module of frontends.py, imported on use so that the graph benchmarks run without torch """
+    import SuperPointPretrainedNetwork.demo_superpoint as sp
+    return sp
+
+
+def unit_descriptors(rng, n):
+    desc = rng.randn(DESCRIPTOR_SIZE, n)
+    return desc / np.linalg.norm(desc, axis=0)
+
+
+def keypoint_sequence(keypoints, noise=0.05, seed=0):
+    """
+    A cycle of frames of keypoints points and descriptors, in which every keypoint is seen in LIFETIME
+    consecutive frames with a noisy descriptor. The cycle repeats without breaking the tracks, so that
+    frame i of a sequence is cycle[i % len(cycle)].
+    """
+    rng = np.random.RandomState(seed)
+    step = max(keypoints // LIFETIME, 1)
+    period = 2 * LIFETIME
+    pool = step * period
+    positions = rng.rand(2, pool) * np.array(IMAGE_SIZE[::-1])[:, None]
+    descriptors = unit_descriptors(rng, pool)
+    cycle = []
+    for i in range(period):
+        index = (i * step + np.arange(keypoints)) % pool
+        pts = np.vstack((positions[:, index], rng.rand(keypoints)))
+        desc = descriptors[:, index] + noise * rng.randn(DESCRIPTOR_SIZE, keypoints) / np.sqrt(DESCRIPTOR_SIZE)
+        cycle.append((pts, desc / np.linalg.norm(desc, axis=0)))
+    return cycle
+
+
+def setup_nms_fast(args, keypoints):
+    sp = superpoint()
+    rng = np.random.RandomState(0)
+    H, W = IMAGE_SIZE
+    # Distinct pixels, as the candidates above the confidence threshold of a heatmap
+    pixels = rng.choice(H * W, keypoints, replace=False)
+    corners = np.vstack((pixels % W, pixels // W, rng.rand(keypoints))).astype(float)
+
+    def run():
+        pts, _ = sp.SuperPointFrontend.nms_fast(None, corners, H, W, dist_thresh=args.nms_dist)
+        return {'kept': pts.shape[1]}
+    return run
+
+
+@functools.lru_cache(maxsize=None)
+def frontend():
+    sp = superpoint()
+    import frontends
+    return sp.SuperPointFrontend(weights_path=os.path.join(REPO, frontends.WEIGHTS_PATH), nms_dist=frontends.NMS_DIST,
+                                 conf_thresh=frontends.CONF_THRESH, nn_thresh=frontends.NN_THRESH, cuda=False)
+
+
+def setup_superpoint_run(args):
+    fe = frontend()
+    # Blocks of random gray levels with mild noise have corners everywhere, like a street scene
+    rng = np.random.RandomState(0)
+    H, W = IMAGE_SIZE
+    blocks = np.kron(rng.rand(H // 8 + 1, W // 8 + 1), np.ones((8, 8)))[:H, :W]
+    img = np.clip(blocks + 0.02 * rng.randn(H, W), 0., 1.).astype('float32')
+
+    def run():
+        pts, _, _ = fe.run(img)
+        return {'keypoints': pts.shape[1]}
+    return run
+
+
+def setup_nn_match_two_way(args, keypoints):
+    sp = superpoint()
+    tracker = sp.PointTracker(max_length=2, nn_thresh=args.nn_thresh)
+    (_, desc1), (_, desc2) = keypoint_sequence(keypoints)[:2]
+
+    def run():
+        return {'matches': tracker.nn_match_two_way(desc1, desc2, args.nn_thresh).shape[1]}
+    return run
+
+
+def setup_tracker_update(args, keypoints, frames):
+    sp = superpoint()
+    cycle = keypoint_sequence(keypoints)
+    # As in main.py, the tracker holds the whole sequence
+    tracker = sp.PointTracker(max_length=frames + 1, nn_thresh=args.nn_thresh)
+
+    def run():
+        for i in range(frames):
+            tracker.update(*cycle[i % len(cycle)])
+        return {'tracks': tracker.tracks.shape[0]}
+    return run
+
+
+def setup_get_vision_data(args, tracks, frames, keypoints=1000):
+    """ A tracker as left by frames updates in main.py, holding tracks tracks of LIFETIME frames """
+    sp = superpoint()
+    import main
+    rng = np.random.RandomState(0)
+    tracker = sp.PointTracker(max_length=frames + 1, nn_thresh=args.nn_thresh)
+    pts = np.vstack((rng.rand(2, keypoints) * np.array(IMAGE_SIZE[::-1])[:, None], rng.rand(keypoints)))
+    tracker.all_pts = [np.zeros((2, 0))] + [pts] * frames
+    offsets = tracker.get_offsets()
+
+    # Row of a track: id, score, then the point id in each of the frames + 1 stored images
+    tracker.tracks = -np.ones((tracks, frames + 3))
+    tracker.tracks[:, 0] = np.arange(tracks)
+    tracker.tracks[:, 1] = rng.rand(tracks)
+    first = rng.randint(0, max(frames - LIFETIME, 0) + 1, tracks)
+    for k in range(min(LIFETIME, frames)):
+        frame = first + k
+        tracker.tracks[np.arange(tracks), frame + 3] = offsets[frame + 1] + rng.randint(0, keypoints, tracks)
+
+    def run():
+        return {'observations': int(np.sum(main.get_vision_data(tracker)[:, :, 0] >= 0))}
+    return run
+
+
+@functools.lru_cache(maxsize=None)
+def drive_inputs(tracks, frames, n_skip):
+    """ Measurements, keypoint tracks and depth of a synthetic drive of frames frames and tracks landmarks """
+    drive = synthetic.load_scenario(*common.synthetic_drive(frames, tracks))
+    measurements = common.drive_measurements(drive, frames)
+    return measurements, drive.vision_data(n_skip, frames), drive.depth(frames)
+
+
+def keypoint_graph(args, tracks, frames):
+    """ Inputs of add_keypoints, and the IMU-only graph it adds to """
+    measurements, vision_data, depth = drive_inputs(tracks, frames, args.n_skip)
+    landmarks = landmark_selection.stride_tracks(vision_data, args.landmark_stride)
+    return imu_graph(measurements, args.n_skip), (vision_data, measurements[-1], args.n_skip, depth, None), landmarks
+
+
+def imu_graph(measurements, n_skip):
+    _, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = measurements
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip)
+    return graph
+
+
+def setup_add_imu_measurements(args, frames):
+    # The IMU factors do not depend on the landmarks: reuse the drive of the smallest track count
+    measurements, _, _ = drive_inputs(min(args.tracks), frames, args.n_skip)
+    _, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = measurements
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+
+    def run():
+        graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, args.n_skip)
+        return {'factors': graph.graph.size()}
+    return run
+
+
+def setup_add_keypoints(args, tracks, frames):
+    graph, inputs, landmarks = keypoint_graph(args, tracks, frames)
+
+    def run():
+        graph.add_keypoints(*inputs, tracks=landmarks)
+        return {'factors': graph.graph.size()}
+    return run
+
+
+def setup_estimate(args, tracks, frames):
+    graph, inputs, landmarks = keypoint_graph(args, tracks, frames)
+    graph.add_keypoints(*inputs, tracks=landmarks)
+    params = common.vio_solver_params(args.max_iterations)
+
+    def run():
+        graph.estimate(params)
+        return {'iterations': graph.optimizer.iterations()}
+    return run
+
+
+# Name, sizes it depends on, setup returning the function to time
+BENCHMARKS = (
+    ('nms_fast', ('keypoints',), setup_nms_fast),
+    ('superpoint_run', (), setup_superpoint_run),
+    ('nn_match_two_way', ('keypoints',), setup_nn_match_two_way),
+    ('tracker_update', ('keypoints', 'frames'), setup_tracker_update),
+    ('get_vision_data', ('tracks', 'frames'), setup_get_vision_data),
+    ('add_imu_measurements', ('frames',), setup_add_imu_measurements),
+    ('add_keypoints', ('tracks', 'frames'), setup_add_keypoints),
+    ('estimate', ('tracks', 'frames'), setup_estimate),
+)
+
+
+def cases(args):
+    """ (case name, benchmark setup, sizes) of every selected benchmark and combination of its sizes """
+    for name, dims, setup in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        for values in itertools.product(*(getattr(args, dim) for dim in dims)):
+            sizes = dict(zip(dims, values))
+            label = '%s[%s]' % (name, ','.join('%s=%d' % item for item in sizes.items())) if sizes else name
+            yield label, setup, sizes
+
+
+def measure(args, setup, sizes):
+    """ Time the function of a fresh setup args.repeat times. Returns the statistics and the function's output. """
+    times = []
+    for _ in range(args.repeat):
+        fn = setup(args, **sizes)
+        start = time.perf_counter()
+        info = fn()
+        times.append(time.perf_counter() - start)
+    return dict({'min_s': min(times), 'median_s': float(np.median(times))}, **info)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the pipeline functions with stored baselines.')
+    parser.add_argument('--keypoints', dest='keypoints', type=int, nargs='+', default=[250, 1000])
+    parser.add_argument('--tracks', dest='tracks', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--frames', dest='frames', type=int, nargs='+', default=[100, 300])
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    parser.add_argument('--landmark_stride', dest='landmark_stride', type=int, default=1)
+    parser.add_argument('--nms_dist', dest='nms_dist', type=int, default=4)
+    parser.add_argument('--nn_thresh', dest='nn_thresh', type=float, default=0.9)
+    parser.add_argument('--max_iterations', dest='max_iterations', type=int, default=20)
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3)
+    parser.add_argument('--only', dest='only', type=str, nargs='+', default=None,
+                        choices=[name for name, _, _ in BENCHMARKS])
+    parser.add_argument('--save', dest='save', type=str, default=None,
+                        help='Store the results as a baseline in this JSON file.')
+    parser.add_argument('--baseline', dest='baseline', type=str, default=BASELINE,
+                        help='Compare the results with the baseline of this JSON file, by default the committed '
+                             'benchmarks/baseline.json. An empty string skips the comparison.')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.2,
+                        help='Relative growth of the minimum time over the baseline that fails the comparison.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        print('==> Comparing with the baseline of %s, measured on %s' % (args.baseline, stored['machine']))
+
+    results = {}
+    regressions = []
+    print('%-48s %10s %12s %14s %9s' % ('case', 'min (ms)', 'median (ms)', 'baseline (ms)', 'change'))
+    for label, setup, sizes in cases(args):
+        stats = measure(args, setup, sizes)
+        results[label] = dict(sizes, **stats)
+        if label in baseline:
+            change = stats['min_s'] / baseline[label]['min_s'] - 1.
+            regressed = change > args.threshold
+            if regressed:
+                regressions.append(label)
+            print('%-48s %10.2f %12.2f %14.2f %+8.1f%%%s' % (label, 1.e3 * stats['min_s'], 1.e3 * stats['median_s'],
+                  1.e3 * baseline[label]['min_s'], 100. * change, ' REGRESSION' if regressed else ''))
+        else:
+            print('%-48s %10.2f %12.2f %14s %9s' % (label, 1.e3 * stats['min_s'], 1.e3 * stats['median_s'], '-', '-'))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(),
+                       'repeat': args.repeat, 'results': results}, f, indent=2)
+        print('==> Saved baseline to', args.save)
+
+    if regressions:
+        print('==> %d of %d cases regressed by more than %.0f%%' % (len(regressions), len(results), 100. * args.threshold))
+        sys.exit(1)
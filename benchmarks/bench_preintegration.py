@@ -0,0 +1,67 @@
+"""
+Preintegration throughput of the IMU factors at the 10 Hz frame rate against the 100 Hz IMU stream of a
+synthetic drive, and the position RMSE of the resulting IMU-only solve.
+
+Reports the time to slice the stream into keyframe intervals, the time spent building the IMU factors,
+the preintegrated samples per second and the time per keyframe.
+
+    python benchmarks/bench_preintegration.py --n_frames 2000 --n_skip 10
+"""
+
+import argparse
+import time
+
+import common
+import imu
+import synthetic
+import VisualInertialOdometry as vio
+
+
+def preintegrate(drive_id, n_frames, n_skip, high_rate):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+    n_keyframes = (n_frames - 1) // n_skip
+
+    imu_stream = None
+    slicing = 0.
+    samples = n_frames - 1
+    if high_rate:
+        imu_stream = drive.imu_stream()
+        start = time.perf_counter()
+        segments = imu.imu_segments(time_s[::n_skip], *imu_stream)
+        slicing = time.perf_counter() - start
+        samples = sum(dt.shape[0] for _, _, dt in segments)
+
+    start = time.perf_counter()
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip,
+                               imu_stream=imu_stream)
+    build = time.perf_counter() - start
+
+    result = graph.estimate(common.vio_solver_params())
+
+    return {
+        'samples': samples,
+        'slice_s': slicing,
+        'build_s': build,
+        'samples_per_s': samples / build,
+        'keyframe_us': 1.e6 * build / n_keyframes,
+        'rmse_m': common.translation_rmse(result, measured_poses, n_skip),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark IMU preintegration at the frame rate and at the IMU rate.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=2000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, 100)
+
+    print('%-8s %9s %9s %9s %12s %13s %8s' % ('IMU', 'samples', 'slice (s)', 'build (s)', 'samples/s',
+                                             'keyframe (us)', 'RMSE (m)'))
+    for high_rate in (False, True):
+        stats = preintegrate(drive_id, args.n_frames, args.n_skip, high_rate)
+        print('%-8s %9d %9.4f %9.3f %12.0f %13.1f %8.3f' % ('100 Hz' if high_rate else '10 Hz', stats['samples'],
+              stats['slice_s'], stats['build_s'], stats['samples_per_s'], stats['keyframe_us'], stats['rmse_m']))
@@ -0,0 +1,69 @@
+"""
+Explicit landmarks (one L(i) variable and one GenericProjectionFactor per observation) against one
+SmartProjectionPoseFactor per track, on the same tracks of a synthetic drive, from both initial estimates
+of src/main.py --init: the perturbed ground truth (the default) and IMU dead reckoning.
+
+Reports graph size, build and solve time, peak memory and the position RMSE of the keyframes. Smart factors
+triangulate their landmark from the initial poses, which the perturbed estimate puts meters off: main.py
+only accepts --smart_factors with --init imu.
+
+    python benchmarks/bench_smart_factors.py --n_frames 1000 --n_landmarks 10000 --n_skip 10
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import common
+import synthetic
+import VisualInertialOdometry as vio
+
+
+def solve(drive_id, n_frames, n_skip, smart, init):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    vision_data = drive.vision_data(n_skip, n_frames)
+    depth = drive.depth(n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+
+    start = time.perf_counter()
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    np.random.seed(0)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip,
+                               initialization=init)
+    # Like main.py, dead reckoning initializes the landmarks from the keyframe poses of the initial estimate
+    graph.add_keypoints(vision_data, None if init == 'imu' else measured_poses, n_skip, depth, None, smart=smart)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = graph.estimate(common.vio_solver_params())
+    solve = time.perf_counter() - start
+
+    return {
+        'variables': graph.initial_estimate.size(),
+        'factors': graph.graph.size(),
+        'build_s': build,
+        'solve_s': solve,
+        'iterations': graph.optimizer.iterations(),
+        'rmse_m': common.translation_rmse(result, measured_poses, n_skip),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark smart projection factors against explicit landmarks.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks)
+
+    print('%-10s %-10s %10s %8s %9s %9s %6s %9s %8s' % ('init', 'landmarks', 'variables', 'factors', 'build (s)',
+                                                        'solve (s)', 'iters', 'peak (MB)', 'RMSE (m)'))
+    for init in vio.INITIALIZATIONS:
+        for smart in (False, True):
+            stats, peak = common.run_isolated(solve, drive_id, args.n_frames, args.n_skip, smart, init)
+            print('%-10s %-10s %10d %8d %9.2f %9.2f %6d %9.1f %8.3f' % (init, 'smart' if smart else 'explicit',
+                  stats['variables'], stats['factors'], stats['build_s'], stats['solve_s'], stats['iterations'], peak,
+                  stats['rmse_m']))
@@ -0,0 +1,82 @@
+"""
+Solve phase of src/main.py: IMU-only and VIO graphs built separately and solved one after the other,
+against the VIO graph extending the IMU-only one, optionally warm started from the IMU-only solution or
+solved concurrently with it.
+
+Reports build and solve time of both graphs together, LM iterations of the VIO solve and the position
+RMSE of the VIO keyframes.
+
+    python benchmarks/bench_solve_phase.py --n_frames 1000 --n_landmarks 10000 --n_skip 10
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import common
+import synthetic
+import VisualInertialOdometry as vio
+
+MODES = ('separate', 'shared', 'warm_start', 'concurrent')
+
+
+def solve_phase(drive_id, n_frames, n_skip, mode):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    vision_data = drive.vision_data(n_skip, n_frames)
+    depth = drive.depth(n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+    imu_measurements = (measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip)
+
+    np.random.seed(0)
+    start = time.perf_counter()
+    imu_only = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    imu_only.add_imu_measurements(*imu_measurements)
+    if mode == 'separate':
+        np.random.seed(0)
+        vio_full = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+        vio_full.add_imu_measurements(*imu_measurements)
+    else:
+        vio_full = imu_only.copy()
+    vio_full.add_keypoints(vision_data, measured_poses, n_skip, depth, None)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == 'concurrent':
+        pending_imu = imu_only.estimate_in_process('estimate', common.imu_solver_params())
+        pending_full = vio_full.estimate_in_process('estimate', common.vio_solver_params())
+        pending_imu.get()
+        result = pending_full.get()
+        iterations = -1
+    else:
+        result_imu = imu_only.estimate(common.imu_solver_params())
+        if mode == 'warm_start':
+            vio_full.warm_start(result_imu)
+        result = vio_full.estimate(common.vio_solver_params())
+        iterations = vio_full.optimizer.iterations()
+    solve = time.perf_counter() - start
+
+    return {
+        'build_s': build,
+        'solve_s': solve,
+        'iterations': iterations,
+        'rmse_m': common.translation_rmse(result, measured_poses, n_skip),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the IMU-only and VIO solve phase of src/main.py.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks)
+
+    print('%-12s %9s %9s %9s %6s %8s' % ('mode', 'build (s)', 'solve (s)', 'total (s)', 'iters', 'RMSE (m)'))
+    for mode in MODES:
+        stats = solve_phase(drive_id, args.n_frames, args.n_skip, mode)
+        iterations = '-' if stats['iterations'] < 0 else str(stats['iterations'])
+        print('%-12s %9.2f %9.2f %9.2f %6s %8.3f' % (mode, stats['build_s'], stats['solve_s'],
+              stats['build_s'] + stats['solve_s'], iterations, stats['rmse_m']))
@@ -0,0 +1,70 @@
+"""
+Stereo matching of track heads (stereo.match_rows) on rendered rectified pairs: a smooth random texture
+seen at a depth growing from left to right across the image, warped into the partner camera with the KITTI
+gray baseline.
+
+Reports the matched fraction, the median and 95th percentile relative depth error and the matching time
+per frame for a number of heads per frame.
+
+    python benchmarks/bench_stereo.py --heads 50 200 1000 --radius 3
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+import common
+import stereo
+
+FX = 721.5
+BASELINE = 0.54
+
+
+def render_pair(rng, image_size=(375, 1242), min_depth=4., max_depth=70.):
+    """ Image of the right camera, its left partner and the depth of every pixel """
+    H, W = image_size
+    img = gaussian_filter(rng.random((H, W)), 1.5).astype(np.float32)
+    depth = np.tile(np.linspace(min_depth, max_depth, W), (H, 1))
+    # The partner sees pixel u at u + fx * baseline / depth
+    shifted = np.arange(W) + FX * BASELINE / depth[0]
+    other = np.array([np.interp(np.arange(W), shifted, row) for row in img], dtype=np.float32)
+    return img, other, depth
+
+
+def match(n_heads, radius, n_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    matched, errors, elapsed = 0, [], 0.
+    for _ in range(n_frames):
+        img, other, depth = render_pair(rng)
+        H, W = img.shape
+        uv = np.stack((rng.integers(0, W, n_heads), rng.integers(0, H, n_heads)), axis=1)
+        start = time.perf_counter()
+        z, _ = stereo.match_rows(img, other, uv, BASELINE, FX, radius=radius)
+        elapsed += time.perf_counter() - start
+        ok = z > 0
+        matched += int(ok.sum())
+        true = depth[uv[ok, 1], uv[ok, 0]]
+        errors.append(np.abs(z[ok] - true) / true)
+    errors = np.concatenate(errors)
+    return {
+        'matched': matched / float(n_heads * n_frames),
+        'median_error': float(np.median(errors)),
+        'p95_error': float(np.percentile(errors, 95)),
+        'ms_per_frame': 1000. * elapsed / n_frames,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark stereo matching of track heads.')
+    parser.add_argument('--heads', dest='heads', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--radius', dest='radius', type=int, default=3)
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%8s %8s %12s %10s %8s' % ('heads', 'matched', 'median err', 'p95 err', 'ms/frame'))
+    for n_heads in args.heads:
+        stats = match(n_heads, args.radius, args.n_frames)
+        print('%8d %7.1f%% %11.2f%% %9.2f%% %8.1f' % (n_heads, 100 * stats['matched'], 100 * stats['median_error'],
+              100 * stats['p95_error'], stats['ms_per_frame']))
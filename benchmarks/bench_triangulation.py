@@ -0,0 +1,83 @@
+"""
+Landmark initialization on a synthetic drive with sparse depth: the depth at the first observation with a
+valid depth pixel, multi-view triangulation falling back to the depth, and triangulation only.
+
+Reports the landmarks initialized, the median and 95th percentile error of their initial positions
+against the true landmarks, and the LM iterations, solve time and ATE of the VIO solve within a fixed
+iteration budget.
+
+    python benchmarks/bench_triangulation.py --n_frames 1000 --n_landmarks 10000 --depth_ratio 0.3
+"""
+
+import argparse
+import time
+
+import numpy as np
+import gtsam
+from gtsam.symbol_shorthand import L
+
+import common
+import evaluation
+import synthetic
+import trajectory
+import VisualInertialOdometry as vio
+
+CONFIGURATIONS = (('depth', True, False), ('triangulate + depth', True, True), ('triangulate', False, True))
+
+
+def solve(drive_id, n_frames, n_skip, use_depth, triangulate, max_iterations):
+    drive = synthetic.load_scenario(*drive_id)
+    time_s, delta_t, measured_vel, measured_acc, measured_omega, measured_poses = common.drive_measurements(drive, n_frames)
+    IMU_PARAMS, BIAS_COVARIANCE = common.imu_params()
+
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
+    graph.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip)
+    start = time.perf_counter()
+    graph.add_keypoints(drive.vision_data(n_skip, n_frames), measured_poses, n_skip,
+                        drive.depth(n_frames) if use_depth else None, None, triangulate=triangulate)
+    build = time.perf_counter() - start
+
+    # Rows of vision_data are the landmarks observed in the keyframes, in increasing order
+    keep = (drive.obs_frame < n_frames) & (drive.obs_frame % n_skip == 0)
+    track_landmark = np.unique(drive.obs_landmark[keep])
+    world = np.linalg.inv(drive.poses[0])
+    truth = drive.landmarks @ world[:3, :3].T + world[:3, 3]
+    keys = [key for key in graph.initial_estimate.keys() if gtsam.symbolChr(key) == ord('l')]
+    index = np.array([gtsam.symbolIndex(key) for key in keys], dtype=int)
+    initial = np.array([graph.initial_estimate.atPoint3(L(i)) for i in index])
+    errors = np.linalg.norm(initial - truth[track_landmark[index]], axis=1)
+
+    start = time.perf_counter()
+    result = graph.estimate(common.vio_solver_params(max_iterations))
+    solve = time.perf_counter() - start
+
+    traj = trajectory.Trajectory.from_values(result)
+    return {
+        'landmarks': index.shape[0],
+        'median_error_m': float(np.median(errors)),
+        'p95_error_m': float(np.percentile(errors, 95)),
+        'build_s': build,
+        'iterations': graph.optimizer.iterations(),
+        'solve_s': solve,
+        'ate_m': evaluation.ate(traj.poses, measured_poses[::n_skip][traj.index], 'se3')['rmse'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark depth and triangulation landmark initialization.')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=10000)
+    parser.add_argument('--n_skip', dest='n_skip', type=int, default=10)
+    parser.add_argument('--depth_ratio', dest='depth_ratio', type=float, default=0.3)
+    parser.add_argument('--max_iterations', dest='max_iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    drive_id = common.synthetic_drive(args.n_frames, args.n_landmarks, depth_ratio=args.depth_ratio)
+
+    print('%-20s %9s %10s %10s %9s %6s %9s %8s' % ('initialization', 'landmarks', 'median (m)', 'p95 (m)',
+                                                  'build (s)', 'iters', 'solve (s)', 'ATE (m)'))
+    for name, use_depth, triangulate in CONFIGURATIONS:
+        stats = solve(drive_id, args.n_frames, args.n_skip, use_depth, triangulate, args.max_iterations)
+        print('%-20s %9d %10.3f %10.3f %9.2f %6d %9.2f %8.3f' % (name, stats['landmarks'], stats['median_error_m'],
+              stats['p95_error_m'], stats['build_s'], stats['iterations'], stats['solve_s'], stats['ate_m']))
@@ -0,0 +1,103 @@
+"""
+Shared setup of the benchmarks: import path to src/, the IMU and solver parameters of src/main.py,
+synthetic drives and peak-memory measurement in a fresh process.
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import gtsam
+from gtsam.symbol_shorthand import X
+
+import synthetic
+
+DATE = '2011_09_26'
+
+
+def imu_params():
+    """ IMU preintegration parameters and bias covariance of src/main.py """
+    g = 9.81
+    IMU_PARAMS = gtsam.PreintegrationParams.MakeSharedU(g)
+    I = np.eye(3)
+    IMU_PARAMS.setAccelerometerCovariance(I * 0.2)
+    IMU_PARAMS.setGyroscopeCovariance(I * 0.2)
+    IMU_PARAMS.setIntegrationCovariance(I * 0.2)
+    BIAS_COVARIANCE = gtsam.noiseModel.Isotropic.Variance(6, 0.4)
+    return IMU_PARAMS, BIAS_COVARIANCE
+
+
+def imu_solver_params(max_iterations=1000):
+    """ Levenberg-Marquardt parameters of the IMU-only solve in src/main.py, without verbose output """
+    params = gtsam.LevenbergMarquardtParams()
+    params.setMaxIterations(max_iterations)
+    return params
+
+
+def vio_solver_params(max_iterations=1000):
+    """ Levenberg-Marquardt parameters of the VIO solve in src/main.py, without verbose output """
+    params = gtsam.LevenbergMarquardtParams()
+    params.setMaxIterations(max_iterations)
+    params.setlambdaUpperBound(1.e+6)
+    params.setlambdaLowerBound(0.1)
+    params.setDiagonalDamping(1000)
+    params.setRelativeErrorTol(1.e-9)
+    params.setAbsoluteErrorTol(1.e-9)
+    return params
+
+
+def synthetic_drive(n_frames, n_landmarks, seed=0, basedir=None, outlier_ratio=0., **kwargs):
+    """ Generate a synthetic drive once and return its (basedir, date, drive) for synthetic.load_scenario. """
+    if basedir is None:
+        basedir = os.path.join(tempfile.gettempdir(), 'superpoint-gtsam-vio-bench')
+    # The outlier ratio is always in the name: drives cached before its default became 0 have outliers
+    drive = '%d_%d_%d_outlier_ratio%s' % (n_frames, n_landmarks, seed, outlier_ratio)
+    drive += ''.join('_%s%s' % (k, v) for k, v in sorted(kwargs.items()))
+    if not os.path.exists(synthetic.scenario_path(basedir, DATE, drive)):
+        scenario = synthetic.generate_scenario(n_frames=n_frames, n_landmarks=n_landmarks, seed=seed,
+                                               outlier_ratio=outlier_ratio, **kwargs)
+        synthetic.save_scenario(synthetic.scenario_path(basedir, DATE, drive), scenario)
+    return basedir, DATE, drive
+
+
+def drive_measurements(drive, n_frames=None):
+    """ The arrays main.py derives from a drive: time, delta_t, velocity, acceleration, angular velocity, poses """
+    if n_frames is None:
+        n_frames = drive.time.shape[0]
+    time = drive.time[:n_frames]
+    measured_poses = np.linalg.inv(drive.poses[0]) @ drive.poses[:n_frames]
+    return (time, np.diff(time), drive.vel[:n_frames], drive.acc[:n_frames], drive.omega[:n_frames],
+            measured_poses)
+
+
+def translation_rmse(result, measured_poses, n_skip):
+    """ RMS position error of the keyframe poses in result against the ground truth, in meters """
+    n_keyframes = (measured_poses.shape[0] - 1) // n_skip + 1
+    est = np.array([result.atPose3(X(k)).translation() for k in range(n_keyframes)])
+    return float(np.sqrt(np.mean(np.sum((est - measured_poses[::n_skip, :3, 3]) ** 2, axis=1))))
+
+
+def _isolated(fn, args, queue):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = fn(*args)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((result, (peak - baseline) / 1024.))
+
+
+def run_isolated(fn, *args):
+    """
+    Run fn(*args) in a freshly spawned process and return its result together with the growth of the
+    peak resident memory in MB while it ran, which includes GTSAM's native allocations.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_isolated, args=(fn, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
@@ -1,5 +1,37 @@
-import wget
+"""
+Download KITTI raw drives, their calibration and the annotated depth maps into the layout src/main.py
+expects:
+
+    <out>/<date>/calib_*.txt
+    <out>/<date>/<date>_drive_<drive>_sync/{image_0x,oxts,velodyne_points}
+    <out>/<date>/<date>_drive_<drive>_sync/proj_depth/groundtruth/image_0x
+
+Archives are fetched by a pool of workers and extracted while they stream in, so no archive has to be
+fully on disk before extraction starts. The bytes received are kept in <name>.part next to the output so
+an interrupted download resumes with an HTTP range request. Each zip member is checked against its CRC32
+and the whole archive against the sha256 or md5 of the manifest, when given.
+
+Example:
+    python download_kitti_raw.py --out ~/datasets/kitti --files 2011_09_26_calib.zip 2011_09_26_drive_0022 --depth --workers 4
+
+The base URL and the manifest (a JSON list of {"name", "path", "layout", ["sha256" | "md5"]}) are
+configurable, e.g. to test against a local HTTP server.
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
 import os
+import shutil
+import struct
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BASE_URL = 'https://s3.eu-central-1.amazonaws.com/avg-kitti'
+CHUNK_SIZE = 1 << 20
 
 # files_name = ["2011_09_26_calib.zip",
 # "2011_09_26_drive_0001",
@@ -164,22 +196,269 @@ import os
 # "2011_10_03_drive_0058"]
 
 # download the calibration and raw data
-files_name = ["2011_09_26_calib.zip", "2011_09_26_drive_0022"]
+FILES_NAME = ["2011_09_26_calib.zip", "2011_09_26_drive_0022"]
 
-for file_name in files_name:
-    if file_name.endswith('.zip'):
-        short_name = file_name
-        full_name = file_name
-    else:
-        short_name = file_name + '_sync.zip'
-        full_name = file_name + '/' + file_name + '_sync.zip'
 
-    url = 'https://s3.eu-central-1.amazonaws.com/avg-kitti/raw_data/' + full_name
-    print("Downloading: " + short_name)
+def build_manifest(files_name, depth=False):
+    """ Manifest entries of the calibration/raw archives in files_name and optionally the annotated depth maps. """
+    manifest = []
+    for file_name in files_name:
+        if file_name.endswith('.zip'):
+            short_name = file_name
+            full_name = file_name
+        else:
+            short_name = file_name + '_sync.zip'
+            full_name = file_name + '/' + file_name + '_sync.zip'
+        manifest.append({'name': short_name, 'path': 'raw_data/' + full_name, 'layout': 'raw'})
+
+    if depth:
+        manifest.append({'name': 'data_depth_annotated.zip', 'path': 'data_depth_annotated.zip', 'layout': 'depth'})
+    return manifest
+
+
+def member_target(out_dir, layout, drives=None):
+    """
+    Map a zip member name to its output path, or None to skip it.
+
+    Raw and calibration archives already start with the date folder. The annotated depth archive is laid
+    out as {train,val}/<date>_drive_<drive>_sync/proj_depth/..., which is moved under the date folder;
+    when drives is given only the depth maps of those drives are extracted.
+    """
+    def target(name):
+        if name.endswith('/'):
+            return None
+        parts = name.split('/')
+        if layout == 'depth':
+            if len(parts) < 3 or (drives is not None and parts[1][:-len('_sync')] not in drives):
+                return None
+            parts = [parts[1][:10]] + parts[1:]
+        return os.path.join(out_dir, *parts)
+    return target
+
+
+class StreamingZipExtractor(object):
+    """
+    Extract a zip archive from consecutive chunks of its bytes, using the local file headers instead of
+    the central directory at the end of the file. Supports stored and deflated members, with or without
+    data descriptors, and checks the CRC32 of every member.
+    """
+    LOCAL_HEADER = 0x04034b50
+    DATA_DESCRIPTOR = 0x08074b50
+
+    def __init__(self, target):
+        self.target = target
+        self.buffer = b''
+        self.state = 'header'
+        self.n_members = 0
+
+    def feed(self, data):
+        self.buffer += data
+        while self.buffer and self.state != 'done':
+            if self.state == 'header' and not self._read_header():
+                return
+            if self.state == 'data' and not self._read_data():
+                return
+            if self.state == 'descriptor' and not self._read_descriptor():
+                return
+
+    def close(self):
+        if self.state != 'done':
+            raise IOError('Truncated zip archive')
+
+    def _read_header(self):
+        if len(self.buffer) < 4:
+            return False
+        signature, = struct.unpack('<I', self.buffer[:4])
+        if signature != self.LOCAL_HEADER:
+            # Central directory: all members have been read.
+            self.state = 'done'
+            self.buffer = b''
+            return False
+        if len(self.buffer) < 30:
+            return False
+        (_, _, self.flags, self.method, _, _, self.crc, self.remaining, _,
+         name_length, extra_length) = struct.unpack('<IHHHHHIIIHH', self.buffer[:30])
+        if len(self.buffer) < 30 + name_length + extra_length:
+            return False
+        name = self.buffer[30:30 + name_length].decode('utf-8' if self.flags & 0x800 else 'cp437')
+        extra = self.buffer[30 + name_length:30 + name_length + extra_length]
+        self.buffer = self.buffer[30 + name_length + extra_length:]
+
+        # Data descriptors hold 8 byte sizes when the member has a zip64 extra field.
+        self.zip64 = False
+        while len(extra) >= 4:
+            header_id, size = struct.unpack('<HH', extra[:4])
+            self.zip64 = self.zip64 or header_id == 0x0001
+            extra = extra[4 + size:]
+        if self.method == 8:
+            self.decompressor = zlib.decompressobj(-15)
+        elif self.method != 0:
+            raise IOError('Unsupported compression method %d for %s' % (self.method, name))
+        elif self.flags & 0x8:
+            raise IOError('Cannot stream stored member %s with a data descriptor' % name)
+
+        path = self.target(name)
+        self.out = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.out = open(path, 'wb')
+        self.name = name
+        self.member_crc = 0
+        self.state = 'data'
+        return True
+
+    def _write(self, data):
+        self.member_crc = zlib.crc32(data, self.member_crc)
+        if self.out is not None:
+            self.out.write(data)
+
+    def _read_data(self):
+        if self.method == 8:
+            self._write(self.decompressor.decompress(self.buffer))
+            if not self.decompressor.eof:
+                self.buffer = b''
+                return False
+            self.buffer = self.decompressor.unused_data
+        else:
+            n = min(self.remaining, len(self.buffer))
+            self._write(self.buffer[:n])
+            self.buffer = self.buffer[n:]
+            self.remaining -= n
+            if self.remaining > 0:
+                return False
+
+        if self.flags & 0x8:
+            self.state = 'descriptor'
+        else:
+            self._finish_member()
+        return True
+
+    def _read_descriptor(self):
+        size = 20 if self.zip64 else 12
+        if len(self.buffer) < size + 4:
+            return False
+        if struct.unpack('<I', self.buffer[:4])[0] == self.DATA_DESCRIPTOR:
+            self.buffer = self.buffer[4:]
+        self.crc, = struct.unpack('<I', self.buffer[:4])
+        self.buffer = self.buffer[size:]
+        self._finish_member()
+        return True
+
+    def _finish_member(self):
+        if self.out is not None:
+            self.out.close()
+        if self.member_crc != self.crc:
+            raise IOError('CRC mismatch for %s' % self.name)
+        self.n_members += 1
+        self.state = 'header'
+
+
+def download(entry, base_url, out_dir, drives=None, keep_archive=False, retries=3):
+    """
+    Download one manifest entry, extracting it on the fly. Resumes from <name>.part if present and
+    retries interrupted transfers from where they stopped.
+    """
+    part = os.path.join(out_dir, entry['name'] + '.part')
+    done = os.path.join(out_dir, entry['name'] + '.done')
+    if os.path.exists(done):
+        print('Already downloaded: ' + entry['name'])
+        return entry['name']
+
+    url = base_url.rstrip('/') + '/' + entry['path']
+    algorithm = 'md5' if 'md5' in entry else 'sha256'
+    hasher = hashlib.new(algorithm)
+    extractor = StreamingZipExtractor(member_target(out_dir, entry.get('layout', 'raw'), drives))
+
+    # Replay the bytes received by an earlier run through the checksum and the extractor.
+    offset = 0
+    if os.path.exists(part):
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                extractor.feed(chunk)
+                offset += len(chunk)
+        print('Resuming: ' + entry['name'] + ' at %d bytes' % offset)
+
+    print('Downloading: ' + entry['name'])
     print('url: ' + url)
-    wget.download(url, out=short_name)
+    for attempt in range(retries + 1):
+        headers = {'Range': 'bytes=%d-' % offset} if offset > 0 else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+                if offset > 0 and response.status != 206:
+                    # The server ignored the range request, start over.
+                    offset = 0
+                    hasher = hashlib.new(algorithm)
+                    extractor = StreamingZipExtractor(extractor.target)
+                with open(part, 'ab' if offset > 0 else 'wb') as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        extractor.feed(chunk)
+                        offset += len(chunk)
+                # http.client ends a body cut off before its Content-Length like a complete one
+                if response.length:
+                    raise http.client.IncompleteRead(b'', response.length)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset > 0:
+                # Nothing left to fetch, the part file is complete.
+                break
+            raise
+        except (urllib.error.URLError, http.client.IncompleteRead, ConnectionError, TimeoutError) as e:
+            if attempt == retries:
+                raise
+            print('Retrying ' + entry['name'] + ' after error: ' + str(e))
+
+    extractor.close()
+    digest = hasher.hexdigest()
+    if algorithm in entry and entry[algorithm] != digest:
+        os.remove(part)
+        raise IOError('%s checksum mismatch for %s: expected %s, got %s'
+                      % (algorithm, entry['name'], entry[algorithm], digest))
+
+    if keep_archive:
+        shutil.move(part, os.path.join(out_dir, entry['name']))
+    else:
+        os.remove(part)
+    with open(done, 'w') as f:
+        f.write(algorithm + ' ' + digest + '\n')
+    print('Extracted %d files from %s (%s %s)' % (extractor.n_members, entry['name'], algorithm, digest))
+    return entry['name']
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download KITTI raw data and annotated depth maps.')
+    parser.add_argument('--out', dest='out', type=str, default='.')
+    parser.add_argument('--files', dest='files', type=str, nargs='+', default=FILES_NAME,
+                        help='Calibration archives and drives to download (see the list above).')
+    parser.add_argument('--depth', dest='depth', action='store_true',
+                        help='Also download the annotated depth maps of the selected drives.')
+    parser.add_argument('--manifest', dest='manifest', type=str, default=None,
+                        help='JSON manifest to use instead of --files/--depth.')
+    parser.add_argument('--base_url', dest='base_url', type=str, default=BASE_URL)
+    parser.add_argument('--workers', dest='workers', type=int, default=4)
+    parser.add_argument('--retries', dest='retries', type=int, default=3)
+    parser.add_argument('--keep_archives', dest='keep_archives', action='store_true')
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    else:
+        manifest = build_manifest(args.files, args.depth)
+    drives = [e['name'][:-len('_sync.zip')] for e in manifest if e['name'].endswith('_sync.zip')]
 
-# download the annotated depth map
-url = 'https://s3.eu-central-1.amazonaws.com/avg-kitti/data_depth_annotated.zip'
-wget.download(url, out=short_name)
+    os.makedirs(args.out, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(download, entry, args.base_url, args.out, drives or None,
+                               args.keep_archives, args.retries) for entry in manifest]
+        failed = []
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print('Failed: ' + str(e))
+                failed.append(e)
+    if failed:
+        raise SystemExit('%d of %d downloads failed' % (len(failed), len(manifest)))
@@ -13,11 +13,114 @@ import numpy as np
 import gtsam
 from gtsam.symbol_shorthand import B, V, X, L
 import matplotlib.pyplot as plt
+import landmark_selection
+import keyframe_selection
+import calibration
+import imu
+import reprojection
+import triangulation
+import trajectory
+import multiprocessing
+import os
+from collections import defaultdict
+try:
+    from gtsam import IncrementalFixedLagSmoother, FixedLagSmootherKeyTimestampMap
+    def timestamp_entry(key, timestamp):
+        return (key, timestamp)
+except ImportError:
+    # GTSAM 4.1 ships the fixed-lag smoothers in gtsam_unstable
+    from gtsam_unstable import IncrementalFixedLagSmoother, FixedLagSmootherKeyTimestampMap
+    from gtsam_unstable import FixedLagSmootherKeyTimestampMapValue as timestamp_entry
 np.random.seed(0)
 
+# Linear solvers of the Gauss-Newton steps, see gtsam.NonlinearOptimizerParams
+LINEAR_SOLVERS = {
+    'multifrontal_cholesky': 'MULTIFRONTAL_CHOLESKY',
+    'multifrontal_qr': 'MULTIFRONTAL_QR',
+    'sequential_cholesky': 'SEQUENTIAL_CHOLESKY',
+    'sequential_qr': 'SEQUENTIAL_QR',
+    'pcg': 'ITERATIVE',
+}
+ORDERINGS = ('colamd', 'metis', 'natural', 'landmarks_first')
+INITIALIZATIONS = ('perturbed', 'imu')
+
+def kitti_camera_calibration():
+    """
+    Fallback calibration for the 2011_09_26 recordings when no calibration files are given: the K_01
+    intrinsics with the camera 0 extrinsics. Returns (K_np, imu_to_cam) as 3x3 and 4x4 numpy arrays,
+    imu_to_cam being the pose of the camera in the IMU frame. See calibration.load_calibration.
+    """
+    R_rect = np.array([[9.999239e-01, 9.837760e-03, -7.445048e-03, 0.],
+                       [ -9.869795e-03, 9.999421e-01, -4.278459e-03, 0.],
+                       [ 7.402527e-03, 4.351614e-03, 9.999631e-01, 0.],
+                       [ 0., 0., 0., 1.]])
+    R_cam_velo = np.array([[7.533745e-03, -9.999714e-01, -6.166020e-04],
+                           [ 1.480249e-02, 7.280733e-04, -9.998902e-01],
+                           [ 9.998621e-01, 7.523790e-03, 1.480755e-02]])
+    R_velo_imu = np.array([[9.999976e-01, 7.553071e-04, -2.035826e-03],
+                           [-7.854027e-04, 9.998898e-01, -1.482298e-02],
+                           [2.024406e-03, 1.482454e-02, 9.998881e-01]])
+    t_cam_velo = np.array([-4.069766e-03, -7.631618e-02, -2.717806e-01])
+    t_velo_imu = np.array([-8.086759e-01, 3.195559e-01, -7.997231e-01])
+    T_velo_imu = np.zeros((4,4))
+    T_cam_velo = np.zeros((4,4))
+    T_velo_imu[3,3] = 1.
+    T_cam_velo[3,3] = 1.
+    T_velo_imu[:3,:3] = R_velo_imu
+    T_velo_imu[:3,3] = t_velo_imu
+    T_cam_velo[:3,:3] = R_cam_velo
+    T_cam_velo[:3,3] = t_cam_velo
+    cam_to_imu = R_rect @ T_cam_velo @ T_velo_imu
+    imu_to_cam = np.linalg.inv(cam_to_imu)
+
+    K_np = np.array([[9.895267e+02, 0.000000e+00, 7.020000e+02], 
+                     [0.000000e+00, 9.878386e+02, 2.455590e+02], 
+                     [0.000000e+00, 0.000000e+00, 1.000000e+00]]) 
+
+    return K_np, imu_to_cam
+
+def value_at(values, key):
+    """ Typed access to the value of a pose (x), velocity (v), bias (b) or landmark (l) key. """
+    chr = gtsam.symbolChr(key)
+    if chr == ord('x'):
+        return values.atPose3(key)
+    elif chr == ord('v'):
+        return values.atVector(key)
+    elif chr == ord('b'):
+        return values.atConstantBias(key)
+    return values.atPoint3(key)
+
+def _estimate_child(graph, method, args, kwargs, sender):
+    try:
+        sender.send((True, getattr(graph, method)(*args, **kwargs).serialize()))
+    except Exception as e:
+        sender.send((False, '%s: %s' % (type(e).__name__, e)))
+    sender.close()
+
+
+class PendingEstimate(object):
+    """ Result of VisualInertialOdometryGraph.estimate_in_process """
+
+    def __init__(self, graph, process, receiver):
+        self.graph = graph
+        self.process = process
+        self.receiver = receiver
+
+    def get(self):
+        try:
+            ok, payload = self.receiver.recv()
+        except EOFError:
+            ok, payload = False, 'solver process exited with code %s' % self.process.exitcode
+        self.process.join()
+        if not ok:
+            raise RuntimeError(payload)
+        self.graph.result = gtsam.Values()
+        self.graph.result.deserialize(payload)
+        return self.graph.result
+
 class VisualInertialOdometryGraph(object):
     
-    def __init__(self, IMU_PARAMS=None, BIAS_COVARIANCE=None):
+    def __init__(self, IMU_PARAMS=None, BIAS_COVARIANCE=None, CALIBRATION=None):
         """
         Define factor graph parameters (e.g. noise, camera calibrations, etc) here
         """
@@ -25,8 +128,137 @@ class VisualInertialOdometryGraph(object):
         self.initial_estimate = gtsam.Values()
         self.IMU_PARAMS = IMU_PARAMS
         self.BIAS_COVARIANCE = BIAS_COVARIANCE
+        if CALIBRATION is None:
+            CALIBRATION = calibration.CameraCalibration(*kitti_camera_calibration())
+        self.CALIBRATION = CALIBRATION
+        self.arrays = {}
+        # Per-keyframe stream of the graph for estimate_fixed_lag, in place of self.graph
+        self.updates = None
+
+    def copy(self):
+        """
+        A graph with the same parameters, factors and initial estimate, to extend independently. The
+        factors themselves are shared, e.g. to add the keypoints to the IMU factors of an IMU-only graph
+        without building them again.
+        """
+        other = VisualInertialOdometryGraph(self.IMU_PARAMS, self.BIAS_COVARIANCE, self.CALIBRATION)
+        other.graph = gtsam.NonlinearFactorGraph(self.graph)
+        other.initial_estimate = gtsam.Values(self.initial_estimate)
+        other.updates = self.updates
+        return other
+
+    def save(self, path, **arrays):
+        """
+        Save the graph, the initial estimate and the camera calibration to a compressed npz file, together
+        with any numpy arrays given, e.g. the ground truth for evaluating the solve. The factors and values
+        are stored in GTSAM's serialization format.
+        """
+        for name in ('graph', 'initial_estimate', 'K_np', 'imu_to_cam', 'image_size'):
+            if name in arrays:
+                raise ValueError('%s is a reserved array name' % name)
+        image_size = self.CALIBRATION.image_size
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f,
+                                graph=np.frombuffer(self.graph.serialize().encode(), dtype=np.uint8),
+                                initial_estimate=np.frombuffer(self.initial_estimate.serialize().encode(), dtype=np.uint8),
+                                K_np=self.CALIBRATION.K_np, imu_to_cam=self.CALIBRATION.imu_to_cam,
+                                image_size=np.array(image_size if image_size is not None else []),
+                                **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a graph written by save, ready to be solved. The extra arrays are in the arrays dict of the
+        graph. IMU parameters are not saved, so no IMU measurements can be added to it.
+        """
+        with np.load(path) as data:
+            image_size = data['image_size'] if data['image_size'].size > 0 else None
+            other = cls(CALIBRATION=calibration.CameraCalibration(data['K_np'], data['imu_to_cam'], image_size))
+            other.graph.deserialize(data['graph'].tobytes().decode())
+            other.initial_estimate.deserialize(data['initial_estimate'].tobytes().decode())
+            other.arrays = {name: data[name] for name in data.files
+                            if name not in ('graph', 'initial_estimate', 'K_np', 'imu_to_cam', 'image_size')}
+        return other
+
+    def initial_states(self):
+        """ The initial estimate of the X/V/B keys, built from self.updates() when the graph is streamed """
+        if self.updates is None:
+            return self.initial_estimate
+        states = gtsam.Values()
+        for _, _, values in self.updates():
+            for key in values.keys():
+                if gtsam.symbolChr(key) != ord('l'):
+                    states.insert(key, value_at(values, key))
+        return states
+
+    def warm_start(self, values, landmarks=False):
+        """
+        Replace the initial estimate of the X/V/B keys found in values, e.g. the IMU-only solution. With
+        landmarks the L keys are replaced too, e.g. from the solution of the same graph with other solver
+        settings.
+        """
+        update = gtsam.Values()
+        for key in values.keys():
+            if (landmarks or gtsam.symbolChr(key) != ord('l')) and self.initial_estimate.exists(key):
+                update.insert(key, value_at(values, key))
+        self.initial_estimate.update(update)
+
+    def release_solver(self):
+        """ Drop the optimizer, iSAM2 or smoother state of the last solve, keeping its result """
+        for name in ('optimizer', 'isam', 'smoother'):
+            if hasattr(self, name):
+                setattr(self, name, None)
+
+    def estimate_in_process(self, method='estimate', *args, **kwargs):
+        """
+        Run one of the estimate methods in a forked process, which inherits the graph without copying it.
+        Returns a PendingEstimate whose get() waits for the result and stores it in self.result; the
+        optimizer state of the solve stays in the child process.
+        """
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        # Daemonic, so that a failed solve does not leave the other ones blocking the exit
+        process = context.Process(target=_estimate_child, args=(self, method, args, kwargs, sender), daemon=True)
+        process.start()
+        sender.close()
+        return PendingEstimate(self, process, receiver)
 
-    def add_imu_measurements(self, measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip, initial_poses=None):
+    def add_imu_measurements(self, measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip, initial_poses=None, imu_stream=None,
+                             initialization='perturbed', measured_velocity=True):
+        """
+        Add IMU factors between every n_skip-th frame, or between the frames of the array n_skip, e.g. from
+        keyframe_selection.select_keyframes, which must start with frame 0. By default one measurement per
+        frame is integrated.
+        imu_stream = (times, acc, omega) integrates a higher rate stream instead, e.g. the 100 Hz OXTS
+        data, with times in seconds relative to the first frame.
+
+        initialization selects the initial estimate of the keyframe states:
+          'perturbed' - ground truth poses composed with a random offset, for experiments only.
+          'imu' - dead reckoning: the state at the prior is propagated through the preintegrated
+                  measurements of each IMU factor with zero bias. Only the first measured pose is used.
+                  With measured_velocity the propagated velocity is replaced at every keyframe by the
+                  measured body velocity (OXTS vf, vl, vu) rotated into the world frame, which keeps the
+                  position drift linear instead of quadratic.
+
+        imu_updates yields the same factors and values one keyframe at a time.
+        """
+        for _, factors, values in self.imu_updates(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip,
+                                                   imu_stream, initialization, measured_velocity):
+            self.graph.push_back(factors)
+            self.initial_estimate.insert(values)
+
+    def imu_updates(self, measured_poses, measured_acc, measured_omega, measured_vel, delta_t, n_skip, imu_stream=None,
+                    initialization='perturbed', measured_velocity=True, random=np.random):
+        """
+        The factors and values of add_imu_measurements one keyframe at a time, as (keyframe index,
+        gtsam.NonlinearFactorGraph, gtsam.Values): the priors with the first states, then the IMU and bias
+        factors ending at each keyframe with its states. random draws the offsets of the perturbed
+        initialization, e.g. a np.random.RandomState to draw the same ones for another graph.
+        """
+        if initialization not in INITIALIZATIONS:
+            raise ValueError('Unknown initialization %s, expected one of %s' % (initialization, ', '.join(INITIALIZATIONS)))
 
         n_frames = measured_poses.shape[0]
 
@@ -35,132 +267,551 @@ class VisualInertialOdometryGraph(object):
         assert measured_acc.shape[0] == n_frames
         assert measured_vel.shape[0] == n_frames
 
+        factors = gtsam.NonlinearFactorGraph()
+        values = gtsam.Values()
+
         # Pose prior
         pose_key = X(0)
         pose_noise = gtsam.noiseModel.Diagonal.Sigmas(np.array([0.2, 0.2, 0.2, 0.2, 0.2, 0.2]))
         pose_0 = gtsam.Pose3(measured_poses[0])
-        self.graph.push_back(gtsam.PriorFactorPose3(pose_key, pose_0, pose_noise))
+        factors.push_back(gtsam.PriorFactorPose3(pose_key, pose_0, pose_noise))
 
-        self.initial_estimate.insert(pose_key, gtsam.Pose3(measured_poses[0]))
+        values.insert(pose_key, gtsam.Pose3(measured_poses[0]))
 
         # IMU prior
         bias_key = B(0)
         bias_noise = gtsam.noiseModel.Isotropic.Sigma(6, 0.5)
-        self.graph.push_back(gtsam.PriorFactorConstantBias(bias_key, gtsam.imuBias.ConstantBias(), bias_noise))
+        factors.push_back(gtsam.PriorFactorConstantBias(bias_key, gtsam.imuBias.ConstantBias(), bias_noise))
 
-        self.initial_estimate.insert(bias_key, gtsam.imuBias.ConstantBias())
+        values.insert(bias_key, gtsam.imuBias.ConstantBias())
 
         # Velocity prior
         velocity_key = V(0)
         velocity_noise = gtsam.noiseModel.Isotropic.Sigma(3, .5)
         velocity_0 = measured_vel[0]
-        self.graph.push_back(gtsam.PriorFactorVector(velocity_key, velocity_0, velocity_noise))
+        factors.push_back(gtsam.PriorFactorVector(velocity_key, velocity_0, velocity_noise))
 
-        self.initial_estimate.insert(velocity_key, velocity_0)
+        values.insert(velocity_key, velocity_0)
+        yield 0, factors, values
         
+        keyframes = keyframe_selection.keyframe_frames(n_skip, n_frames)
+        assert keyframes[0] == 0
+        is_keyframe = np.zeros(n_frames, dtype=bool)
+        is_keyframe[keyframes] = True
+
         # Preintegrator
         accum = gtsam.PreintegratedImuMeasurements(self.IMU_PARAMS)
+        state = gtsam.NavState(pose_0, velocity_0)
+        zero_bias = gtsam.imuBias.ConstantBias()
+
+        if imu_stream is not None:
+            frame_times = np.concatenate(([0.], np.cumsum(delta_t)))
+            segments = iter(imu.imu_segments(frame_times[keyframes], *imu_stream))
 
         # Add measurements to factor graph
         for i in range(1, n_frames):
-            accum.integrateMeasurement(measured_acc[i], measured_omega[i], delta_t[i-1])
-            if i % n_skip == 0:
+            if imu_stream is None:
+                accum.integrateMeasurement(measured_acc[i], measured_omega[i], delta_t[i-1])
+            if is_keyframe[i]:
+                if imu_stream is not None:
+                    imu.integrate_measurements(accum, *next(segments))
+                factors = gtsam.NonlinearFactorGraph()
+                values = gtsam.Values()
                 pose_key += 1
-                DELTA = gtsam.Pose3(gtsam.Rot3.Rodrigues(0, 0, 0.1 * np.random.randn()),
-                                    gtsam.Point3(4 * np.random.randn(), 4 * np.random.randn(), 4 * np.random.randn()))
-                self.initial_estimate.insert(pose_key, gtsam.Pose3(measured_poses[i]).compose(DELTA))
-
                 velocity_key += 1
-                self.initial_estimate.insert(velocity_key, measured_vel[i])
+                if initialization == 'imu':
+                    state = accum.predict(state, zero_bias)
+                    if measured_velocity:
+                        state = gtsam.NavState(state.pose(), state.attitude().matrix() @ measured_vel[i])
+                    values.insert(pose_key, state.pose())
+                    values.insert(velocity_key, state.velocity())
+                else:
+                    DELTA = gtsam.Pose3(gtsam.Rot3.Rodrigues(0, 0, 0.1 * random.randn()),
+                                        gtsam.Point3(4 * random.randn(), 4 * random.randn(), 4 * random.randn()))
+                    values.insert(pose_key, gtsam.Pose3(measured_poses[i]).compose(DELTA))
+                    values.insert(velocity_key, measured_vel[i])
 
                 bias_key += 1
-                self.graph.add(gtsam.BetweenFactorConstantBias(bias_key - 1, bias_key, gtsam.imuBias.ConstantBias(), self.BIAS_COVARIANCE))
-                self.initial_estimate.insert(bias_key, gtsam.imuBias.ConstantBias())
+                factors.add(gtsam.BetweenFactorConstantBias(bias_key - 1, bias_key, gtsam.imuBias.ConstantBias(), self.BIAS_COVARIANCE))
+                values.insert(bias_key, gtsam.imuBias.ConstantBias())
 
                 # Add IMU Factor
-                self.graph.add(gtsam.ImuFactor(pose_key - 1, velocity_key - 1, pose_key, velocity_key, bias_key, accum))
+                factors.add(gtsam.ImuFactor(pose_key - 1, velocity_key - 1, pose_key, velocity_key, bias_key, accum))
 
                 # Reset preintegration
                 accum.resetIntegration()
+                yield gtsam.symbolIndex(pose_key), factors, values
+
+    def add_keypoints(self,vision_data,measured_poses,n_skip, depth, axs, smart=False, tracks=None,
+                      gate=None, kernel=None, kernel_threshold=None, stereo=None, stereo_factors=False,
+                      triangulate=False):
+      """
+      Add projection factors for the keypoint tracks. With smart=True each track becomes a single
+      SmartProjectionPoseFactor on the poses that observed it, which eliminates the landmark internally
+      instead of adding an L(i) variable, and no depth is needed to initialize it.
+
+      tracks holds the indices of the tracks to use, e.g. from landmark_selection.select_tracks. By
+      default every 20th valid track is used.
+
+      gate drops the observations whose reprojection error in pixels at the initial landmark position
+      exceeds it, projected with the keyframe poses of the initial estimate the solve starts from, never the
+      ground truth; landmarks left with a single observation are dropped as well. kernel ('huber', 'cauchy'
+      or 'tukey') makes the remaining projection factors robust, see reprojection.robust_noise_model. Both
+      only apply to explicit landmarks.
 
-    def add_keypoints(self,vision_data,measured_poses,n_skip, depth, axs):
-      R_rect = np.array([[9.999239e-01, 9.837760e-03, -7.445048e-03, 0.],
-                         [ -9.869795e-03, 9.999421e-01, -4.278459e-03, 0.],
-                         [ 7.402527e-03, 4.351614e-03, 9.999631e-01, 0.],
-                         [ 0., 0., 0., 1.]])
-      R_cam_velo = np.array([[7.533745e-03, -9.999714e-01, -6.166020e-04],
-                             [ 1.480249e-02, 7.280733e-04, -9.998902e-01],
-                             [ 9.998621e-01, 7.523790e-03, 1.480755e-02]])
-      R_velo_imu = np.array([[9.999976e-01, 7.553071e-04, -2.035826e-03],
-                             [-7.854027e-04, 9.998898e-01, -1.482298e-02],
-                             [2.024406e-03, 1.482454e-02, 9.998881e-01]])
-      t_cam_velo = np.array([-4.069766e-03, -7.631618e-02, -2.717806e-01])
-      t_velo_imu = np.array([-8.086759e-01, 3.195559e-01, -7.997231e-01])
-      T_velo_imu = np.zeros((4,4))
-      T_cam_velo = np.zeros((4,4))
-      T_velo_imu[3,3] = 1.
-      T_cam_velo[3,3] = 1.
-      T_velo_imu[:3,:3] = R_velo_imu
-      T_velo_imu[:3,3] = t_velo_imu
-      T_cam_velo[:3,:3] = R_cam_velo
-      T_cam_velo[:3,3] = t_cam_velo
-      cam_to_imu = R_rect @ T_cam_velo @ T_velo_imu
-      CAM_TO_IMU_POSE = gtsam.Pose3(cam_to_imu)
-      imu_to_cam = np.linalg.inv(cam_to_imu)
-      IMU_TO_CAM_POSE = gtsam.Pose3(imu_to_cam)
-
-      K_np = np.array([[9.895267e+02, 0.000000e+00, 7.020000e+02], 
-                       [0.000000e+00, 9.878386e+02, 2.455590e+02], 
-                       [0.000000e+00, 0.000000e+00, 1.000000e+00]]) 
-
-      K = gtsam.Cal3_S2(K_np[0,0], K_np[1,1], 0., K_np[0,2], K_np[1,2])
-
-      valid_track = np.zeros(vision_data.shape[0], dtype=bool)
-      N = vision_data.shape[1]
-      for i in range(vision_data.shape[0]):
-          track_length = N - np.sum(vision_data[i,:,0] == -1)
-          if track_length > 1 and track_length < 0.5*N:
-              valid_track[i] = True
+      Landmarks are initialized from the depth at their first observation and the measured pose of that
+      frame, or from the initial estimate of the keyframe pose when measured_poses is None.
+
+      The columns of vision_data are every n_skip-th frame, or the frames of the array n_skip.
+
+      stereo replaces the depth images by the stereo matches of the track heads, a stereo.StereoHeads:
+      depth may then be None, and tracks whose head has no match are dropped. With stereo_factors the
+      projection factor of the head becomes a GenericStereoFactor3D on the left camera of the pair.
+
+      With triangulate the landmarks are triangulated from all the observations of their track and the
+      same poses, see triangulation.triangulate, and only their inlier observations get a factor. Tracks
+      failing its cheirality or parallax checks fall back to the depth or stereo initialization, and are
+      dropped if both depth and stereo are None.
+      """
+      K_np = self.CALIBRATION.K_np
+      imu_to_cam = self.CALIBRATION.imu_to_cam
+      IMU_TO_CAM_POSE = self.CALIBRATION.IMU_TO_CAM_POSE
+      K = self.CALIBRATION.K
+
+      if depth is not None:
+          frames = keyframe_selection.keyframe_frames(n_skip, len(depth))
+      if measured_poses is None:
+          keyframe_poses = trajectory.Trajectory.from_values(self.initial_estimate).poses
+      else:
+          keyframe_poses = measured_poses[keyframe_selection.keyframe_frames(n_skip, measured_poses.shape[0])]
+
+      if tracks is None:
+          tracks = landmark_selection.stride_tracks(vision_data)
+
+      if triangulate and not smart:
+          track_array = np.asarray(tracks, dtype=int)
+          tri_index, tri_frame = np.nonzero(vision_data[track_array, :-1, 0] >= 0)
+          tri_track = track_array[tri_index]
+          points, triangulated, tri_inlier = triangulation.triangulate(vision_data[tri_track, tri_frame].astype(float),
+                                                                      keyframe_poses[tri_frame] @ imu_to_cam, K_np,
+                                                                      tri_track, vision_data.shape[0])
+          # Observations kept by the triangulation, the outliers of a triangulated track get no factor
+          inlier_obs = np.zeros(vision_data.shape[:2], dtype=bool)
+          inlier_obs[tri_track[tri_inlier], tri_frame[tri_inlier]] = True
+          print('==> Triangulated ', int(triangulated[track_array].sum()), ' of ', track_array.shape[0], ' tracks')
 
       count = 0
       measurement_noise = gtsam.noiseModel.Isotropic.Sigma(2, 10.0) 
-      for i in range(0, vision_data.shape[0], 20):
-        if not valid_track[i]:
+      projection_noise = reprojection.robust_noise_model(measurement_noise, kernel, kernel_threshold)
+      smart_params = gtsam.SmartProjectionParams()
+      smart_params.setDegeneracyMode(gtsam.DegeneracyMode.ZERO_ON_DEGENERACY)
+
+      # Candidate observations (track, keyframe) and initial landmark positions
+      obs_track = []
+      obs_frame = []
+      landmarks = {}
+      for i in [int(i) for i in tracks]:
+        if smart:
+            smart_factor = gtsam.SmartProjectionPoseFactorCal3_S2(measurement_noise, K, IMU_TO_CAM_POSE, smart_params)
+            for j in np.flatnonzero(vision_data[i,:-1,0] >= 0).tolist():
+                smart_factor.add(vision_data[i,j,:].astype(float), X(j))
+            if smart_factor.size() > 1:
+                self.graph.push_back(smart_factor)
+                count += 1
+            continue
+        if triangulate and triangulated[i]:
+            for j in np.flatnonzero(inlier_obs[i,:-1]).tolist():
+                obs_track.append(i)
+                obs_frame.append(j)
+            landmarks[i] = points[i]
+            continue
+        if depth is None and stereo is None:
             continue
         key_point_initialized=False 
         for j in range(vision_data.shape[1]-1):
           if vision_data[i,j,0] >= 0:
-            zp = float(depth[j * n_skip][vision_data[i,j,1], vision_data[i,j,0], 2])
+            if stereo is not None:
+                # Only the head needs a depth, matched in the stereo pair
+                zp = float(stereo.depth[i])
+            else:
+                zp = float(depth[frames[j]][vision_data[i,j,1], vision_data[i,j,0], 2])
             if zp == 0:
                 continue
-            self.graph.push_back(gtsam.GenericProjectionFactorCal3_S2(
-              vision_data[i,j,:], measurement_noise, X(j), L(i), K, IMU_TO_CAM_POSE))
+            obs_track.append(i)
+            obs_frame.append(j)
             if not key_point_initialized:
-                count += 1
-
-                # Initialize landmark 3D coordinates
-                fx = K_np[0,0]
-                fy = K_np[1,1]
-                cx = K_np[0,2]
-                cy = K_np[1,2]
-
-                # Depth:
-                zp = float(depth[j * n_skip][vision_data[i,j,1], vision_data[i,j,0], 2])
-                xp = float(vision_data[i,j,0] - cx) / fx * zp
-                yp = float(vision_data[i,j,1] - cy) / fy * zp
-
-                # Convert to global
-                Xg = measured_poses[j*n_skip] @ imu_to_cam @ np.array([xp, yp, zp, 1])
-                axs.scatter(Xg[0], Xg[1], s=10)
-                self.initial_estimate.insert(L(i), Xg[:3])
-                
+                landmarks[i] = self._back_project(vision_data[i,j], zp, keyframe_poses[j])
                 key_point_initialized = True
 
+      obs_track = np.array(obs_track, dtype=int)
+      obs_frame = np.array(obs_frame, dtype=int)
+      keep = np.ones(obs_track.shape[0], dtype=bool)
+      if gate is not None and obs_track.shape[0] > 0:
+          points = np.array([landmarks[i] for i in obs_track.tolist()])
+          estimate_poses = trajectory.Trajectory.from_values(self.initial_estimate).poses
+          errors = reprojection.reprojection_errors(points, estimate_poses[obs_frame] @ imu_to_cam, K_np,
+                                                    vision_data[obs_track, obs_frame].astype(float))
+          keep = errors <= gate
+          # Landmarks need a second observation to be constrained
+          tracks_kept, n_kept = np.unique(obs_track[keep], return_counts=True)
+          keep &= np.isin(obs_track, tracks_kept[n_kept > 1])
+          print('==> Gated ', int((~keep).sum()), ' of ', keep.shape[0], ' observations')
+
+      if stereo_factors:
+          stereo_noise = reprojection.robust_noise_model(gtsam.noiseModel.Isotropic.Sigma(3, 10.0), kernel, kernel_threshold)
+
+      for i, j in zip(obs_track[keep].tolist(), obs_frame[keep].tolist()):
+          if stereo_factors and j == stereo.head[i]:
+              self.graph.push_back(self._stereo_factor(i, j, vision_data[i,j], stereo, stereo_noise))
+          else:
+              self.graph.push_back(gtsam.GenericProjectionFactorCal3_S2(
+                vision_data[i,j,:], projection_noise, X(j), L(i), K, IMU_TO_CAM_POSE))
+          if not self.initial_estimate.exists(L(i)):
+              count += 1
+              if axs is not None:
+                  axs.scatter(landmarks[i][0], landmarks[i][1], s=10)
+              self.initial_estimate.insert(L(i), landmarks[i])
+
       print('==> Using ', count, ' tracks')
 
-    def estimate(self, SOLVER_PARAMS=None):
+    def keypoint_updates(self, updates, vision_data, measured_poses, n_skip, depth, smart=False, tracks=None,
+                         gate=None, kernel=None, kernel_threshold=None, stereo=None, stereo_factors=False,
+                         triangulate=False):
+        """
+        Streaming counterpart of add_keypoints, with the same options: extends every (keyframe, factors,
+        values) update of imu_updates with the landmarks of the tracks, keeping only the state of the tracks
+        still observed. The gate, and the landmarks when measured_poses is None, use the keyframe poses of
+        the updates.
+
+        A landmark initialized from depth or stereo enters at its second observation kept by the gate,
+        together with the factor of the first one, so that it is constrained when it enters the solver; every
+        later observation adds its factor to its keyframe. Smart factors and triangulated landmarks need the
+        whole track and enter at its last observation. Landmarks left with a single observation are never
+        added.
+        """
+        imu_to_cam = self.CALIBRATION.imu_to_cam
+        IMU_TO_CAM_POSE = self.CALIBRATION.IMU_TO_CAM_POSE
+        K = self.CALIBRATION.K
+
+        if depth is not None:
+            frames = keyframe_selection.keyframe_frames(n_skip, len(depth))
+        if measured_poses is not None:
+            pose_frames = keyframe_selection.keyframe_frames(n_skip, measured_poses.shape[0])
+        if tracks is None:
+            tracks = landmark_selection.stride_tracks(vision_data)
+        tracks = np.asarray(tracks, dtype=int)
+
+        # Observations of the tracks in keyframe order, and the keyframe of the last one of every track
+        n_keyframes = vision_data.shape[1] - 1
+        obs_index, obs_frame = np.nonzero(vision_data[tracks, :-1, 0] >= 0)
+        order = np.argsort(obs_frame, kind='stable')
+        obs_track, obs_frame = tracks[obs_index[order]], obs_frame[order]
+        bounds = np.searchsorted(obs_frame, np.arange(n_keyframes + 1))
+        last = np.zeros(vision_data.shape[0], dtype=int)
+        np.maximum.at(last, obs_track, obs_frame)
+
+        measurement_noise = gtsam.noiseModel.Isotropic.Sigma(2, 10.0)
+        projection_noise = reprojection.robust_noise_model(measurement_noise, kernel, kernel_threshold)
+        if stereo_factors:
+            stereo_noise = reprojection.robust_noise_model(gtsam.noiseModel.Isotropic.Sigma(3, 10.0), kernel, kernel_threshold)
+        smart_params = gtsam.SmartProjectionParams()
+        smart_params.setDegeneracyMode(gtsam.DegeneracyMode.ZERO_ON_DEGENERACY)
+
+        def factor(i, j, uv):
+            if stereo_factors and j == stereo.head[i]:
+                return self._stereo_factor(i, j, uv, stereo, stereo_noise)
+            return gtsam.GenericProjectionFactorCal3_S2(uv.astype(float), projection_noise, X(j), L(i), K, IMU_TO_CAM_POSE)
+
+        def gated(points, cameras, uv):
+            if gate is None:
+                return np.ones(uv.shape[0], dtype=bool)
+            return reprojection.reprojection_errors(points, cameras @ imu_to_cam, self.CALIBRATION.K_np, uv.astype(float)) <= gate
+
+        # State of the tracks being observed: their smart factor, their observations to triangulate, or their
+        # initial landmark position with the factors held back until it enters, None once it has
+        smart_factors = {}
+        observations = defaultdict(list)
+        landmarks = {}
+        held = {}
+        count = 0
+        for j, factors, values in updates:
+            if j >= n_keyframes:
+                yield j, factors, values
+                continue
+            estimate_pose = values.atPose3(X(j)).matrix()
+            pose = estimate_pose if measured_poses is None else measured_poses[pose_frames[j]]
+            for i in obs_track[bounds[j]:bounds[j + 1]].tolist():
+                uv = vision_data[i, j]
+                if smart:
+                    if i not in smart_factors:
+                        smart_factors[i] = gtsam.SmartProjectionPoseFactorCal3_S2(measurement_noise, K, IMU_TO_CAM_POSE, smart_params)
+                    smart_factors[i].add(uv.astype(float), X(j))
+                    if j == last[i]:
+                        smart_factor = smart_factors.pop(i)
+                        if smart_factor.size() > 1:
+                            factors.push_back(smart_factor)
+                            count += 1
+                    continue
+
+                zp = 0.
+                if stereo is not None:
+                    # Only the head needs a depth, matched in the stereo pair
+                    zp = float(stereo.depth[i])
+                elif depth is not None:
+                    zp = float(depth[frames[j]][uv[1], uv[0], 2])
+
+                if triangulate:
+                    observations[i].append((j, uv, pose, estimate_pose, zp))
+                    if j == last[i]:
+                        obs_j, obs_uv, obs_pose, obs_estimate, obs_depth = map(np.array, zip(*observations.pop(i)))
+                        points, triangulated, use = triangulation.triangulate(obs_uv.astype(float), obs_pose @ imu_to_cam, self.CALIBRATION.K_np,
+                                                                             np.zeros(obs_j.shape[0], dtype=int), 1)
+                        point = points[0]
+                        if not triangulated[0]:
+                            # Fall back to the depth or stereo initialization
+                            use = obs_depth > 0
+                            if not use.any():
+                                continue
+                            head = int(np.argmax(use))
+                            point = self._back_project(obs_uv[head], obs_depth[head], obs_pose[head])
+                        use &= gated(np.tile(point, (obs_j.shape[0], 1)), obs_estimate, obs_uv)
+                        if use.sum() > 1:
+                            values.insert(L(i), point)
+                            for k in np.flatnonzero(use).tolist():
+                                factors.push_back(factor(i, int(obs_j[k]), obs_uv[k]))
+                            count += 1
+                    continue
+
+                if zp != 0:
+                    if i not in landmarks:
+                        landmarks[i] = self._back_project(uv, zp, pose)
+                        held[i] = []
+                    if gated(landmarks[i][None], estimate_pose[None], uv[None])[0]:
+                        if held[i] is None:
+                            factors.push_back(factor(i, j, uv))
+                        else:
+                            held[i].append(factor(i, j, uv))
+                            if len(held[i]) > 1:
+                                values.insert(L(i), landmarks[i])
+                                for f in held[i]:
+                                    factors.push_back(f)
+                                held[i] = None
+                                count += 1
+                if j == last[i]:
+                    landmarks.pop(i, None)
+                    held.pop(i, None)
+            yield j, factors, values
+
+        print('==> Using ', count, ' tracks')
+
+    def _back_project(self, uv, zp, pose):
+        """ World position of the keypoint uv at depth zp, seen from the keyframe pose of the IMU """
+        K_np = self.CALIBRATION.K_np
+        xp = float(uv[0] - K_np[0,2]) / K_np[0,0] * zp
+        yp = float(uv[1] - K_np[1,2]) / K_np[1,1] * zp
+        return (pose @ self.CALIBRATION.imu_to_cam @ np.array([xp, yp, zp, 1]))[:3]
+
+    def _stereo_factor(self, i, j, uv, stereo, noise):
+        """ GenericStereoFactor3D of the head uv of track i in keyframe j, on the left camera of the pair """
+        measured = stereo.rig.stereo_point(float(uv[0]), float(uv[1]), stereo.partner_u[i])
+        return gtsam.GenericStereoFactor3D(measured, noise, X(j), L(i), stereo.rig.K_stereo, stereo.rig.left.IMU_TO_CAM_POSE)
+
+    def elimination_ordering(self, ordering):
+        """
+        Elimination ordering of the graph: COLAMD, METIS or natural, or COLAMD constrained to eliminate
+        every landmark before the X/V/B keys (landmarks_first). The latter is the Schur complement of bundle
+        adjustment: the landmarks only touch the poses that observe them, so eliminating them first leaves
+        a dense but small reduced system over the keyframe states.
+        """
+        if ordering == 'colamd':
+            return gtsam.Ordering.ColamdNonlinearFactorGraph(self.graph)
+        if ordering == 'metis':
+            return gtsam.Ordering.MetisNonlinearFactorGraph(self.graph)
+        if ordering == 'natural':
+            return gtsam.Ordering.NaturalNonlinearFactorGraph(self.graph)
+        if ordering == 'landmarks_first':
+            landmarks = gtsam.KeyVector([key for key in self.initial_estimate.keys()
+                                         if gtsam.symbolChr(key) == ord('l')])
+            return gtsam.Ordering.ColamdConstrainedFirstNonlinearFactorGraph(self.graph, landmarks)
+        raise ValueError('Unknown ordering %s, expected one of %s' % (ordering, ', '.join(ORDERINGS)))
+
+    def estimate(self, SOLVER_PARAMS=None, linear_solver=None, ordering=None):
+        """
+        Batch Levenberg-Marquardt solve. linear_solver (a key of LINEAR_SOLVERS) and ordering (one of
+        ORDERINGS) override the linear solver and the elimination ordering of SOLVER_PARAMS. pcg solves each
+        step with preconditioned conjugate gradients and a block-Jacobi preconditioner.
+        """
+        if linear_solver is not None or ordering is not None:
+            if SOLVER_PARAMS is None:
+                SOLVER_PARAMS = gtsam.LevenbergMarquardtParams()
+            if linear_solver is not None:
+                if linear_solver not in LINEAR_SOLVERS:
+                    raise ValueError('Unknown linear solver %s, expected one of %s'
+                                     % (linear_solver, ', '.join(LINEAR_SOLVERS)))
+                SOLVER_PARAMS.setLinearSolverType(LINEAR_SOLVERS[linear_solver])
+                if linear_solver == 'pcg':
+                    PCG_PARAMS = gtsam.PCGSolverParameters()
+                    if hasattr(PCG_PARAMS, 'setPreconditionerParams'):
+                        PCG_PARAMS.setPreconditionerParams(gtsam.BlockJacobiPreconditionerParameters())
+                    else:
+                        # GTSAM 4.2+ exposes the preconditioner as an attribute
+                        PCG_PARAMS.preconditioner = gtsam.BlockJacobiPreconditionerParameters()
+                    SOLVER_PARAMS.setIterativeParams(PCG_PARAMS)
+            if ordering is not None:
+                SOLVER_PARAMS.setOrdering(self.elimination_ordering(ordering))
+
         self.optimizer = gtsam.LevenbergMarquardtOptimizer(self.graph, self.initial_estimate, SOLVER_PARAMS)
         self.result = self.optimizer.optimize()
 
         return self.result
 
+    def keyframe_updates(self, landmark_noise=None):
+        """
+        Split the graph and the initial estimate into the new factors and values of each keyframe, in
+        keyframe order. X/V/B factors belong to the keyframe of their latest key. A landmark becomes
+        available at its second observation so that it is constrained when it enters the solver; its
+        earlier projection factors are held back until then. Landmarks seen only once are left out.
+
+        Two nearly parallel rays leave a landmark poorly conditioned, which the batch solver absorbs with
+        LM damping but iSAM2 cannot; landmark_noise adds a prior around the depth-based initial landmark
+        position instead.
+
+        Yields (keyframe index, gtsam.NonlinearFactorGraph, gtsam.Values).
+        """
+        landmark_char = ord('l')
+
+        # Keyframe of every factor, ignoring landmarks
+        factor_keyframes = []
+        landmark_keyframes = defaultdict(list)
+        for i in range(self.graph.size()):
+            keys = list(self.graph.at(i).keys())
+            keyframe = max([gtsam.symbolIndex(k) for k in keys if gtsam.symbolChr(k) != landmark_char] or [0])
+            landmarks = [k for k in keys if gtsam.symbolChr(k) == landmark_char]
+            for k in landmarks:
+                landmark_keyframes[k].append(keyframe)
+            factor_keyframes.append((keyframe, landmarks))
+
+        # Keyframe at which each landmark is observed for the second time
+        landmark_keyframe = {}
+        for k, keyframes in landmark_keyframes.items():
+            if len(keyframes) > 1:
+                landmark_keyframe[k] = sorted(keyframes)[1]
+        n_dropped = len(landmark_keyframes) - len(landmark_keyframe)
+        if n_dropped > 0:
+            print('==> Leaving out', n_dropped, 'landmarks observed only once')
+
+        new_factors = defaultdict(gtsam.NonlinearFactorGraph)
+        for i, (keyframe, landmarks) in enumerate(factor_keyframes):
+            if any(k not in landmark_keyframe for k in landmarks):
+                continue
+            keyframe = max([keyframe] + [landmark_keyframe[k] for k in landmarks])
+            new_factors[keyframe].push_back(self.graph.at(i))
+
+        new_values = defaultdict(gtsam.Values)
+        for key in self.initial_estimate.keys():
+            if gtsam.symbolChr(key) == landmark_char:
+                if key in landmark_keyframe:
+                    point = self.initial_estimate.atPoint3(key)
+                    new_values[landmark_keyframe[key]].insert(key, point)
+                    if landmark_noise is not None:
+                        new_factors[landmark_keyframe[key]].push_back(gtsam.PriorFactorPoint3(key, point, landmark_noise))
+            else:
+                new_values[gtsam.symbolIndex(key)].insert(key, value_at(self.initial_estimate, key))
+
+        for keyframe in sorted(set(new_factors) | set(new_values)):
+            yield keyframe, new_factors[keyframe], new_values[keyframe]
+
+    def estimate_incremental(self, ISAM2_PARAMS=None, LANDMARK_SIGMA=5.):
+        """
+        Solve the graph with iSAM2, one keyframe at a time: each keyframe only adds its IMU and projection
+        factors and its new values to the Bayes tree instead of re-solving the whole graph.
+        """
+        if ISAM2_PARAMS is None:
+            ISAM2_PARAMS = gtsam.ISAM2Params()
+        landmark_noise = gtsam.noiseModel.Isotropic.Sigma(3, LANDMARK_SIGMA) if LANDMARK_SIGMA else None
+        self.isam = gtsam.ISAM2(ISAM2_PARAMS)
+        for _, factors, values in self.keyframe_updates(landmark_noise):
+            self.isam.update(factors, values)
+        self.result = self.isam.calculateEstimate()
+
+        return self.result
+
+    def estimate_fixed_lag(self, keyframe_times, LAG, ISAM2_PARAMS=None, LANDMARK_SIGMA=5., marginalized=None):
+        """
+        Solve the graph with an incremental fixed-lag smoother: poses, velocities, biases and landmarks
+        not touched for LAG seconds are marginalized out and their marginal is kept as a prior, so the
+        per-keyframe cost and memory of the solver stay bounded however long the drive is.
+
+        The graph is fed one keyframe at a time from self.updates() when set, e.g. imu_updates and
+        keypoint_updates, which build it as it is solved, or else from keyframe_updates. Only the keys in
+        the window are tracked. keyframe_times holds the time in seconds of each keyframe. A landmark's
+        timestamp is refreshed at every observation, so it stays in the window while it is tracked. Factors
+        reaching back to an already marginalized variable are dropped, and so are the new landmarks left
+        with fewer than two factors, which would enter the solver unconstrained.
+
+        Every variable is passed to marginalized(key, value) with its last estimate as it leaves the window,
+        or at the end of the drive. By default the poses, velocities and biases are collected into the
+        returned result and the landmarks are dropped.
+        """
+        if ISAM2_PARAMS is None:
+            ISAM2_PARAMS = gtsam.ISAM2Params()
+        landmark_noise = gtsam.noiseModel.Isotropic.Sigma(3, LANDMARK_SIGMA) if LANDMARK_SIGMA else None
+        self.smoother = IncrementalFixedLagSmoother(LAG, ISAM2_PARAMS)
+        self.result = gtsam.Values()
+        if marginalized is None:
+            def marginalized(key, value):
+                if gtsam.symbolChr(key) != ord('l'):
+                    self.result.insert(key, value)
+
+        key_times = {}
+        n_dropped = 0
+        for keyframe, factors, values in (self.keyframe_updates() if self.updates is None else self.updates()):
+            t = keyframe_times[keyframe]
+
+            # Factors on marginalized variables, then the new landmarks they leave unconstrained
+            kept = [factors.at(i) for i in range(factors.size())
+                    if all(k in key_times or values.exists(k) for k in factors.at(i).keys())]
+            n_factors = defaultdict(int)
+            for factor in kept:
+                for k in factor.keys():
+                    n_factors[k] += 1
+            unconstrained = set(k for k in values.keys() if n_factors[k] < (2 if gtsam.symbolChr(k) == ord('l') else 1))
+            n_dropped += factors.size() - len(kept)
+
+            new_factors = gtsam.NonlinearFactorGraph()
+            new_values = gtsam.Values()
+            new_timestamps = FixedLagSmootherKeyTimestampMap()
+            for factor in kept:
+                keys = list(factor.keys())
+                if unconstrained.intersection(keys):
+                    n_dropped += 1
+                    continue
+                new_factors.push_back(factor)
+                for k in keys:
+                    if gtsam.symbolChr(k) == ord('l') or values.exists(k):
+                        key_times[k] = t
+                        new_timestamps.insert(timestamp_entry(k, t))
+            for k in values.keys():
+                if k not in unconstrained:
+                    new_values.insert(k, value_at(values, k))
+                    if landmark_noise is not None and gtsam.symbolChr(k) == ord('l'):
+                        new_factors.push_back(gtsam.PriorFactorPoint3(k, values.atPoint3(k), landmark_noise))
+
+            # The update marginalizes the variables out of the window, which leave with their last estimate
+            leaving = [k for k, tk in key_times.items() if tk < t - LAG]
+            if leaving:
+                estimate = self.smoother.calculateEstimate()
+                for k in leaving:
+                    marginalized(k, value_at(estimate, k))
+                    del key_times[k]
+
+            self.smoother.update(new_factors, new_values, new_timestamps)
+
+        if n_dropped > 0:
+            print('==> Dropped', n_dropped, 'factors on marginalized or unconstrained variables')
+
+        estimate = self.smoother.calculateEstimate()
+        for k in key_times:
+            marginalized(k, value_at(estimate, k))
+
+        return self.result
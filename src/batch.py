@@ -0,0 +1,276 @@
+"""
+Batch runner: run main.py over many drives and parameter sets on a process pool and collect the
+trajectories, metrics and timings of every run into one summary.
+
+The manifest is a JSON file of main.py options, named by their dest. Every drive is run with every
+parameter set, the options of a parameter set overriding those of its drive, which override defaults:
+
+    {
+      "defaults": {"basedir": "/data/kitti", "n_skip": 10},
+      "drives": [{"date": "2011_09_26", "drive": "0022", "n_frames": 701},
+                 {"date": "2011_09_26", "drive": "9001", "basedir": "/tmp/kitti", "synthetic": true}],
+      "parameters": {"baseline": {}, "smart": {"smart_factors": true, "init": "imu"}}
+    }
+
+    python src/batch.py --manifest nightly.json --out /tmp/nightly --workers 16 --threads 1
+
+Workers are spawned processes that load the SuperPoint network once and reuse it for all their runs, with
+their OpenMP/BLAS and torch thread pools capped to --threads, so that workers x threads matches the cores.
+Runs are started longest first; the runs of a drive sharing a --feature_cache run one after another on
+one worker, the first filling the cache for the others. Each run writes its trajectories (main.py
+--export), its log and, with --plots, its figures and with --profile, its section times (main.py
+--profile) into <out>/<run>; summary.json in <out> holds the metrics, stage timings and resident memory of
+all runs, or the traceback of the failed ones.
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+SUMMARY_FILE = 'summary.json'
+LOG_FILE = 'log.txt'
+PROFILE_FILE = 'profile.json'
+# Thread pools of the numerical libraries, read when they are first imported
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS')
+
+_worker = {}
+
+
+def load_manifest(path):
+    """
+    The runs of a manifest, as a list of (name, options) with the options merged as described above. A run
+    is named <date>_<drive>_<parameter set>, with the index of the drive in the manifest after <drive> when
+    several drives share their date and number, e.g. with another camera or basedir.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = manifest.get('defaults', {})
+    parameters = manifest.get('parameters', {'default': {}})
+    drives = []
+    for drive in manifest['drives']:
+        options = dict(defaults, **drive)
+        drives.append('%s_%s' % (options.get('date'), options.get('drive')))
+    repeated = collections.Counter(drives)
+    runs = []
+    for index, drive in enumerate(manifest['drives']):
+        drive_name = drives[index] if repeated[drives[index]] == 1 else '%s_%d' % (drives[index], index)
+        for name, params in sorted(parameters.items()):
+            options = dict(defaults, **drive)
+            options.update(params)
+            runs.append(('%s_%s' % (drive_name, name), options))
+    return runs
+
+
+def run_arguments(parser, options):
+    """ main.py arguments of a run: the defaults of the parser, overridden by the options """
+    args = parser.parse_args([])
+    unknown = sorted(set(options) - set(vars(args)))
+    if unknown:
+        raise ValueError('unknown options %s' % ', '.join(unknown))
+    for key, value in options.items():
+        setattr(args, key, value)
+    return args
+
+
+class _OptionChecker(object):
+    """ Stands in for the parser of main.check_arguments, raising its errors instead of exiting """
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def check_runs(runs):
+    """ Raise a ValueError naming the first run with unknown or incompatible options, or sharing its name """
+    import main
+    parser = main.build_parser()
+    names = collections.Counter(name for name, _ in runs)
+    for name, options in runs:
+        if names[name] > 1:
+            raise ValueError('run %s: %d runs have this name and would write to the same directory' % (name, names[name]))
+        try:
+            main.check_arguments(_OptionChecker(), run_arguments(parser, options))
+        except ValueError as e:
+            raise ValueError('run %s: %s' % (name, e))
+
+
+def _init_worker(threads):
+    import matplotlib
+    matplotlib.use('Agg')
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+
+
+def _frontend_loader(args):
+    """
+    Loads the frontend of a run. The SuperPoint network is loaded on the first run of the worker that needs
+    it and returned on the next ones; the other frontends are cheap to build for every run.
+    """
+    import frontends
+
+    def load():
+        if args.frontend != 'superpoint':
+            return frontends.load_frontend(args)
+        if args.cuda not in _worker:
+            _worker[args.cuda] = frontends.load_superpoint(args.cuda)
+        return _worker[args.cuda]
+    return load
+
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """ Redirect stdout and stderr to path at the file descriptor level, which also catches GTSAM's output """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(path, 'w') as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def _run(task):
+    name, options, out, plots, seed, profile = task
+    import numpy as np
+    import main
+    import profiling
+    import matplotlib.pyplot as plt
+
+    run_dir = os.path.join(out, name)
+    os.makedirs(run_dir, exist_ok=True)
+    summary = {'name': name, 'options': options, 'pid': os.getpid()}
+    start = time.perf_counter()
+    with redirect_output(os.path.join(run_dir, LOG_FILE)):
+        try:
+            args = run_arguments(main.build_parser(), options)
+            args.export = run_dir
+            args.viz_tracking = False
+            # The perturbed initial estimate is random; reseed so that a run does not depend on its worker
+            np.random.seed(seed)
+            if profile:
+                profiling.timers.enable()
+            axs = plt.subplots(1, figsize=(12, 8))[1] if plots else None
+            result = main.run(args, axs, _frontend_loader(args))
+            if plots:
+                main.plot_results(result, axs, run_dir)
+            summary.update(status='ok', keyframes=int(result['keyframe_frames'].shape[0]),
+                           metrics=result['metrics'], timings=result['timings'], memory=result['memory'])
+            if profile:
+                profiling.timers.save(os.path.join(run_dir, PROFILE_FILE))
+                summary['sections'] = profiling.timers.summary()['sections']
+        except Exception:
+            traceback.print_exc()
+            summary.update(status='failed', error=traceback.format_exc())
+        finally:
+            profiling.timers.disable()
+            plt.close('all')
+    summary['wall_s'] = time.perf_counter() - start
+    return summary
+
+
+def _run_group(tasks):
+    return [_run(task) for task in tasks]
+
+
+def group_tasks(tasks):
+    """
+    Tasks grouped into the lists of tasks run one after another by one worker: the runs of a drive sharing
+    a feature cache, so that the first fills it for the others instead of all extracting the same features
+    at once. Other runs are groups of their own. Groups keep the order of their first task.
+    """
+    groups = collections.OrderedDict()
+    for task in tasks:
+        options = task[1]
+        if options.get('feature_cache') is None:
+            key = ('run', task[0])
+        else:
+            key = ('drive', options['feature_cache'], options.get('basedir'), options.get('date'), options.get('drive'),
+                   options.get('camera'))
+        groups.setdefault(key, []).append(task)
+    return list(groups.values())
+
+
+def run_batch(runs, out, workers, threads=1, plots=False, seed=0, profile=False):
+    """
+    Run the (name, options) runs on workers processes, each from the random seed, and write the summary.
+    Returns the run summaries.
+    """
+    os.makedirs(out, exist_ok=True)
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    # Longest drives first, so that the last runs do not leave most workers idle
+    tasks = sorted(((name, options, out, plots, seed, profile) for name, options in runs),
+                   key=lambda task: -(task[1].get('n_frames') or sys.maxsize))
+
+    context = multiprocessing.get_context('spawn')
+    summaries = []
+    start = time.perf_counter()
+    with context.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        for group in pool.imap_unordered(_run_group, group_tasks(tasks)):
+            for summary in group:
+                summaries.append(summary)
+                print('==> [%d/%d] %s %s in %.1f s' % (len(summaries), len(tasks), summary['name'], summary['status'],
+                                                       summary['wall_s']))
+    summaries.sort(key=lambda summary: summary['name'])
+
+    with open(os.path.join(out, SUMMARY_FILE), 'w') as f:
+        json.dump({'workers': workers, 'threads': threads, 'wall_s': time.perf_counter() - start,
+                   'runs': summaries}, f, indent=2)
+    return summaries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run main.py over the drives and parameter sets of a manifest.')
+    parser.add_argument('--manifest', dest='manifest', type=str, required=True,
+                        help='JSON file of the drives and parameter sets, see the module docstring.')
+    parser.add_argument('--out', dest='out', type=str, required=True,
+                        help='Directory of the run outputs and of summary.json.')
+    parser.add_argument('--threads', dest='threads', type=int, default=1,
+                        help='OpenMP/BLAS and torch threads of every worker.')
+    parser.add_argument('--workers', dest='workers', type=int, default=None,
+                        help='Worker processes, by default the number of cores divided by --threads.')
+    parser.add_argument('--plots', dest='plots', action='store_true',
+                        help='Save the figures of main.py into the directory of every run.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='Random seed of every run, e.g. of the perturbed initial estimate.')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='Time the pipeline sections of every run, see main.py --profile.')
+    args = parser.parse_args()
+
+    workers = args.workers or max(os.cpu_count() // args.threads, 1)
+    runs = load_manifest(args.manifest)
+
+    # Reject invalid options before starting any run
+    try:
+        check_runs(runs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print('==> Running', len(runs), 'runs on', workers, 'workers of', args.threads, 'threads')
+    summaries = run_batch(runs, args.out, workers, args.threads, args.plots, args.seed, args.profile)
+
+    print('%-40s %8s %10s %10s %9s' % ('run', 'status', 'IMU ATE', 'VIO ATE', 'wall (s)'))
+    for summary in summaries:
+        if summary['status'] == 'ok':
+            print('%-40s %8s %10.3f %10.3f %9.1f' % (summary['name'][-40:], summary['status'],
+                  summary['metrics']['IMU-only']['ate_rmse'], summary['metrics']['VIO']['ate_rmse'], summary['wall_s']))
+        else:
+            print('%-40s %8s %10s %10s %9.1f' % (summary['name'][-40:], summary['status'], '-', '-', summary['wall_s']))
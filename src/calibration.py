@@ -0,0 +1,142 @@
+"""
+Camera calibration of the KITTI recordings, parsed from the calib_cam_to_cam.txt, calib_velo_to_cam.txt
+and calib_imu_to_velo.txt files of a date.
+
+The parsed calibration of a (date, camera) pair is cached next to the calibration files as a small npz
+file and in memory, so that runs over many drives of many dates only parse each date once.
+"""
+
+import os
+
+import numpy as np
+import gtsam
+
+CALIB_FILES = ('calib_cam_to_cam.txt', 'calib_velo_to_cam.txt', 'calib_imu_to_velo.txt')
+
+_cache = {}
+
+
+def read_calib_file(path):
+    """ Read a KITTI calibration file of 'key: values' lines into a dict of float arrays. """
+    data = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            try:
+                data[key] = np.array([float(x) for x in value.split()])
+            except ValueError:
+                # calib_time and other non-numeric entries
+                pass
+    return data
+
+
+def transform(R, T):
+    T_out = np.eye(4)
+    T_out[:3, :3] = R.reshape(3, 3)
+    T_out[:3, 3] = T
+    return T_out
+
+
+class CameraCalibration(object):
+    """
+    Rectified intrinsics of one camera and its pose in the IMU frame.
+
+    The gtsam objects used by the projection factors are built once on first use. Only the numpy arrays
+    are pickled, so calibrations can be handed to worker processes.
+    """
+
+    def __init__(self, K_np, imu_to_cam, image_size=None):
+        self.K_np = np.asarray(K_np, dtype=float)
+        self.imu_to_cam = np.asarray(imu_to_cam, dtype=float)
+        self.image_size = None if image_size is None else tuple(int(x) for x in image_size)
+        self._K = None
+        self._IMU_TO_CAM_POSE = None
+
+    @property
+    def K(self):
+        if self._K is None:
+            K_np = self.K_np
+            self._K = gtsam.Cal3_S2(K_np[0,0], K_np[1,1], K_np[0,1], K_np[0,2], K_np[1,2])
+        return self._K
+
+    @property
+    def IMU_TO_CAM_POSE(self):
+        if self._IMU_TO_CAM_POSE is None:
+            self._IMU_TO_CAM_POSE = gtsam.Pose3(self.imu_to_cam)
+        return self._IMU_TO_CAM_POSE
+
+    def __getstate__(self):
+        return {'K_np': self.K_np, 'imu_to_cam': self.imu_to_cam, 'image_size': self.image_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def save(self, path):
+        image_size = np.array(self.image_size if self.image_size is not None else [])
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, K_np=self.K_np, imu_to_cam=self.imu_to_cam, image_size=image_size)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            image_size = data['image_size'] if data['image_size'].size > 0 else None
+            return cls(data['K_np'], data['imu_to_cam'], image_size)
+
+
+def parse_kitti_calibration(calib_dir, camera):
+    """
+    Build the calibration of camera 0-3 from the calibration files in calib_dir, for the rectified
+    images of the synced drives:
+
+      cam_to_imu = T_rect_cam (baseline) @ R_rect_00 @ T_cam0_velo @ T_velo_imu
+    """
+    cam_to_cam = read_calib_file(os.path.join(calib_dir, 'calib_cam_to_cam.txt'))
+    velo_to_cam = read_calib_file(os.path.join(calib_dir, 'calib_velo_to_cam.txt'))
+    imu_to_velo = read_calib_file(os.path.join(calib_dir, 'calib_imu_to_velo.txt'))
+
+    P_rect = cam_to_cam['P_rect_%02d' % camera].reshape(3, 4)
+    R_rect = np.eye(4)
+    R_rect[:3, :3] = cam_to_cam['R_rect_00'].reshape(3, 3)
+
+    # The rectified projection matrices of cameras 1-3 hold the baseline to camera 0.
+    T_rect = np.eye(4)
+    T_rect[0, 3] = P_rect[0, 3] / P_rect[0, 0]
+
+    T_cam_velo = transform(velo_to_cam['R'], velo_to_cam['T'])
+    T_velo_imu = transform(imu_to_velo['R'], imu_to_velo['T'])
+    cam_to_imu = T_rect @ R_rect @ T_cam_velo @ T_velo_imu
+
+    image_size = cam_to_cam.get('S_rect_%02d' % camera)
+    if image_size is not None:
+        image_size = image_size[::-1]
+
+    return CameraCalibration(P_rect[:, :3], np.linalg.inv(cam_to_imu), image_size)
+
+
+def load_calibration(basedir, date, camera):
+    """
+    Calibration of a camera for the drives of a date, from <basedir>/<date>/calib_*.txt. The result is
+    cached in memory and in <basedir>/<date>/calib_cam<camera>.npz if the directory is writable, which is
+    rebuilt whenever one of the calibration files is newer.
+    """
+    calib_dir = os.path.join(basedir, date)
+    key = (os.path.abspath(calib_dir), camera)
+    if key in _cache:
+        return _cache[key]
+
+    cache_path = os.path.join(calib_dir, 'calib_cam%d.npz' % camera)
+    sources = [os.path.join(calib_dir, name) for name in CALIB_FILES]
+    if os.path.exists(cache_path) and all(os.path.getmtime(cache_path) >= os.path.getmtime(p) for p in sources):
+        calib = CameraCalibration.load(cache_path)
+    else:
+        calib = parse_kitti_calibration(calib_dir, camera)
+        try:
+            calib.save(cache_path)
+        except OSError as e:
+            # e.g. a read-only dataset: the calibration is then only cached in memory
+            print('==> Not caching the calibration in %s: %s' % (cache_path, e))
+
+    _cache[key] = calib
+    return calib
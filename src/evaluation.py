@@ -0,0 +1,215 @@
+"""
+Trajectory accuracy: absolute trajectory error (ATE) after an SE(3) or Sim(3) Umeyama alignment, and
+relative pose error (RPE) over windows of frames, traveled distance or time. Everything is vectorized
+over the poses of a trajectory.
+
+Evaluate trajectory files written by main.py --export against the ground truth, in one batch:
+
+    python src/evaluation.py --gt out/gt_tum.txt --est out/imu_tum.txt out/vio_tum.txt --align sim3 --rpe_delta 100 --rpe_unit meters
+"""
+
+import argparse
+import json
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+import trajectory
+
+ALIGNMENTS = ('none', 'se3', 'sim3')
+RPE_UNITS = ('frames', 'meters', 'seconds')
+
+
+def umeyama(src, dst, with_scale=False):
+    """
+    Least squares similarity transform mapping the N x 3 points src onto dst (Umeyama, 1991).
+    Returns (R, t, s) with dst ~ s * R @ src + t; s is 1 unless with_scale.
+    """
+    mu_src = src.mean(axis=0)
+    mu_dst = dst.mean(axis=0)
+    src_c = src - mu_src
+    dst_c = dst - mu_dst
+    cov = dst_c.T @ src_c / src.shape[0]
+    U, D, Vt = np.linalg.svd(cov)
+    S = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        S[2, 2] = -1
+    R = U @ S @ Vt
+    s = 1.
+    if with_scale:
+        var_src = np.mean(np.sum(src_c ** 2, axis=1))
+        s = np.trace(np.diag(D) @ S) / var_src
+    t = mu_dst - s * R @ mu_src
+    return R, t, s
+
+
+def align(est, gt, alignment='se3'):
+    """ The N x 4 x 4 poses est aligned onto gt by their positions, and the scale applied. """
+    if alignment == 'none':
+        return est, 1.
+    if alignment not in ALIGNMENTS:
+        raise ValueError('Unknown alignment %s, expected one of %s' % (alignment, ', '.join(ALIGNMENTS)))
+    R, t, s = umeyama(est[:, :3, 3], gt[:, :3, 3], with_scale=alignment == 'sim3')
+    aligned = est.copy()
+    aligned[:, :3, :3] = R @ est[:, :3, :3]
+    aligned[:, :3, 3] = s * est[:, :3, 3] @ R.T + t
+    return aligned, s
+
+
+def statistics(errors):
+    if errors.shape[0] == 0:
+        return {'rmse': float('nan'), 'mean': float('nan'), 'median': float('nan'), 'max': float('nan'), 'n': 0}
+    return {
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mean': float(np.mean(errors)),
+        'median': float(np.median(errors)),
+        'max': float(np.max(errors)),
+        'n': int(errors.shape[0]),
+    }
+
+
+def ate(est, gt, alignment='se3'):
+    """
+    Absolute trajectory error of the N x 4 x 4 poses est against gt: statistics of the position errors
+    in meters after alignment, the per-pose errors and the scale of the alignment.
+    """
+    aligned, scale = align(est, gt, alignment)
+    errors = np.linalg.norm(aligned[:, :3, 3] - gt[:, :3, 3], axis=1)
+    result = statistics(errors)
+    result['scale'] = float(scale)
+    result['errors'] = errors
+    return result
+
+
+def relative_inverse(poses):
+    """ Inverse of a stack of rigid transforms """
+    inv = np.tile(np.eye(4), (poses.shape[0], 1, 1))
+    Rt = np.transpose(poses[:, :3, :3], (0, 2, 1))
+    inv[:, :3, :3] = Rt
+    inv[:, :3, 3] = -np.einsum('nij,nj->ni', Rt, poses[:, :3, 3])
+    return inv
+
+
+def rpe_pairs(gt, delta, unit='frames', timestamps=None):
+    """
+    Index pairs (i, j) of the RPE windows: j is delta frames after i, or the first pose at least delta
+    meters of ground truth path or delta seconds after i.
+    """
+    n = gt.shape[0]
+    if unit == 'frames':
+        i = np.arange(max(n - int(delta), 0))
+        return i, i + int(delta)
+    if unit == 'meters':
+        along = np.concatenate(([0.], np.cumsum(np.linalg.norm(np.diff(gt[:, :3, 3], axis=0), axis=1))))
+    elif unit == 'seconds':
+        if timestamps is None:
+            raise ValueError('RPE over time windows needs timestamps')
+        along = np.asarray(timestamps, dtype=float)
+    else:
+        raise ValueError('Unknown RPE unit %s, expected one of %s' % (unit, ', '.join(RPE_UNITS)))
+    j = np.searchsorted(along, along + delta, side='left')
+    i = np.arange(n)
+    valid = j < n
+    return i[valid], j[valid]
+
+
+def rpe(est, gt, delta=1, unit='frames', timestamps=None):
+    """
+    Relative pose error of est against gt over windows of delta frames, meters or seconds: statistics
+    of the translation errors in meters and of the rotation errors in radians.
+    """
+    i, j = rpe_pairs(gt, delta, unit, timestamps)
+    gt_rel = relative_inverse(gt[i]) @ gt[j]
+    est_rel = relative_inverse(est[i]) @ est[j]
+    error = relative_inverse(gt_rel) @ est_rel
+    trans = np.linalg.norm(error[:, :3, 3], axis=1)
+    rot = Rotation.from_matrix(error[:, :3, :3]).magnitude()
+    return {'trans': statistics(trans), 'rot': statistics(rot), 'pairs': (i, j)}
+
+
+def associate(est_times, gt_times, max_difference=0.02):
+    """ Indices (est, gt) of the poses with the nearest timestamps, closer than max_difference seconds. """
+    gt_times = np.asarray(gt_times)
+    est_times = np.asarray(est_times)
+    if gt_times.shape[0] == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # Nearest of the ground truth poses before and after every estimate, the same one at the ends
+    after = np.minimum(np.searchsorted(gt_times, est_times), gt_times.shape[0] - 1)
+    before = np.maximum(after - 1, 0)
+    j = np.where(np.abs(gt_times[before] - est_times) <= np.abs(gt_times[after] - est_times), before, after)
+    valid = np.abs(gt_times[j] - est_times) <= max_difference
+    return np.flatnonzero(valid), j[valid]
+
+
+def load_trajectory(path):
+    """ (timestamps or None, poses) of a TUM or KITTI trajectory file, told apart by the column count. """
+    with open(path) as f:
+        columns = len(f.readline().split())
+    if columns == 8:
+        return trajectory.load_tum(path)
+    return None, trajectory.load_kitti(path)
+
+
+def evaluate(est, gt, alignment='se3', rpe_delta=1, rpe_unit='frames', timestamps=None):
+    """ ATE and RPE of est against gt, as a flat dict of the summary statistics. """
+    ate_result = ate(est, gt, alignment)
+    rpe_result = rpe(est, gt, rpe_delta, rpe_unit, timestamps)
+    return {
+        'poses': ate_result['n'],
+        'scale': ate_result['scale'],
+        'ate_rmse': ate_result['rmse'],
+        'ate_mean': ate_result['mean'],
+        'ate_median': ate_result['median'],
+        'ate_max': ate_result['max'],
+        'rpe_trans_rmse': rpe_result['trans']['rmse'],
+        'rpe_rot_rmse': rpe_result['rot']['rmse'],
+        'rpe_pairs': rpe_result['trans']['n'],
+    }
+
+
+def evaluate_files(est_paths, gt_path, alignment='se3', rpe_delta=1, rpe_unit='frames', max_difference=0.02):
+    """
+    Evaluate many trajectory files against one ground truth file. TUM files are associated with the
+    ground truth by timestamp, KITTI files pose by pose. Returns one result dict per file.
+    """
+    gt_times, gt = load_trajectory(gt_path)
+    results = []
+    for path in est_paths:
+        est_times, est = load_trajectory(path)
+        if est_times is not None and gt_times is not None:
+            est_idx, gt_idx = associate(est_times, gt_times, max_difference)
+            est_matched, gt_matched, times = est[est_idx], gt[gt_idx], gt_times[gt_idx]
+        else:
+            n = min(est.shape[0], gt.shape[0])
+            est_matched, gt_matched = est[:n], gt[:n]
+            times = None if gt_times is None else gt_times[:n]
+        result = evaluate(est_matched, gt_matched, alignment, rpe_delta, rpe_unit, times)
+        result['file'] = path
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ATE and RPE of trajectory files against a ground truth.')
+    parser.add_argument('--gt', dest='gt', type=str, required=True, help='Ground truth, TUM or KITTI format.')
+    parser.add_argument('--est', dest='est', type=str, nargs='+', required=True, help='Estimated trajectories.')
+    parser.add_argument('--align', dest='align', type=str, default='se3', choices=ALIGNMENTS)
+    parser.add_argument('--rpe_delta', dest='rpe_delta', type=float, default=1)
+    parser.add_argument('--rpe_unit', dest='rpe_unit', type=str, default='frames', choices=RPE_UNITS)
+    parser.add_argument('--max_difference', dest='max_difference', type=float, default=0.02,
+                        help='Largest timestamp difference in seconds when associating TUM trajectories.')
+    parser.add_argument('--json', dest='json', type=str, default=None, help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    results = evaluate_files(args.est, args.gt, args.align, args.rpe_delta, args.rpe_unit, args.max_difference)
+
+    print('%-40s %6s %7s %9s %9s %9s %10s %10s' % ('trajectory', 'poses', 'scale', 'ATE rmse', 'ATE mean', 'ATE max',
+                                                  'RPE t (m)', 'RPE r (deg)'))
+    for result in results:
+        print('%-40s %6d %7.3f %9.3f %9.3f %9.3f %10.3f %10.3f' % (result['file'][-40:], result['poses'],
+              result['scale'], result['ate_rmse'], result['ate_mean'], result['ate_max'],
+              result['rpe_trans_rmse'], np.degrees(result['rpe_rot_rmse'])))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,225 @@
+"""
+On-disk cache of the keypoints and descriptors of a feature frontend, addressed by the content of the
+image and by a hash of the frontend weights and parameters.
+
+The features of a drive are appended to one pack: a flat float32 file read back through np.memmap, with
+a small JSON index from feature key to offset. Several processes may fill the same pack: each append and
+each index write holds an exclusive lock on the pack, and close() merges the index on disk with its own.
+When the packs of a cache directory outgrow max_bytes, the least recently used ones are evicted as a whole,
+each under its lock, skipping the packs whose lock is held. A process that finds its pack evicted since it
+last held the lock drops the entries that went with it and starts a new pack.
+
+    cache = FeatureCache('/tmp/features', 'kitti_2011_09_26_0022_cam1', frontend_key(weights_path, nms_dist=4))
+    fe = CachedFrontend(cache, lambda: sp.SuperPointFrontend(weights_path, ...))
+    pts, desc, _ = fe.run(img)   # the network is only loaded and run on misses
+    cache.close()
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+import numpy as np
+
+INDEX_SUFFIX = '.json'
+DATA_SUFFIX = '.bin'
+
+
+def frontend_key(weights_path=None, **params):
+    """ Hash of the frontend weights file and of its parameters, e.g. nms_dist and conf_thresh. """
+    h = hashlib.sha1()
+    if weights_path is not None:
+        with open(weights_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def image_key(img, frontend):
+    """ Feature key of an image: hash of its pixels, shape and dtype, and of the frontend key. """
+    img = np.ascontiguousarray(img)
+    h = hashlib.sha1(frontend.encode())
+    h.update(('%s%s' % (img.dtype.str, img.shape)).encode())
+    h.update(img.data)
+    return h.hexdigest()
+
+
+class FeatureCache(object):
+    """
+    Pack of the features of one drive in cache_dir. get() and put() take the image itself; the counters
+    hits and misses count the lookups. The index is written by close(), which also evicts old packs.
+    """
+
+    def __init__(self, cache_dir, name, frontend, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.frontend = frontend
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        base = os.path.join(cache_dir, '%s_%s' % (name, frontend))
+        self.index_path = base + INDEX_SUFFIX
+        self.data_path = base + DATA_SUFFIX
+
+        self.index = {}
+        self._data = None
+        self._dirty = False
+        # The data file the entries of the index point into, open until close() even if it gets evicted
+        self._pack = None
+        with self._locked() as f:
+            size = os.fstat(f.fileno()).st_size
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as index:
+                    self.index = json.load(index)
+        # Entries past the end of the data file were never completely written
+        self.index = {k: v for k, v in self.index.items() if 4 * (v[0] + v[1] * (3 + v[2])) <= size}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the exclusive lock of the pack, on its data file. If another process evicted the pack since this
+        one last held the lock, its entries went with it: the index is emptied and a new pack started.
+        """
+        while True:
+            if self._pack is None:
+                self._pack = open(self.data_path, 'a+b')
+            fcntl.flock(self._pack, fcntl.LOCK_EX)
+            if os.fstat(self._pack.fileno()).st_nlink > 0:
+                break
+            self._pack.close()
+            self._pack = None
+            self.index = {}
+            self._data = None
+        try:
+            yield self._pack
+        finally:
+            self._pack.flush()
+            fcntl.flock(self._pack, fcntl.LOCK_UN)
+
+    def _read(self, offset, n, d):
+        if self._data is None or self._data.shape[0] < offset + n * (3 + d):
+            if self._pack is None:
+                self._pack = open(self.data_path, 'a+b')
+            self._data = np.memmap(self._pack, dtype=np.float32, mode='r')
+        pts = np.array(self._data[offset:offset + 3 * n], dtype=float).reshape(3, n)
+        if d == 0:
+            return pts, None
+        desc = np.array(self._data[offset + 3 * n:offset + n * (3 + d)]).reshape(d, n)
+        return pts, desc
+
+    def get(self, img):
+        """ (pts, desc) of the image, or None on a miss """
+        entry = self.index.get(image_key(img, self.frontend))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._read(*entry)
+
+    def put(self, img, pts, desc):
+        n = pts.shape[1]
+        d = 0 if desc is None else desc.shape[0]
+        # Other processes may append to the same pack: the entry starts at its end, written under the lock
+        with self._locked() as f:
+            offset = f.seek(0, os.SEEK_END) // 4
+            f.write(np.ascontiguousarray(pts, dtype=np.float32).tobytes())
+            if desc is not None:
+                f.write(np.ascontiguousarray(desc, dtype=np.float32).tobytes())
+        self.index[image_key(img, self.frontend)] = [offset, n, d]
+        self._dirty = True
+
+    def close(self):
+        """ Write the index and evict the least recently used packs beyond max_bytes. """
+        self._data = None
+        if self._dirty or os.path.exists(self.index_path):
+            # Merge the entries other processes wrote since this one read the index, under the lock of the pack
+            with self._locked():
+                if os.path.exists(self.index_path):
+                    with open(self.index_path) as f:
+                        index = json.load(f)
+                    index.update(self.index)
+                    self.index = index
+                tmp_path = self.index_path + '.%d.tmp' % os.getpid()
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.index, f)
+                os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes):
+        """
+        Delete whole packs, least recently closed first, until the cache fits in max_bytes. Packs whose lock
+        another process holds, in the middle of an append or an index write, are kept.
+        """
+        packs = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(INDEX_SUFFIX):
+                index_path = os.path.join(self.cache_dir, filename)
+                data_path = index_path[:-len(INDEX_SUFFIX)] + DATA_SUFFIX
+                size = os.path.getsize(index_path)
+                if os.path.exists(data_path):
+                    size += os.path.getsize(data_path)
+                packs.append((os.path.getmtime(index_path), size, index_path, data_path))
+        total = sum(pack[1] for pack in packs)
+        for _, size, index_path, data_path in sorted(packs):
+            if total <= max_bytes:
+                break
+            if index_path == self.index_path:
+                continue
+            try:
+                lock = open(data_path, 'rb')
+            except FileNotFoundError:
+                lock = None
+            try:
+                if lock is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                for path in (index_path, data_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+            except BlockingIOError:
+                continue
+            finally:
+                if lock is not None:
+                    lock.close()
+            total -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return '%d hits, %d misses (%.0f%% hit rate), %d entries' % (
+            self.hits, self.misses, 100. * self.hits / max(lookups, 1), len(self.index))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CachedFrontend(object):
+    """
+    Drop-in for a frontend with a run(img) -> (pts, desc, heatmap) method, answering from the cache. The
+    frontend is only built, by make_frontend(), on the first miss. Cached results have no heatmap.
+    """
+
+    def __init__(self, cache, make_frontend):
+        self.cache = cache
+        self.make_frontend = make_frontend
+        self.frontend = None
+
+    def run(self, img):
+        cached = self.cache.get(img)
+        if cached is not None:
+            return cached[0], cached[1], None
+        if self.frontend is None:
+            self.frontend = self.make_frontend()
+        pts, desc, heatmap = self.frontend.run(img)
+        self.cache.put(img, pts, desc)
+        return pts, desc, heatmap
@@ -0,0 +1,157 @@
+"""
+Keypoint frontends of main.py, by name: SuperPoint, SIFT and ORB of OpenCV, and PopSift on the GPU.
+
+A frontend has the interface of SuperPointFrontend: run(img) takes a gray image, float32 in [0, 1], and
+returns the 3 x N keypoints (u, v, confidence), their D x N descriptors, None without keypoints, and a
+heatmap or None. The tracker matches descriptors by their L2 distance against --nn_thresh, so every
+frontend returns unit descriptors.
+
+FRONTENDS maps the name of a frontend to its loader, which builds it from the main.py arguments. Frontends
+of other packages are added with register_frontend, or named on the command line as module:loader, which
+--frontend imports:
+
+    def load(args):
+        return MyFrontend(max_keypoints=args.max_keypoints)
+
+    python src/main.py ... --frontend my_package.features:load
+"""
+
+import importlib
+
+import numpy as np
+import cv2
+import SuperPointPretrainedNetwork.demo_superpoint as sp
+
+import feature_cache
+
+# Inputs from list of default options in superpoint_demo.py.
+WEIGHTS_PATH = 'src/SuperPointPretrainedNetwork/superpoint_v1.pth'
+NMS_DIST = 4
+CONF_THRESH = 0.15  # 0.015
+NN_THRESH = 0.9
+# Keypoints per frame of the frontends that need a target, without --max_keypoints
+ORB_FEATURES = 2000
+POPSIFT_FEATURES = 1000
+
+
+def load_superpoint(cuda=True, nms_dist=NMS_DIST, conf_thresh=CONF_THRESH):
+    print('==> Loading pre-trained network.')
+    # This class runs the SuperPoint network and processes its outputs.
+    fe = sp.SuperPointFrontend(weights_path=WEIGHTS_PATH,
+                               nms_dist=nms_dist,
+                               conf_thresh=conf_thresh,
+                               nn_thresh=NN_THRESH,
+                               cuda=cuda)
+    print('==> Successfully loaded pre-trained network.')
+    return fe
+
+
+def gray_uint8(img):
+    """ The uint8 image a float32 image in [0, 1] was read from """
+    return np.rint(img * 255.).astype(np.uint8)
+
+
+def unit_descriptors(desc):
+    """ D x N descriptors scaled to unit L2 norm """
+    desc = np.asarray(desc, dtype=np.float32)
+    return desc / np.maximum(np.linalg.norm(desc, axis=0), 1.e-12)
+
+
+class OpenCVFrontend(object):
+    """
+    Keypoints and descriptors of an OpenCV detector, e.g. cv2.SIFT_create(). The confidence of a keypoint
+    is its response. Binary descriptors (binary=True, e.g. ORB) are unpacked into bits of +-1/sqrt(bits),
+    so that the squared L2 distance of two descriptors is 4 times their Hamming distance over the bits.
+    """
+
+    def __init__(self, detector, binary=False):
+        self.detector = detector
+        self.binary = binary
+
+    def run(self, img):
+        keypoints, descriptors = self.detector.detectAndCompute(gray_uint8(img), None)
+        if descriptors is None or len(keypoints) == 0:
+            return np.zeros((3, 0)), None, None
+        pts = np.array([[kp.pt[0], kp.pt[1], kp.response] for kp in keypoints]).T
+        if self.binary:
+            bits = np.unpackbits(descriptors, axis=1).T.astype(np.float32)
+            desc = (2. * bits - 1.) / np.sqrt(bits.shape[0])
+        else:
+            desc = unit_descriptors(descriptors.T)
+        return pts, desc, None
+
+
+class PopSiftFrontend(object):
+    """ SIFT keypoints and descriptors of PopSift on the GPU, through pypopsift """
+
+    def __init__(self, max_keypoints=POPSIFT_FEATURES, peak_threshold=0.1, edge_threshold=10.):
+        from pypopsift import popsift
+        self.popsift = popsift
+        self.max_keypoints = max_keypoints
+        self.peak_threshold = peak_threshold
+        self.edge_threshold = edge_threshold
+
+    def run(self, img):
+        keypoints, descriptors = self.popsift(gray_uint8(img), peak_threshold=self.peak_threshold,
+                                              edge_threshold=self.edge_threshold,
+                                              target_num_features=self.max_keypoints, downsampling=-1)
+        if len(keypoints) == 0:
+            return np.zeros((3, 0)), None, None
+        # Rows start with u, v and the confidence
+        pts = np.asarray(keypoints, dtype=float)[:, :3].T
+        return pts, unit_descriptors(np.asarray(descriptors).T), None
+
+
+def _load_superpoint(args):
+    return load_superpoint(args.cuda, args.nms_dist, args.conf_thresh)
+
+
+def _load_sift(args):
+    return OpenCVFrontend(cv2.SIFT_create(nfeatures=args.max_keypoints or 0, nOctaveLayers=3, contrastThreshold=0.04,
+                                          edgeThreshold=10, sigma=1.6))
+
+
+def _load_orb(args):
+    return OpenCVFrontend(cv2.ORB_create(nfeatures=args.max_keypoints or ORB_FEATURES), binary=True)
+
+
+def _load_popsift(args):
+    return PopSiftFrontend(args.max_keypoints or POPSIFT_FEATURES)
+
+
+FRONTENDS = {
+    'superpoint': _load_superpoint,
+    'sift': _load_sift,
+    'orb': _load_orb,
+    'popsift': _load_popsift,
+}
+
+
+def register_frontend(name, loader):
+    """ Make the frontend built by loader(args) available as --frontend name """
+    FRONTENDS[name] = loader
+
+
+def frontend_loader(name):
+    """ Loader of the frontend name: a registered one, or the loader function of module:loader """
+    if name in FRONTENDS:
+        return FRONTENDS[name]
+    module, sep, function = name.partition(':')
+    if not sep:
+        raise ValueError('unknown frontend %s, expected one of %s or module:loader' % (name, ', '.join(sorted(FRONTENDS))))
+    try:
+        return getattr(importlib.import_module(module), function)
+    except (ImportError, AttributeError) as e:
+        raise ValueError('cannot load frontend %s: %s' % (name, e))
+
+
+def load_frontend(args):
+    """ The frontend args.frontend, built from args """
+    return frontend_loader(args.frontend)(args)
+
+
+def cache_key(args):
+    """ Feature cache key of the frontend of args, see feature_cache.frontend_key """
+    if args.frontend == 'superpoint':
+        return feature_cache.frontend_key(WEIGHTS_PATH, nms_dist=args.nms_dist, conf_thresh=args.conf_thresh)
+    return feature_cache.frontend_key(frontend=args.frontend, max_keypoints=args.max_keypoints)
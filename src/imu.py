@@ -0,0 +1,81 @@
+"""
+High-rate IMU input: the 100 Hz OXTS stream of the unsynced KITTI drives, and its preintegration
+between keyframes.
+
+The samples of every keyframe interval are found with one timestamp search over the whole stream and
+handed to the preintegrator as contiguous slices, with the time steps precomputed.
+"""
+
+import datetime
+import os
+
+import numpy as np
+
+# Columns of the OXTS packets, see the KITTI raw data devkit (dataformat.txt)
+OXTS_VEL = [8, 9, 10]     # vf, vl, vu
+OXTS_ACC = [14, 15, 16]   # af, al, au
+OXTS_OMEGA = [20, 21, 22] # wf, wl, wu
+
+
+def read_timestamps(path):
+    """ Seconds since the epoch of every line of a KITTI timestamps.txt file. """
+    times = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                # Nanosecond timestamps: keep microseconds for datetime.
+                t = datetime.datetime.strptime(line.strip()[:26], '%Y-%m-%d %H:%M:%S.%f')
+                times.append(t.replace(tzinfo=datetime.timezone.utc).timestamp())
+    return np.array(times)
+
+
+def load_oxts_stream(basedir, date, drive):
+    """
+    Load the 100 Hz OXTS stream of the unsynced drive <date>_drive_<drive>_extract.
+
+    Returns
+      times - N array of seconds since the epoch.
+      vel, acc, omega - Nx3 arrays of body velocity, acceleration and angular rate.
+    """
+    oxts_path = os.path.join(basedir, date, date + '_drive_' + drive + '_extract', 'oxts')
+    times = read_timestamps(os.path.join(oxts_path, 'timestamps.txt'))
+    data_path = os.path.join(oxts_path, 'data')
+    packets = []
+    for filename in sorted(f for f in os.listdir(data_path) if f.endswith('.txt')):
+        with open(os.path.join(data_path, filename)) as f:
+            packets.append(np.array(f.read().split(), dtype=float))
+    packets = np.array(packets)
+    return times, packets[:, OXTS_VEL], packets[:, OXTS_ACC], packets[:, OXTS_OMEGA]
+
+
+def imu_segments(keyframe_times, imu_times, acc, omega):
+    """
+    Split an IMU stream into the measurements between consecutive keyframes.
+
+    Each sample is held until the next sample or keyframe, so the interval between two keyframes starts
+    with the last sample before the first keyframe. Samples outside the keyframe span are ignored.
+
+    Returns a list with one (acc, omega, dt) tuple of arrays per keyframe interval.
+    """
+    bounds = np.searchsorted(imu_times, keyframe_times, side='right')
+    segments = []
+    for k in range(1, len(keyframe_times)):
+        lo, hi = bounds[k - 1], bounds[k]
+        t = np.concatenate(([keyframe_times[k - 1]], imu_times[lo:hi], [keyframe_times[k]]))
+        dt = np.diff(t)
+        first = max(lo - 1, 0)
+        a = acc[first:hi]
+        w = omega[first:hi]
+        if lo == 0:
+            # No sample before the first keyframe: start with the first sample.
+            a = np.concatenate((acc[:1], a))
+            w = np.concatenate((omega[:1], w))
+        keep = dt > 0
+        segments.append((a[keep], w[keep], dt[keep]))
+    return segments
+
+
+def integrate_measurements(accum, acc, omega, dt):
+    """ Feed consecutive measurements to a gtsam preintegrator. """
+    for a, w, d in zip(acc, omega, dt):
+        accum.integrateMeasurement(a, w, d)
@@ -0,0 +1,85 @@
+"""
+Selection of the keyframes that become states in the factor graph.
+
+A fixed stride (n_skip) gives a parked car as many keyframes as a car at highway speed. The adaptive
+policy walks the tracked frames instead and starts a new keyframe once the motion since the last one is
+worth a state: the median parallax of the tracks seen in both frames, the fraction of the tracks of the last
+keyframe that survived, and the translation and rotation dead-reckoned from the IMU. Frames where the IMU
+shows no motion are dropped whatever the tracks do, so the graph grows with the distance driven instead of
+the time elapsed.
+"""
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+KEYFRAME_POLICIES = ('stride', 'adaptive')
+
+
+def keyframe_frames(n_skip, n_frames):
+    """ Frame index of every keyframe: every n_skip-th frame, or n_skip itself if it is an array of frame indices. """
+    if np.ndim(n_skip) == 0:
+        return np.arange(0, n_frames, int(n_skip))
+    return np.asarray(n_skip, dtype=int)
+
+
+def imu_motion(measured_vel, measured_omega, delta_t):
+    """
+    Dead-reckoned motion of every frame relative to the first: N x 3 x 3 rotations integrated from the
+    angular velocity, and N x 3 positions integrated from the body velocity (OXTS vf, vl, vu) rotated by
+    them. Each step uses the measurement of the frame it ends at, like add_imu_measurements.
+    """
+    n_frames = measured_vel.shape[0]
+    steps = Rotation.from_rotvec(measured_omega[1:] * delta_t[:, None]).as_matrix()
+    rotations = np.tile(np.eye(3), (n_frames, 1, 1))
+    positions = np.zeros((n_frames, 3))
+    for k in range(1, n_frames):
+        positions[k] = positions[k - 1] + rotations[k - 1] @ measured_vel[k] * delta_t[k - 1]
+        rotations[k] = rotations[k - 1] @ steps[k - 1]
+    return rotations, positions
+
+
+def select_keyframes(vision_data, rotations, positions, min_parallax=50., min_survival=0.5, max_translation=10.,
+                     max_rotation=np.radians(10.), min_translation=0.5, min_rotation=np.radians(1.)):
+    """
+    Pick the keyframes among the tracked frames.
+
+    Inputs
+      vision_data - M x N x 2 int array of keypoint tracks, -1 where a track has no observation.
+      rotations, positions - dead-reckoned motion of the first K <= N tracked frames, see imu_motion.
+      min_parallax - median displacement in pixels of the tracks seen in both frames that makes a keyframe.
+      min_survival - fraction of the tracks of the last keyframe still observed below which a frame is a keyframe.
+      max_translation, max_rotation - motion in meters and radians that makes a keyframe whatever the tracks.
+      min_translation, min_rotation - motion below both of which the vehicle is stationary and frames are dropped.
+    Returns
+      Sorted indices of the keyframes among the K frames, starting with the first frame.
+    """
+    observed = vision_data[:, :, 0] >= 0
+    keyframes = [0]
+    last = 0
+    for k in range(1, positions.shape[0]):
+        translation = np.linalg.norm(positions[k] - positions[last])
+        cos_angle = (np.trace(rotations[last].T @ rotations[k]) - 1.) / 2.
+        rotation = np.arccos(np.clip(cos_angle, -1., 1.))
+        if translation < min_translation and rotation < min_rotation:
+            continue
+
+        common = observed[:, last] & observed[:, k]
+        survival = common.sum() / max(observed[:, last].sum(), 1)
+        parallax = 0.
+        if common.any():
+            parallax = np.median(np.linalg.norm(vision_data[common, k] - vision_data[common, last], axis=1))
+
+        if (parallax >= min_parallax or survival < min_survival or translation >= max_translation
+                or rotation >= max_rotation):
+            keyframes.append(k)
+            last = k
+    return np.array(keyframes, dtype=int)
+
+
+def keyframe_tracks(vision_data, keyframes):
+    """
+    The columns of vision_data at the keyframes, followed by an empty column: like main.get_vision_data,
+    the last column holds no observations and add_keypoints skips it.
+    """
+    empty = -1 * np.ones((vision_data.shape[0], 1, 2), dtype=vision_data.dtype)
+    return np.concatenate((vision_data[:, keyframes], empty), axis=1)
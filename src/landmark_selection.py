@@ -0,0 +1,90 @@
+"""
+Selection of the keypoint tracks that become landmarks in the factor graph.
+
+Tracks are scored by their length, their descriptor match score and how sparsely their image region is
+covered, bucketed by the image cell of their first observation in each keyframe, and cut to a budget of
+landmarks and projection factors. Everything works on the dense M x N x 2 vision_data array of
+main.get_vision_data, without a Python loop over tracks.
+"""
+
+import numpy as np
+
+
+def track_lengths(vision_data):
+    """ Number of observations of every track. """
+    return np.sum(vision_data[:, :, 0] >= 0, axis=1)
+
+
+def valid_tracks(vision_data, max_length_ratio=0.5):
+    """ Tracks observed more than once but in less than max_length_ratio of the keyframes. """
+    N = vision_data.shape[1]
+    length = track_lengths(vision_data)
+    return (length > 1) & (length < max_length_ratio * N)
+
+
+def stride_tracks(vision_data, stride=20):
+    """ Every stride-th track that is valid, the default landmarks of add_keypoints. """
+    valid_track = valid_tracks(vision_data)
+    return [i for i in range(0, vision_data.shape[0], stride) if valid_track[i]]
+
+
+def select_tracks(vision_data, scores=None, nn_thresh=0.9, image_size=(375, 1242), grid=(4, 12),
+                  per_bucket=4, max_landmarks=None, max_factors=None, max_length_ratio=0.5,
+                  weights=(1., 1., 1.)):
+    """
+    Pick the tracks to turn into landmarks.
+
+    Inputs
+      vision_data - M x N x 2 int array of keypoint tracks, -1 where a track has no observation.
+      scores - M array of average descriptor distances of the tracks (lower is better), or None.
+      nn_thresh - descriptor distance used to normalize the scores.
+      image_size - (H, W) of the images.
+      grid - (rows, cols) of the image buckets.
+      per_bucket - tracks kept per bucket, a bucket being an image cell of the keyframe where the track starts.
+      max_landmarks, max_factors - budget of landmarks and of projection factors (one per observation).
+      weights - weights of the length, match score and coverage terms of the priority.
+    Returns
+      Sorted indices of the selected tracks.
+    """
+    M, N = vision_data.shape[:2]
+    if M == 0:
+        return np.zeros(0, dtype=int)
+
+    observed = vision_data[:, :, 0] >= 0
+    length = observed.sum(axis=1)
+    candidates = np.flatnonzero(valid_tracks(vision_data, max_length_ratio))
+    if candidates.shape[0] == 0:
+        return candidates
+
+    # Bucket of every track: image cell of its first observation, in the keyframe of that observation.
+    H, W = image_size
+    head = np.argmax(observed[candidates], axis=1)
+    uv = vision_data[candidates, head]
+    row = np.minimum(uv[:, 1] * grid[0] // H, grid[0] - 1)
+    col = np.minimum(uv[:, 0] * grid[1] // W, grid[1] - 1)
+    bucket = (head * grid[0] + row) * grid[1] + col
+    _, bucket_idx, bucket_count = np.unique(bucket, return_inverse=True, return_counts=True)
+
+    # Priority: long tracks, good matches, sparsely covered image regions.
+    length_term = length[candidates] / float(N)
+    if scores is None:
+        score_term = np.zeros(candidates.shape[0])
+    else:
+        score_term = 1. - np.clip(scores[candidates] / nn_thresh, 0., 1.)
+    coverage_term = 1. / bucket_count[bucket_idx]
+    priority = weights[0] * length_term + weights[1] * score_term + weights[2] * coverage_term
+
+    # Keep the best per_bucket tracks of each bucket.
+    order = np.lexsort((-priority, bucket_idx))
+    first = np.searchsorted(bucket_idx[order], bucket_idx[order])
+    rank = np.arange(order.shape[0]) - first
+    keep = order[rank < per_bucket]
+
+    # Spend the budget on the remaining tracks by decreasing priority.
+    keep = keep[np.argsort(-priority[keep], kind='stable')]
+    if max_landmarks is not None:
+        keep = keep[:max_landmarks]
+    if max_factors is not None:
+        keep = keep[np.cumsum(length[candidates[keep]]) <= max_factors]
+
+    return np.sort(candidates[keep])
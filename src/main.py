@@ -1,10 +1,25 @@
 import numpy as np
 import VisualInertialOdometry as vio
+import synthetic
+import landmark_selection
+import keyframe_selection
+import calibration
+import imu
+import reprojection
+import stereo
+import solve
+import feature_cache
+import trajectory
+import evaluation
+import profiling
+import streaming
+import frontends
 import pykitti
 import argparse
 import SuperPointPretrainedNetwork.demo_superpoint as sp
 import cv2
 import os
+from time import perf_counter
 from scipy.spatial.transform import Rotation as R
 
 import gtsam
@@ -14,9 +29,13 @@ import matplotlib.pyplot as plt
 #plt.rc('text', usetex=True)
 plt.rc('font', size=16)
 
+# Share of --memory_budget above which the depth images are read on demand instead of all at once
+DEPTH_BUDGET_FRACTION = 0.25
+
 def get_theta(rotation):
     return R.from_matrix(rotation).as_euler('xyz')
 
+@profiling.timed('observations')
 def get_vision_data(tracker):
     """ Get keypoint-data pairs from the tracks. 
     """
@@ -37,21 +56,212 @@ def get_vision_data(tracker):
         vision_data[j, i] = np.array([int(round(pt2[0])), int(round(pt2[1]))])
     return vision_data
 
-
-if __name__ == '__main__':
-    # Input arguments
+def instrument_frontend(fe):
+    """
+    Time the network forward pass (inference) and the non-maximum suppression (nms) of the SuperPoint
+    frontend fe, and the rest of its run (decode: heatmap decoding, border removal and descriptor
+    sampling). The sections are only recorded while the timers are enabled; fe is instrumented once.
+    """
+    if getattr(fe, 'instrumented', False):
+        return fe
+    timers = profiling.timers
+    forward, nms_fast, run = fe.net.forward, fe.nms_fast, fe.run
+
+    def timed_forward(*args):
+        if not timers.enabled:
+            return forward(*args)
+        with timers.section('inference'):
+            outs = forward(*args)
+            if fe.cuda:
+                # Wait for the asynchronous kernels, which would otherwise be charged to decode
+                import torch
+                torch.cuda.synchronize()
+        return outs
+
+    def timed_run(img):
+        if not timers.enabled:
+            return run(img)
+        durations = timers.durations
+        n_inference, n_nms = len(durations['inference']), len(durations['nms'])
+        start = perf_counter()
+        outs = run(img)
+        nested = sum(durations['inference'][n_inference:]) + sum(durations['nms'][n_nms:])
+        timers.record('decode', perf_counter() - start - nested)
+        return outs
+
+    fe.net.forward = timed_forward
+    fe.nms_fast = timers.timed('nms')(nms_fast)
+    fe.run = timed_run
+    fe.instrumented = True
+    return fe
+
+
+def build_parser():
+    """ Command line options of main.py, also parsed into the runs of batch.py """
     parser = argparse.ArgumentParser(description='Visual Inertial Odometry of KITTI dataset.')
     parser.add_argument('--basedir', dest='basedir', type=str)
     parser.add_argument('--date', dest='date', type=str)
     parser.add_argument('--drive', dest='drive', type=str)
     parser.add_argument('--n_skip', dest='n_skip', type=int, default=1)
     parser.add_argument('--n_frames', dest='n_frames', type=int, default=None)
-    args = parser.parse_args()
-
-    fig, axs = plt.subplots(1, figsize=(12, 8), facecolor='w', edgecolor='k')
-    plt.subplots_adjust(right=0.95, left=0.1, bottom=0.17)
+    parser.add_argument('--keyframes', dest='keyframes', type=str, default='stride', choices=keyframe_selection.KEYFRAME_POLICIES,
+                        help='Every n_skip-th frame (stride), or keyframes picked among them by parallax, track survival and IMU motion (adaptive).')
+    parser.add_argument('--min_parallax', dest='min_parallax', type=float, default=50.,
+                        help='Median track parallax in pixels that makes an adaptive keyframe.')
+    parser.add_argument('--min_survival', dest='min_survival', type=float, default=0.5,
+                        help='Fraction of surviving tracks of the last keyframe below which a frame is an adaptive keyframe.')
+    parser.add_argument('--max_translation', dest='max_translation', type=float, default=10.,
+                        help='IMU translation in meters that makes an adaptive keyframe whatever the tracks.')
+    parser.add_argument('--min_translation', dest='min_translation', type=float, default=0.5,
+                        help='IMU translation in meters below which the vehicle is stationary and frames are dropped.')
+    parser.add_argument('--imu_stream', dest='imu_stream', action='store_true',
+                        help='Preintegrate the 100 Hz OXTS stream of the unsynced drive instead of the synced 10 Hz samples.')
+    parser.add_argument('--init', dest='init', type=str, default='perturbed', choices=vio.INITIALIZATIONS,
+                        help='Initial keyframe states: ground truth with random offsets, or IMU dead reckoning.')
+    parser.add_argument('--init_velocity', dest='init_velocity', type=str, default='measured', choices=['measured', 'predicted'],
+                        help='With --init imu, reset the velocity to the measured OXTS velocity at each keyframe or keep the propagated one.')
+    parser.add_argument('--camera', dest='camera', type=int, default=1,
+                        help='Camera whose images are tracked (calibration is read from the calib files of the date, '
+                             'depth maps from proj_depth/groundtruth/image_02 or image_03 on the side of the camera).')
+    parser.add_argument('--synthetic', dest='synthetic', action='store_true',
+                        help='Load the drive written by synthetic.py instead of the KITTI raw data.')
+    parser.add_argument('--smart_factors', dest='smart_factors', action='store_true',
+                        help='Model each track with a smart projection factor instead of a landmark variable. Needs --init imu.')
+    parser.add_argument('--frontend', dest='frontend', type=str, default='superpoint',
+                        help='Keypoint frontend: one of %s, or module:loader of an external one (see frontends.py).'
+                             % ', '.join(sorted(frontends.FRONTENDS)))
+    parser.add_argument('--max_keypoints', dest='max_keypoints', type=int, default=None,
+                        help='Keypoints per frame of the sift, orb and popsift frontends, by default all SIFT keypoints, '
+                             '%d ORB and %d PopSift ones.' % (frontends.ORB_FEATURES, frontends.POPSIFT_FEATURES))
+    parser.add_argument('--nms_dist', dest='nms_dist', type=int, default=frontends.NMS_DIST,
+                        help='Non-maximum suppression distance of the SuperPoint keypoints in pixels.')
+    parser.add_argument('--conf_thresh', dest='conf_thresh', type=float, default=frontends.CONF_THRESH,
+                        help='Detection threshold of the SuperPoint keypoints.')
+    parser.add_argument('--nn_thresh', dest='nn_thresh', type=float, default=frontends.NN_THRESH,
+                        help='Descriptor distance threshold of the track matches.')
+    parser.add_argument('--landmark_selection', dest='landmark_selection', type=str, default='stride',
+                        choices=['stride', 'bucketed'],
+                        help='Every LANDMARK_STRIDE-th track (stride) or scored tracks bucketed per image cell (bucketed).')
+    parser.add_argument('--landmark_stride', dest='landmark_stride', type=int, default=20)
+    parser.add_argument('--per_bucket', dest='per_bucket', type=int, default=4)
+    parser.add_argument('--max_landmarks', dest='max_landmarks', type=int, default=None)
+    parser.add_argument('--max_factors', dest='max_factors', type=int, default=None)
+    parser.add_argument('--landmark_depth', dest='landmark_depth', type=str, default='depth_maps',
+                        choices=['depth_maps', 'stereo', 'none'],
+                        help='Initialize the landmarks from the annotated depth maps, or by stereo matching of the track heads '
+                             'in the rectified pair of the tracked camera (cam0/cam1, cam2/cam3). none needs --triangulate.')
+    parser.add_argument('--triangulate', dest='triangulate', action='store_true',
+                        help='Triangulate the landmarks from all their observations, falling back to --landmark_depth for '
+                             'tracks failing the cheirality or parallax checks.')
+    parser.add_argument('--stereo_factors', dest='stereo_factors', action='store_true',
+                        help='With --landmark_depth stereo, use a stereo factor instead of a projection factor at each track head.')
+    parser.add_argument('--gate', dest='gate', type=float, default=None,
+                        help='Drop observations reprojecting more than GATE pixels from their initial landmark, with the '
+                             'initial keyframe poses: use it with --init imu, the perturbed poses are meters off.')
+    parser.add_argument('--robust_kernel', dest='robust_kernel', type=str, default=None,
+                        choices=sorted(reprojection.ROBUST_KERNELS),
+                        help='M-estimator of the projection factors.')
+    parser.add_argument('--feature_cache', dest='feature_cache', type=str, default=None,
+                        help='Directory caching the keypoints and descriptors of the frontend for every frame.')
+    parser.add_argument('--feature_cache_size', dest='feature_cache_size', type=float, default=4096,
+                        help='Size in MB above which the least recently used drives are evicted from the feature cache.')
+    parser.add_argument('--export', dest='export', type=str, default=None,
+                        help='Write the IMU-only, VIO and ground truth keyframe trajectories into this directory, '
+                             'in KITTI odometry and TUM format.')
+    parser.add_argument('--save_problem', dest='save_problem', type=str, default=None,
+                        help='Save the built graphs into this directory for solve.py.')
+    parser.add_argument('--cpu', dest='cuda', action='store_false',
+                        help='Run the SuperPoint network on the CPU.')
+    parser.add_argument('--no_viz', dest='viz_tracking', action='store_false',
+                        help='Do not show the tracks while running the frontend.')
+    parser.add_argument('--profile', dest='profile', type=str, default=None,
+                        help='Time the pipeline stages and write their per-frame times and p50/p95/p99 into this JSON file.')
+    parser.add_argument('--cprofile', dest='cprofile', type=str, default=None,
+                        help='Run under cProfile and write its statistics into this file.')
+    parser.add_argument('--profile_memory', dest='profile_memory', action='store_true',
+                        help='With --profile, also sample the traced Python heap and the resident memory of every section.')
+    parser.add_argument('--memory_budget', dest='memory_budget', type=float, default=None,
+                        help='Memory budget in MB: track with a streaming tracker, read the depth images on demand if '
+                             'they take more than a quarter of the budget, and release every stage output once consumed.')
+    solve.add_solver_arguments(parser)
+    return parser
+
+
+def check_arguments(parser, args):
+    solve.check_solver_arguments(parser, args)
+    try:
+        frontends.frontend_loader(args.frontend)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.landmark_depth == 'stereo' and args.synthetic:
+        parser.error('--landmark_depth stereo needs the KITTI images and cannot be combined with --synthetic')
+    if args.stereo_factors and args.landmark_depth != 'stereo':
+        parser.error('--stereo_factors needs --landmark_depth stereo')
+    if args.smart_factors and args.init != 'imu':
+        parser.error('--smart_factors needs --init imu: smart factors triangulate their landmark from the initial '
+                     'poses, which are meters off with --init perturbed')
+    if args.landmark_depth == 'none' and not args.triangulate:
+        parser.error('--landmark_depth none needs --triangulate')
+    if args.profile_memory and args.profile is None:
+        parser.error('--profile_memory needs --profile')
+    if args.fixed_lag is not None and (args.save_problem is not None or args.warm_start):
+        parser.error('--save_problem and --warm_start need the whole graph, which --fixed_lag builds one keyframe at a time')
+    if args.memory_budget is not None and args.concurrent:
+        parser.error('--concurrent holds both solves in memory at once and cannot be combined with --memory_budget')
+
+
+class LoadedDrive(object):
+    """
+    Measurements of a drive, see load_drive: the frame times and time steps, the OXTS velocity,
+    acceleration and angular velocity, the poses relative to the first frame, the depth images (None
+    unless --landmark_depth depth_maps), the 100 Hz IMU stream (None without --imu_stream), the camera
+    calibration, and the pykitti.raw or synthetic.SyntheticDrive it was read from.
+    """
 
-    viz_tracking = True
+    def __init__(self, time, delta_t, measured_vel, measured_acc, measured_omega, measured_poses, depth, imu_stream,
+                 CALIBRATION, data=None, synthetic_drive=None):
+        self.time = time
+        self.delta_t = delta_t
+        self.measured_vel = measured_vel
+        self.measured_acc = measured_acc
+        self.measured_omega = measured_omega
+        self.measured_poses = measured_poses
+        self.depth = depth
+        self.imu_stream = imu_stream
+        self.CALIBRATION = CALIBRATION
+        self.data = data
+        self.synthetic_drive = synthetic_drive
+
+    @property
+    def n_frames(self):
+        return self.time.shape[0]
+
+
+def depth_folder(camera):
+    """
+    Folder of the annotated depth maps for camera, which only exist for the color cameras: a gray camera
+    takes those of the color camera on its side of the rig (cam0/cam2 left, cam1/cam3 right), 6 cm away.
+    """
+    return 'image_%02d' % (2 + camera % 2)
+
+
+@profiling.timed('load')
+def load_drive(args):
+    """ Load the KITTI raw or synthetic drive of args into a LoadedDrive """
+    if args.synthetic:
+        """
+        Load synthetic drive
+        """
+        drive = synthetic.load_scenario(args.basedir, args.date, args.drive)
+
+        n_frames = drive.time.shape[0] if args.n_frames is None else args.n_frames
+        time = drive.time[:n_frames]
+        measured_poses = np.linalg.inv(drive.poses[0]) @ drive.poses[:n_frames]
+        depth = drive.depth(n_frames) if args.landmark_depth == 'depth_maps' else None
+        imu_stream = drive.imu_stream() if args.imu_stream else None
+        CALIBRATION = calibration.CameraCalibration(drive.K, drive.imu_to_cam, drive.image_size)
+        return LoadedDrive(time, np.diff(time), drive.vel[:n_frames], drive.acc[:n_frames], drive.omega[:n_frames],
+                           measured_poses, depth, imu_stream, CALIBRATION, synthetic_drive=drive)
 
     """ 
     Load KITTI raw data
@@ -84,54 +294,171 @@ if __name__ == '__main__':
     measured_poses = np.array([data.oxts[k][1] for k in range(n_frames)])
     measured_poses = np.linalg.inv(measured_poses[0]) @ measured_poses
 
+    # High-rate IMU, with time relative to the first synced frame
+    imu_stream = None
+    if args.imu_stream:
+        imu_times, _, imu_acc, imu_omega = imu.load_oxts_stream(args.basedir, args.date, args.drive)
+        t0 = imu.read_timestamps(os.path.join(data.data_path, 'oxts', 'timestamps.txt'))[0]
+        imu_stream = (imu_times - t0, imu_acc, imu_omega)
+
     """
-    Load depth data
+    Load depth data, unless the landmarks are initialized by stereo matching or triangulation only
     """
-    depth_data_path = os.path.join(args.basedir, args.date, '2011_09_26_drive_' + args.drive + '_sync/proj_depth/groundtruth/image_02')
-    depth = []
+    depth = None
+    if args.landmark_depth == 'depth_maps':
+        depth_data_path = os.path.join(args.basedir, args.date, args.date + '_drive_' + args.drive + '_sync/proj_depth/groundtruth',
+                                       depth_folder(args.camera))
+        paths = [os.path.join(depth_data_path, filepath) for filepath in sorted(os.listdir(depth_data_path)) if filepath[0] != '.']
+        depth = streaming.LazyImages(paths, cv2.imread)
+
+        # Load in the images, unless they would take too much of the memory budget
+        if args.memory_budget is not None and len(paths) * depth[0].nbytes > DEPTH_BUDGET_FRACTION * args.memory_budget * 2**20:
+            print('==> Reading the depth images on demand')
+        else:
+            depth = [cv2.imread(path) for path in paths]
+
+    CALIBRATION = calibration.load_calibration(args.basedir, args.date, args.camera)
+    return LoadedDrive(time, delta_t, measured_vel, measured_acc, measured_omega, measured_poses, depth, imu_stream,
+                       CALIBRATION, data=data)
+
 
-    # Load in the images
-    for filepath in sorted(os.listdir(depth_data_path)):
-        if filepath[0] == '.':
-            continue
-        depth.append(cv2.imread(os.path.join(depth_data_path, filepath)))
+@profiling.timed('load_image')
+def load_image(args, drive, frame):
+    """ Gray image of the tracked camera at frame, as float32 in [0, 1] """
+    img = getattr(drive.data, 'get_cam%d' % args.camera)(frame)
+    return np.array(img).astype('float32') / 255.0
 
+
+def extract_features(args, drive, frontend_loader=None):
+    """
+    Run the keypoint frontend args.frontend (see frontends.py): yields (frame, pts, desc) for every
+    n_skip-th frame of a KITTI drive, one frame at a time. frontend_loader() returns the frontend, by
+    default a freshly loaded one; a SuperPoint frontend is configured with the nms_dist and conf_thresh of
+    args, so that one network can serve runs with different parameters.
+    """
+    if frontend_loader is None:
+        frontend_loader = lambda: frontends.load_frontend(args)
+
+    def make_frontend():
+        fe = frontend_loader()
+        if args.frontend == 'superpoint':
+            fe.nms_dist = args.nms_dist
+            fe.conf_thresh = args.conf_thresh
+            if profiling.timers.enabled:
+                instrument_frontend(fe)
+        return fe
+
+    if args.feature_cache is not None:
+        # The frontend is only loaded if a frame is missing from the cache
+        cache = feature_cache.FeatureCache(args.feature_cache, '%s_%s_cam%d' % (args.date, args.drive, args.camera),
+                                           frontends.cache_key(args), max_bytes=int(args.feature_cache_size * 2**20))
+        fe = feature_cache.CachedFrontend(cache, make_frontend)
+    else:
+        fe = make_frontend()
+
+    print('==> Running the %s frontend' % args.frontend)
+    try:
+        for i in range(0, drive.n_frames, args.n_skip):
+            profiling.timers.set_frame(i)
+            img = load_image(args, drive, i)
+            with profiling.section('features'):
+                pts, desc, _ = fe.run(img)
+            yield i, pts, desc
+    finally:
+        profiling.timers.set_frame(None)
+        if args.feature_cache is not None:
+            cache.close()
+            print('==> Feature cache:', cache.stats())
+
+
+def confident_keypoints(args, pts, desc):
     """
-    Run superpoint to get keypoints
+    The SuperPoint keypoints pts and descriptors desc above args.conf_thresh: non-maximum suppression only
+    lets a keypoint suppress weaker ones, so features extracted at a lower threshold give the same tracks.
+    The keypoints of other frontends are all kept, their confidence being on another scale.
     """
-    print('==> Loading pre-trained network.')
-    # This class runs the SuperPoint network and processes its outputs.
-    # Inputs from list of default options in superpoint_demo.py.
-    fe = sp.SuperPointFrontend(weights_path='src/SuperPointPretrainedNetwork/superpoint_v1.pth',
-                            nms_dist=4,
-                            conf_thresh=0.15,  # 0.015
-                            nn_thresh=0.9,
-                            cuda=True)
-    print('==> Successfully loaded pre-trained network.')
+    if desc is None or args.frontend != 'superpoint':
+        return pts, desc
+    keep = pts[2] >= args.conf_thresh
+    return pts[:, keep], desc[:, keep]
+
 
-    # This class helps merge consecutive point matches into tracks.
-    max_length = n_frames // args.n_skip + 1
-    tracker = sp.PointTracker(max_length=max_length, nn_thresh=fe.nn_thresh)
+def track_features(args, drive, features):
+    """
+    Merge the (frame, pts, desc) features of extract_features into keypoint tracks, once the SuperPoint
+    keypoints below args.conf_thresh are dropped (see confident_keypoints). Returns the M x N x 2
+    vision_data of get_vision_data and the M track scores. A synthetic drive already holds its tracks.
+    Whichever way they are built, column j holds the keypoints of the j-th tracked frame, frame j * n_skip,
+    and the last column is empty.
+
+    With args.memory_budget the tracks are built by a streaming.StreamingTracker into int16 vision_data,
+    without visualization.
+    """
+    if args.synthetic:
+        n_frames = drive.n_frames
+        vision_data = drive.synthetic_drive.vision_data(args.n_skip, n_frames)
+        if args.memory_budget is not None:
+            vision_data = vision_data.astype(np.int16)
+        return vision_data, drive.synthetic_drive.track_scores(args.n_skip, n_frames)
+
+    if args.memory_budget is not None:
+        tracker = streaming.StreamingTracker(sp.PointTracker(max_length=2, nn_thresh=args.nn_thresh), args.nn_thresh)
+        for i, pts, desc in features:
+            pts, desc = confident_keypoints(args, pts, desc)
+            with profiling.section('track'):
+                tracker.update(pts, desc)
+        profiling.timers.set_frame(None)
+
+        print('==> Extracting keypoint tracks')
+        with profiling.section('observations'):
+            return tracker.vision_data(), tracker.scores
+
+    # This class helps merge consecutive point matches into tracks. With one more slot than tracked frames
+    # the window starts with an empty frame, so that get_vision_data puts the j-th tracked frame in column j.
+    max_length = len(range(0, drive.n_frames, args.n_skip)) + 1
+    tracker = sp.PointTracker(max_length=max_length, nn_thresh=args.nn_thresh)
+
+    for i, pts, desc in features:
+        pts, desc = confident_keypoints(args, pts, desc)
+        with profiling.section('track'):
+            tracker.update(pts, desc)
 
-    print('==> Running SuperPoint')
-    idx = range(0, n_frames, args.n_skip)
-    for i in idx:
-        img = data.get_cam1(i) # only get image from cam0
-        img_np = np.array(img).astype('float32') / 255.0
-        pts, desc, _ = fe.run(img_np)
-        tracker.update(pts, desc)
-        
         # visualize the tracking
-        if viz_tracking:
+        if args.viz_tracking:
+            img_np = load_image(args, drive, i)
             tracks = tracker.get_tracks(2)
             tracks[:, 1] /= float(0.9)
             out1 = (np.dstack((img_np, img_np, img_np)) * 255.).astype('uint8')
             tracker.draw_tracks(out1, tracks)
             cv2.imshow("out1", out1)
             cv2.waitKey(1)
+    profiling.timers.set_frame(None)
 
     print('==> Extracting keypoint tracks')
-    vision_data = get_vision_data(tracker)
+    return get_vision_data(tracker), tracker.tracks[:, 1]
+
+
+@profiling.timed('graph')
+def build_graphs(args, drive, vision_data, track_scores, axs=None):
+    """
+    Select the keyframes and the landmarks and build the IMU-only and VIO graphs. Landmarks are scattered
+    into axs if given. Returns the frame index of every keyframe and both graphs. With --fixed_lag the graphs
+    are left empty and stream their factors into the smoother instead, see VisualInertialOdometryGraph.updates.
+    """
+    """
+    Select keyframes among the tracked frames
+    """
+    keyframe_frames = keyframe_selection.keyframe_frames(args.n_skip, drive.n_frames)
+    if args.keyframes == 'adaptive':
+        with profiling.section('keyframes'):
+            rotations, positions = keyframe_selection.imu_motion(drive.measured_vel, drive.measured_omega, drive.delta_t)
+            selected = keyframe_selection.select_keyframes(vision_data, rotations[keyframe_frames], positions[keyframe_frames],
+                                                           min_parallax=args.min_parallax, min_survival=args.min_survival,
+                                                           max_translation=args.max_translation,
+                                                           min_translation=args.min_translation)
+            vision_data = keyframe_selection.keyframe_tracks(vision_data, selected)
+            keyframe_frames = keyframe_frames[selected]
+    print('==> Using', keyframe_frames.shape[0], 'keyframes of', drive.n_frames, 'frames')
 
     """
     GTSAM parameters
@@ -150,59 +477,199 @@ if __name__ == '__main__':
 
     BIAS_COVARIANCE = gtsam.noiseModel.Isotropic.Variance(6, 0.4)
 
+    keyframe_times = drive.time[keyframe_frames]
+
+    """
+    Select landmarks
+    """
+    with profiling.section('landmarks'):
+        if args.landmark_selection == 'bucketed':
+            # Buckets over the images of the tracked camera, or the KITTI default of select_tracks without S_rect
+            image_size = {} if drive.CALIBRATION.image_size is None else {'image_size': drive.CALIBRATION.image_size}
+            tracks = landmark_selection.select_tracks(vision_data, track_scores, nn_thresh=args.nn_thresh, per_bucket=args.per_bucket,
+                                                      max_landmarks=args.max_landmarks, max_factors=args.max_factors,
+                                                      **image_size)
+        else:
+            tracks = landmark_selection.stride_tracks(vision_data, args.landmark_stride)
+
     """
-    Solve IMU-only graph
+    Stereo depth of the track heads, from the rectified pair of the tracked camera
     """
-    params = gtsam.LevenbergMarquardtParams()
-    params.setMaxIterations(1000)
-    params.setVerbosity('ERROR')
-    params.setVerbosityLM('SUMMARY')
+    stereo_heads = None
+    if args.landmark_depth == 'stereo':
+        partner = args.camera ^ 1
+        rig = stereo.StereoRig(drive.CALIBRATION, calibration.load_calibration(args.basedir, args.date, partner))
 
-    print('==> Solving IMU-only graph')
-    imu_only = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
-    imu_only.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, args.n_skip)
-    result_imu = imu_only.estimate(params)
+        def load_pair(frame):
+            return (stereo.load_gray(getattr(drive.data, 'get_cam%d' % args.camera)(frame)),
+                    stereo.load_gray(getattr(drive.data, 'get_cam%d' % partner)(frame)))
 
+        print('==> Matching track heads in cam%d' % partner)
+        with profiling.section('stereo'):
+            stereo_heads = stereo.match_track_heads(vision_data, tracks, keyframe_frames, load_pair, rig)
+        print('==> Matched', stereo_heads.matched(), 'of', len(tracks), 'track heads')
+
+    """
+    Build graphs: the VIO graph extends the IMU-only graph, sharing its IMU factors and initial estimate
     """
-    Solve VIO graph
+    print('==> Building graphs')
+    imu_only = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE, CALIBRATION=drive.CALIBRATION)
+    imu_args = (drive.measured_poses, drive.measured_acc, drive.measured_omega, drive.measured_vel, drive.delta_t, keyframe_frames)
+    imu_kwargs = dict(imu_stream=drive.imu_stream, initialization=args.init, measured_velocity=args.init_velocity == 'measured')
+    # With dead reckoning the landmarks are initialized from the keyframe poses of the initial estimate
+    keypoint_args = (vision_data, None if args.init == 'imu' else drive.measured_poses, keyframe_frames, drive.depth)
+    keypoint_kwargs = dict(smart=args.smart_factors, tracks=tracks, gate=args.gate, kernel=args.robust_kernel,
+                           stereo=stereo_heads, stereo_factors=args.stereo_factors, triangulate=args.triangulate)
+    if args.fixed_lag is not None:
+        # The smoother builds both graphs one keyframe at a time as it solves them, from the same perturbation
+        seed = np.random.randint(2**31)
+        imu_only.updates = lambda: imu_only.imu_updates(*imu_args, random=np.random.RandomState(seed), **imu_kwargs)
+        vio_full = imu_only.copy()
+        vio_full.updates = lambda: vio_full.keypoint_updates(imu_only.updates(), *keypoint_args, **keypoint_kwargs)
+        return keyframe_frames, imu_only, vio_full
+
+    with profiling.section('imu_factors'):
+        imu_only.add_imu_measurements(*imu_args, **imu_kwargs)
+    vio_full = imu_only.copy()
+    with profiling.section('keypoint_factors'):
+        vio_full.add_keypoints(*keypoint_args, axs, **keypoint_kwargs)
+
+    if args.save_problem is not None:
+        print('==> Saving graphs to', args.save_problem)
+        solve.save_problem(args.save_problem, imu_only, vio_full, drive.measured_poses, keyframe_times, keyframe_frames)
+
+    return keyframe_frames, imu_only, vio_full
+
+
+@profiling.timed('evaluate')
+def evaluate_results(args, drive, keyframe_frames, initial_estimate, result_imu, result_full):
     """
-    params = gtsam.LevenbergMarquardtParams()
-    params.setMaxIterations(1000)
-    params.setlambdaUpperBound(1.e+6)
-    params.setlambdaLowerBound(0.1)
-    params.setDiagonalDamping(1000)
-    params.setVerbosity('ERROR')
-    params.setVerbosityLM('SUMMARY')
-    params.setRelativeErrorTol(1.e-9)
-    params.setAbsoluteErrorTol(1.e-9)
+    Evaluate the IMU-only and VIO solutions against the ground truth keyframe poses and export the
+    trajectories if args.export is set. Returns the result dict of run, without its timings.
+    """
+    traj_imu = trajectory.Trajectory.from_values(result_imu)
+    traj_full = trajectory.Trajectory.from_values(result_full)
+    keyframe_times = drive.time[keyframe_frames]
+    measured_poses = drive.measured_poses
 
-    print('==> Solving VIO graph')
-    vio_full = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS, BIAS_COVARIANCE=BIAS_COVARIANCE)
-    vio_full.add_imu_measurements(measured_poses, measured_acc, measured_omega, measured_vel, delta_t, args.n_skip)
-    vio_full.add_keypoints(vision_data, measured_poses, args.n_skip, depth, axs)
+    """
+    Evaluate against the ground truth keyframe poses
+    """
+    metrics = {}
+    for name, traj in (('IMU-only', traj_imu), ('VIO', traj_full)):
+        metrics[name] = evaluation.evaluate(traj.poses, measured_poses[keyframe_frames][traj.index], alignment='se3',
+                                            rpe_delta=100., rpe_unit='meters')
+        print('==> %s: ATE %.3f m, RPE per 100 m %.3f m / %.3f deg' % (name, metrics[name]['ate_rmse'],
+              metrics[name]['rpe_trans_rmse'], np.degrees(metrics[name]['rpe_rot_rmse'])))
 
-    result_full = vio_full.estimate(SOLVER_PARAMS=params)
+    """
+    Export trajectories
+    """
+    if args.export is not None:
+        print('==> Exporting trajectories to', args.export)
+        os.makedirs(args.export, exist_ok=True)
+        for name, traj in (('imu', traj_imu), ('vio', traj_full)):
+            traj.save_kitti(os.path.join(args.export, name + '_kitti.txt'))
+            traj.save_tum(os.path.join(args.export, name + '_tum.txt'), keyframe_times[traj.index])
+        trajectory.save_kitti(os.path.join(args.export, 'gt_kitti.txt'), measured_poses[keyframe_frames])
+        trajectory.save_tum(os.path.join(args.export, 'gt_tum.txt'), keyframe_times, measured_poses[keyframe_frames])
+
+    return {
+        'time': drive.time,
+        'keyframe_frames': keyframe_frames,
+        'keyframe_times': keyframe_times,
+        'measured_poses': measured_poses,
+        'traj_init': trajectory.Trajectory.from_values(initial_estimate),
+        'traj_imu': traj_imu,
+        'traj_full': traj_full,
+        'metrics': metrics,
+    }
+
+
+def run(args, axs=None, frontend_loader=None):
+    """
+    Run the pipeline for one drive: load the drive, track keypoints, select keyframes and landmarks, build
+    and solve the IMU-only and VIO graphs, evaluate them against the ground truth and export the
+    trajectories if args.export is set. frontend_loader() returns the keypoint frontend, see
+    extract_features; the features are tracked as they are extracted. Landmarks are scattered into axs if
+    given.
+
+    Returns a dict of the frame times, the keyframe frames and times, the ground truth poses, the
+    initial, IMU-only and VIO trajectories, the metrics of both solutions, the wall time of every stage
+    in seconds and the resident memory in MB at the end of every stage.
+    """
+    timings = {}
+    memory = {}
+    start = perf_counter()
+    drive = load_drive(args)
+    timings['load'] = perf_counter() - start
+    memory['load'] = profiling.rss_mb()
+
+    start = perf_counter()
+    features = None if args.synthetic else extract_features(args, drive, frontend_loader)
+    vision_data, track_scores = track_features(args, drive, features)
+    timings['frontend'] = perf_counter() - start
+    memory['frontend'] = profiling.rss_mb()
+
+    start = perf_counter()
+    keyframe_frames, imu_only, vio_full = build_graphs(args, drive, vision_data, track_scores, axs)
+    timings['graph'] = perf_counter() - start
+    memory['graph'] = profiling.rss_mb()
+
+    # Release the stage outputs once consumed
+    del features, vision_data, track_scores
+    drive.depth = None
 
     """
-    Visualize results
+    Solve IMU-only and VIO graphs
+    """
+    start = perf_counter()
+    result_imu, result_full = solve.solve(imu_only, vio_full, args, drive.time[keyframe_frames],
+                                          release=args.memory_budget is not None)
+    timings['solve'] = perf_counter() - start
+    memory['solve'] = profiling.rss_mb()
+    initial_estimate = imu_only.initial_states()
+    del imu_only, vio_full
+
+    start = perf_counter()
+    result = evaluate_results(args, drive, keyframe_frames, initial_estimate, result_imu, result_full)
+    timings['evaluate'] = perf_counter() - start
+    memory['evaluate'] = profiling.rss_mb()
+    result['timings'] = timings
+    result['memory'] = memory
+
+    peak = profiling.peak_rss_mb()
+    if args.memory_budget is not None and peak > args.memory_budget:
+        print('==> Warning: peak resident memory of %.0f MB over the budget of %.0f MB' % (peak, args.memory_budget))
+    return result
+
+
+@profiling.timed('plot')
+def plot_results(result, axs, out_dir='.'):
+    """
+    Visualize the results of run: the path into axs and path.eps, the poses and their errors over time into
+    poses.eps and errors.eps, all in out_dir.
     """
     print('==> Plotting results')
 
+    time = result['time']
+    keyframe_frames = result['keyframe_frames']
+    measured_poses = result['measured_poses']
+    traj_init, traj_imu, traj_full = result['traj_init'], result['traj_imu'], result['traj_full']
+    n_plot = keyframe_frames.shape[0]
+
     x_gt = measured_poses[:,0,3]
     y_gt = measured_poses[:,1,3]
-    theta_gt = np.array([get_theta(measured_poses[k,:3,:3])[2] for k in range(n_frames)])
+    theta_gt = get_theta(measured_poses[:,:3,:3])[:,2]
 
-    x_init = np.array([vio_full.initial_estimate.atPose3(X(k)).translation()[0] for k in range(n_frames//args.n_skip)]) 
-    y_init = np.array([vio_full.initial_estimate.atPose3(X(k)).translation()[1] for k in range(n_frames//args.n_skip)]) 
-    theta_init = np.array([get_theta(vio_full.initial_estimate.atPose3(X(k)).rotation().matrix())[2] for k in range(n_frames//args.n_skip)]) 
+    x_init, y_init = traj_init.positions[:n_plot,:2].T
+    theta_init = traj_init.euler()[:n_plot,2]
 
-    x_est_full = np.array([result_full.atPose3(X(k)).translation()[0] for k in range(n_frames//args.n_skip)]) 
-    y_est_full = np.array([result_full.atPose3(X(k)).translation()[1] for k in range(n_frames//args.n_skip)]) 
-    theta_est_full = np.array([get_theta(result_full.atPose3(X(k)).rotation().matrix())[2] for k in range(n_frames//args.n_skip)]) 
+    x_est_full, y_est_full = traj_full.positions[:n_plot,:2].T
+    theta_est_full = traj_full.euler()[:n_plot,2]
 
-    x_est_imu = np.array([result_imu.atPose3(X(k)).translation()[0] for k in range(n_frames//args.n_skip)]) 
-    y_est_imu = np.array([result_imu.atPose3(X(k)).translation()[1] for k in range(n_frames//args.n_skip)]) 
-    theta_est_imu = np.array([get_theta(result_imu.atPose3(X(k)).rotation().matrix())[2] for k in range(n_frames//args.n_skip)]) 
+    x_est_imu, y_est_imu = traj_imu.positions[:n_plot,:2].T
+    theta_est_imu = traj_imu.euler()[:n_plot,2]
 
     axs.plot(x_gt, y_gt, color='k', label='GT')
     axs.plot(x_init, y_init, 'x-', color='m', label='Initial')
@@ -214,7 +681,7 @@ if __name__ == '__main__':
     plt.grid(True)
 
     plt.legend()
-    plt.savefig('path.eps')
+    plt.savefig(os.path.join(out_dir, 'path.eps'))
 
     # Plot pose as time series
     fig, axs = plt.subplots(3, figsize=(8, 8), facecolor='w', edgecolor='k')
@@ -223,65 +690,79 @@ if __name__ == '__main__':
     # Plot x
     axs[0].grid(True)
     axs[0].plot(time, x_gt, color='k', label='GT')
-    axs[0].plot(time[:n_frames-1:args.n_skip], x_init, color='m', label='Initial')
-    axs[0].plot(time[:n_frames-1:args.n_skip], x_est_imu, color='r', label='IMU')
-    axs[0].plot(time[:n_frames-1:args.n_skip], x_est_full, color='b', label='VIO')
+    axs[0].plot(time[keyframe_frames], x_init, color='m', label='Initial')
+    axs[0].plot(time[keyframe_frames], x_est_imu, color='r', label='IMU')
+    axs[0].plot(time[keyframe_frames], x_est_full, color='b', label='VIO')
     axs[0].set_xlabel('$t\ (s)$')
     axs[0].set_ylabel('$x\ (m)$')
 
     # Plot y
     axs[1].grid(True)
     axs[1].plot(time, y_gt, color='k', label='GT')
-    axs[1].plot(time[:n_frames-1:args.n_skip], y_init, color='m', label='Initial')
-    axs[1].plot(time[:n_frames-1:args.n_skip], y_est_imu, color='r', label='IMU')
-    axs[1].plot(time[:n_frames-1:args.n_skip], y_est_full, color='b', label='VIO')
+    axs[1].plot(time[keyframe_frames], y_init, color='m', label='Initial')
+    axs[1].plot(time[keyframe_frames], y_est_imu, color='r', label='IMU')
+    axs[1].plot(time[keyframe_frames], y_est_full, color='b', label='VIO')
     axs[1].set_xlabel('$t\ (s)$')
     axs[1].set_ylabel('$y\ (m)$')
 
     # Plot theta
     axs[2].grid(True)
     axs[2].plot(time, theta_gt, color='k', label='GT')
-    axs[2].plot(time[:n_frames-1:args.n_skip], theta_init, color='m', label='Initial')
-    axs[2].plot(time[:n_frames-1:args.n_skip], theta_est_imu, color='r', label='IMU')
-    axs[2].plot(time[:n_frames-1:args.n_skip], theta_est_full, color='b', label='VIO')
+    axs[2].plot(time[keyframe_frames], theta_init, color='m', label='Initial')
+    axs[2].plot(time[keyframe_frames], theta_est_imu, color='r', label='IMU')
+    axs[2].plot(time[keyframe_frames], theta_est_full, color='b', label='VIO')
     axs[2].set_xlabel('$t\ (s)$')
     axs[2].set_ylabel('$\\theta\ (rad)$')
     
     plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.savefig('poses.eps')
+    plt.savefig(os.path.join(out_dir, 'poses.eps'))
 
     # Plot pose as time series
     fig, axs = plt.subplots(3, figsize=(8, 8), facecolor='w', edgecolor='k')
     plt.subplots_adjust(right=0.95, left=0.15, bottom=0.17, hspace=0.5)
     # Plot x
     axs[0].grid(True)
-    axs[0].plot(time[:n_frames-1:args.n_skip], np.abs(x_gt[:n_frames-1:args.n_skip] - x_init), color='m', label='Initial')
-    axs[0].plot(time[:n_frames-1:args.n_skip], np.abs(x_gt[:n_frames-1:args.n_skip] - x_est_imu), color='r', label='IMU')
-    axs[0].plot(time[:n_frames-1:args.n_skip], np.abs(x_gt[:n_frames-1:args.n_skip] - x_est_full), color='b', label='VIO')
+    axs[0].plot(time[keyframe_frames], np.abs(x_gt[keyframe_frames] - x_init), color='m', label='Initial')
+    axs[0].plot(time[keyframe_frames], np.abs(x_gt[keyframe_frames] - x_est_imu), color='r', label='IMU')
+    axs[0].plot(time[keyframe_frames], np.abs(x_gt[keyframe_frames] - x_est_full), color='b', label='VIO')
     axs[0].set_xlabel('$t\ (s)$')
     axs[0].set_ylabel('$e_x\ (m)$')
 
     # Plot y
     axs[1].grid(True)
-    axs[1].plot(time[:n_frames-1:args.n_skip], np.abs(y_gt[:n_frames-1:args.n_skip] - y_init), color='m', label='Initial')
-    axs[1].plot(time[:n_frames-1:args.n_skip], np.abs(y_gt[:n_frames-1:args.n_skip] - y_est_imu), color='r', label='IMU')
-    axs[1].plot(time[:n_frames-1:args.n_skip], np.abs(y_gt[:n_frames-1:args.n_skip] - y_est_full), color='b', label='VIO')
+    axs[1].plot(time[keyframe_frames], np.abs(y_gt[keyframe_frames] - y_init), color='m', label='Initial')
+    axs[1].plot(time[keyframe_frames], np.abs(y_gt[keyframe_frames] - y_est_imu), color='r', label='IMU')
+    axs[1].plot(time[keyframe_frames], np.abs(y_gt[keyframe_frames] - y_est_full), color='b', label='VIO')
     axs[1].set_xlabel('$t\ (s)$')
     axs[1].set_ylabel('$e_y\ (m)$')
 
     # Plot theta
     axs[2].grid(True)
-    axs[2].plot(time[:n_frames-1:args.n_skip], np.abs(theta_gt[:n_frames-1:args.n_skip] - theta_init), color='m', label='Initial')
-    axs[2].plot(time[:n_frames-1:args.n_skip], np.abs(theta_gt[:n_frames-1:args.n_skip] - theta_est_imu), color='r', label='IMU')
-    axs[2].plot(time[:n_frames-1:args.n_skip], np.abs(theta_gt[:n_frames-1:args.n_skip] - theta_est_full), color='b', label='VIO')
+    axs[2].plot(time[keyframe_frames], np.abs(theta_gt[keyframe_frames] - theta_init), color='m', label='Initial')
+    axs[2].plot(time[keyframe_frames], np.abs(theta_gt[keyframe_frames] - theta_est_imu), color='r', label='IMU')
+    axs[2].plot(time[keyframe_frames], np.abs(theta_gt[keyframe_frames] - theta_est_full), color='b', label='VIO')
     axs[2].set_xlabel('$t\ (s)$')
     axs[2].set_ylabel('$e_{\\theta}\ (rad)$')
     
     plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.savefig('errors.eps')
-
-    plt.show()
+    plt.savefig(os.path.join(out_dir, 'errors.eps'))
 
 
+if __name__ == '__main__':
+    # Input arguments
+    parser = build_parser()
+    args = parser.parse_args()
+    check_arguments(parser, args)
 
+    fig, axs = plt.subplots(1, figsize=(12, 8), facecolor='w', edgecolor='k')
+    plt.subplots_adjust(right=0.95, left=0.1, bottom=0.17)
 
+    if args.profile is not None:
+        profiling.timers.enable(memory=args.profile_memory)
+    with profiling.cprofile(args.cprofile):
+        result = run(args, axs)
+        plot_results(result, axs)
+    if args.profile is not None:
+        profiling.timers.print_summary()
+        profiling.timers.save(args.profile)
+    plt.show()
@@ -0,0 +1,229 @@
+"""
+Lightweight timing and memory instrumentation of the pipeline stages.
+
+Sections are timed with a context manager or a decorator on the module-level timers:
+
+    with profiling.section('graph'):
+        ...
+
+    @profiling.timed('observations')
+    def get_vision_data(tracker):
+        ...
+
+Timers are disabled by default, in which case section() returns a shared no-op context manager and timed
+functions are called directly, so the instrumentation can stay in the hot paths. Once enabled, every
+section appends its wall time to the durations of its name, and sections run while a frame is set
+(set_frame) are also summed per frame. summary() aggregates the durations (count, total, mean, p50, p95,
+p99, max) next to the per-frame times, and save() writes them as JSON. cprofile() wraps a block in
+cProfile for a function-level breakdown.
+
+Enabled with memory=True, every section also samples the memory when it ends: the peak of the Python
+heap traced by tracemalloc during the section (numpy arrays included, GTSAM's native allocations not),
+the traced memory it retained, and the resident memory of the process and its peak, which include the
+native allocations. Tracing slows the pipeline down, so the times are only indicative then.
+"""
+
+import cProfile
+import collections
+import functools
+import io
+import json
+import os
+import pstats
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+MB = 2. ** 20
+MEMORY_FIELDS = ('traced_peak_mb', 'traced_retained_mb', 'rss_mb', 'peak_rss_mb')
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process in MB """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / MB if os.uname().sysname == 'Darwin' else peak / 1024.
+
+
+def rss_mb():
+    """ Resident memory of the process in MB, or its peak where the current value is not available """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+class _Disabled(object):
+    """ Context manager of the sections of disabled timers """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+class _Section(object):
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        if self.timers.memory:
+            self.timers.enter_memory()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timers.record(self.name, perf_counter() - self.start)
+        if self.timers.memory:
+            self.timers.exit_memory(self.name)
+        return False
+
+
+class Timers(object):
+    """ Wall time of named sections, in total and per frame """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.reset()
+
+    def reset(self):
+        self.durations = collections.defaultdict(list)
+        self.samples = collections.defaultdict(list)
+        self.frames = {}
+        self.frame = None
+        # Traced memory at the start of every open section, and the peak of the sections nested in it
+        self.open_sections = []
+
+    def enable(self, memory=False):
+        """ Clear the recorded times and start recording, with memory samples if memory """
+        self.reset()
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        if self.memory:
+            tracemalloc.stop()
+        self.enabled = False
+        self.memory = False
+
+    def enter_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.open_sections:
+            self.open_sections[-1][1] = max(self.open_sections[-1][1], peak)
+        tracemalloc.reset_peak()
+        self.open_sections.append([current, current])
+
+    def exit_memory(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        start, nested_peak = self.open_sections.pop()
+        peak = max(peak, nested_peak)
+        if self.open_sections:
+            self.open_sections[-1][1] = max(self.open_sections[-1][1], peak)
+        self.samples[name].append((peak / MB, (current - start) / MB, rss_mb(), peak_rss_mb()))
+
+    def set_frame(self, frame):
+        """ Attribute the next sections to frame as well, or to no frame if None """
+        self.frame = frame
+
+    def record(self, name, seconds):
+        self.durations[name].append(seconds)
+        if self.frame is not None:
+            frame = self.frames.setdefault(self.frame, {})
+            frame[name] = frame.get(name, 0.) + seconds
+
+    def section(self, name):
+        """ Context manager timing its block as name """
+        if not self.enabled:
+            return _DISABLED
+        return _Section(self, name)
+
+    def timed(self, name):
+        """ Decorator timing every call of the function as name """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Section(self, name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        Dict of the aggregate statistics of every section in seconds, with the largest memory samples in MB
+        if any, under 'sections', and of the per-frame section times, under 'frames', as a list of dicts
+        ordered by frame.
+        """
+        sections = {}
+        for name, durations in self.durations.items():
+            durations = np.array(durations)
+            stats = {'count': int(durations.shape[0]), 'total_s': float(durations.sum()),
+                     'mean_s': float(durations.mean())}
+            for q, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+                stats['p%d_s' % q] = float(value)
+            stats['max_s'] = float(durations.max())
+            if self.samples[name]:
+                # Largest sample of every memory field
+                stats.update(zip(MEMORY_FIELDS, np.max(self.samples[name], axis=0).tolist()))
+            sections[name] = stats
+        frames = [dict(frame=frame, **self.frames[frame]) for frame in sorted(self.frames)]
+        return {'sections': sections, 'frames': frames}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def print_summary(self):
+        """ Table of the sections, the longest first """
+        sections = self.summary()['sections']
+        header = '%-20s %7s %10s %10s %10s %10s' % ('section', 'count', 'total (s)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)')
+        if self.memory:
+            header += ' %16s %9s' % ('traced peak (MB)', 'RSS (MB)')
+        print(header)
+        for name, stats in sorted(sections.items(), key=lambda item: -item[1]['total_s']):
+            line = '%-20s %7d %10.3f %10.2f %10.2f %10.2f' % (name, stats['count'], stats['total_s'],
+                   1.e3 * stats['p50_s'], 1.e3 * stats['p95_s'], 1.e3 * stats['p99_s'])
+            if 'rss_mb' in stats:
+                line += ' %16.1f %9.1f' % (stats['traced_peak_mb'], stats['rss_mb'])
+            print(line)
+
+
+timers = Timers()
+section = timers.section
+timed = timers.timed
+
+
+@contextmanager
+def cprofile(path=None, top=25):
+    """
+    Run the block under cProfile, write the statistics to path (for pstats or snakeviz) and print the top
+    functions by cumulative time. Without a path the block runs unprofiled.
+    """
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top)
+        print(stream.getvalue())
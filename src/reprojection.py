@@ -0,0 +1,56 @@
+"""
+Reprojection gating and robust noise models of the projection factors.
+
+The residuals of all candidate observations are computed at once from stacked camera poses, so gross
+outliers (bad matches, wrong depth at the initializing observation) can be dropped before the factors
+reach the optimizer. The observations that pass can additionally be given an M-estimator, which
+down-weights the moderate outliers left.
+"""
+
+import numpy as np
+import gtsam
+
+# Default thresholds of the M-estimators, in units of the whitened residual (95% efficiency)
+ROBUST_KERNELS = {
+    'huber': (gtsam.noiseModel.mEstimator.Huber, 1.345),
+    'cauchy': (gtsam.noiseModel.mEstimator.Cauchy, 2.3849),
+    'tukey': (gtsam.noiseModel.mEstimator.Tukey, 4.6851),
+}
+
+
+def reprojection_errors(points, world_from_cam, K_np, uv):
+    """
+    Reprojection error in pixels of N observations.
+
+    Inputs
+      points - N x 3 landmark positions in the world frame.
+      world_from_cam - N x 4 x 4 poses of the observing cameras.
+      K_np - 3 x 3 camera intrinsics.
+      uv - N x 2 observed keypoints.
+    Returns
+      N array of errors, inf for landmarks behind the camera.
+    """
+    R = world_from_cam[:, :3, :3]
+    t = world_from_cam[:, :3, 3]
+    p_cam = np.einsum('nji,nj->ni', R, points - t)
+    z = p_cam[:, 2]
+    in_front = z > 1.e-6
+    projected = p_cam @ K_np.T
+    errors = np.full(points.shape[0], np.inf)
+    errors[in_front] = np.linalg.norm(projected[in_front, :2] / z[in_front, None] - uv[in_front], axis=1)
+    return errors
+
+
+def robust_noise_model(noise, kernel=None, threshold=None):
+    """
+    Wrap a noise model with the M-estimator 'huber', 'cauchy' or 'tukey'. threshold is in units of the
+    whitened residual and defaults to the usual 95% efficiency constant of the estimator.
+    """
+    if kernel is None:
+        return noise
+    if kernel not in ROBUST_KERNELS:
+        raise ValueError('Unknown robust kernel %s, expected one of %s' % (kernel, ', '.join(ROBUST_KERNELS)))
+    estimator, default_threshold = ROBUST_KERNELS[kernel]
+    if threshold is None:
+        threshold = default_threshold
+    return gtsam.noiseModel.Robust.Create(estimator.Create(threshold), noise)
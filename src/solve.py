@@ -0,0 +1,188 @@
+"""
+Solve-only entry point: solve the IMU-only and VIO graphs saved by main.py --save_problem, skipping the
+dataset loading, feature tracking and graph construction, e.g. to tune the backend:
+
+    python src/main.py ... --save_problem /tmp/problem
+    python src/solve.py --problem /tmp/problem --linear_solver pcg --ordering landmarks_first
+
+Also holds the solver options and parameters shared with main.py.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import gtsam
+
+import VisualInertialOdometry as vio
+import keyframe_selection
+import evaluation
+import profiling
+import trajectory
+
+IMU_ONLY_FILE = 'imu_only.npz'
+VIO_FILE = 'vio.npz'
+LINEAR_SOLVER = 'multifrontal_cholesky'
+ORDERING = 'colamd'
+
+
+def add_solver_arguments(parser):
+    """ Command line options of the IMU-only and VIO solves """
+    parser.add_argument('--isam2', dest='isam2', action='store_true',
+                        help='Solve incrementally with iSAM2, one keyframe at a time.')
+    parser.add_argument('--relinearize_threshold', dest='relinearize_threshold', type=float, default=0.1)
+    parser.add_argument('--relinearize_skip', dest='relinearize_skip', type=int, default=1)
+    parser.add_argument('--isam2_factorization', dest='isam2_factorization', type=str, default='QR',
+                        help='CHOLESKY or QR. QR copes better with the loosely constrained IMU chain.')
+    parser.add_argument('--fixed_lag', dest='fixed_lag', type=float, default=None,
+                        help='Solve with a fixed-lag smoother keeping the last FIXED_LAG seconds. main.py then builds '
+                             'the graphs one keyframe at a time as they are solved, in bounded memory.')
+    parser.add_argument('--linear_solver', dest='linear_solver', type=str, default=LINEAR_SOLVER,
+                        choices=sorted(vio.LINEAR_SOLVERS),
+                        help='Linear solver of the Levenberg-Marquardt steps of the VIO solve; the IMU-only solve keeps the default.')
+    parser.add_argument('--ordering', dest='ordering', type=str, default=ORDERING, choices=vio.ORDERINGS,
+                        help='Elimination ordering of the VIO solve; landmarks_first eliminates the landmarks before the poses.')
+    parser.add_argument('--max_iterations', dest='max_iterations', type=int, default=1000,
+                        help='Levenberg-Marquardt iterations of the IMU-only and VIO solves.')
+    parser.add_argument('--lambda_initial', dest='lambda_initial', type=float, default=1.e-5,
+                        help='Initial Levenberg-Marquardt damping of the VIO solve.')
+    parser.add_argument('--lambda_factor', dest='lambda_factor', type=float, default=10.,
+                        help='Factor the VIO damping is scaled by after a rejected or accepted step.')
+    parser.add_argument('--warm_start', dest='warm_start', action='store_true',
+                        help='Start the VIO solve from the IMU-only solution instead of the perturbed initial estimate.')
+    parser.add_argument('--concurrent', dest='concurrent', action='store_true',
+                        help='Solve the IMU-only and VIO graphs concurrently in two processes.')
+
+
+def check_solver_arguments(parser, args):
+    if args.concurrent and args.warm_start:
+        parser.error('--warm_start needs the IMU-only solution first and cannot be combined with --concurrent')
+    if (args.isam2 or args.fixed_lag is not None) and (args.linear_solver != LINEAR_SOLVER or args.ordering != ORDERING):
+        parser.error('--linear_solver and --ordering set the batch Levenberg-Marquardt solve and cannot be combined '
+                     'with --isam2 or --fixed_lag')
+
+
+def solver_params(args):
+    """ Levenberg-Marquardt parameters of the IMU-only and VIO solves, and the iSAM2 parameters """
+    imu_params = gtsam.LevenbergMarquardtParams()
+    imu_params.setMaxIterations(args.max_iterations)
+    imu_params.setVerbosity('ERROR')
+    imu_params.setVerbosityLM('SUMMARY')
+
+    params = gtsam.LevenbergMarquardtParams()
+    params.setMaxIterations(args.max_iterations)
+    params.setlambdaInitial(args.lambda_initial)
+    params.setlambdaFactor(args.lambda_factor)
+    params.setlambdaUpperBound(1.e+6)
+    params.setlambdaLowerBound(0.1)
+    params.setDiagonalDamping(1000)
+    params.setVerbosity('ERROR')
+    params.setVerbosityLM('SUMMARY')
+    params.setRelativeErrorTol(1.e-9)
+    params.setAbsoluteErrorTol(1.e-9)
+
+    ISAM2_PARAMS = gtsam.ISAM2Params()
+    ISAM2_PARAMS.setRelinearizeThreshold(args.relinearize_threshold)
+    if hasattr(ISAM2_PARAMS, 'setRelinearizeSkip'):
+        ISAM2_PARAMS.setRelinearizeSkip(args.relinearize_skip)
+    else:
+        # GTSAM 4.2+ exposes relinearizeSkip as an attribute
+        ISAM2_PARAMS.relinearizeSkip = args.relinearize_skip
+    ISAM2_PARAMS.setFactorization(args.isam2_factorization)
+
+    return imu_params, params, ISAM2_PARAMS
+
+
+def solve(imu_only, vio_full, args, keyframe_times, release=False):
+    """
+    Solve the IMU-only and the VIO graph as selected on the command line. Returns both results. With
+    release the solver state of the IMU-only solve is dropped before the VIO solve. --linear_solver and
+    --ordering only apply to the VIO solve, the IMU-only graph has no landmarks to order.
+    """
+    imu_params, params, ISAM2_PARAMS = solver_params(args)
+
+    def solver(SOLVER_PARAMS, linear_solver=None, ordering=None):
+        """ Estimate method and arguments selected on the command line """
+        if args.fixed_lag is not None:
+            return 'estimate_fixed_lag', (keyframe_times, args.fixed_lag, ISAM2_PARAMS)
+        elif args.isam2:
+            return 'estimate_incremental', (ISAM2_PARAMS,)
+        return 'estimate', (SOLVER_PARAMS, linear_solver, ordering)
+
+    if args.concurrent:
+        print('==> Solving IMU-only and VIO graphs concurrently')
+        # Both solves start together: each is timed until its result is back
+        start = time.perf_counter()
+        method, method_args = solver(imu_params)
+        pending_imu = imu_only.estimate_in_process(method, *method_args)
+        method, method_args = solver(params, args.linear_solver, args.ordering)
+        pending_full = vio_full.estimate_in_process(method, *method_args)
+        result_imu = pending_imu.get()
+        if profiling.timers.enabled:
+            profiling.timers.record('solve_imu', time.perf_counter() - start)
+        result_full = pending_full.get()
+        if profiling.timers.enabled:
+            profiling.timers.record('solve_vio', time.perf_counter() - start)
+    else:
+        print('==> Solving IMU-only graph')
+        method, method_args = solver(imu_params)
+        with profiling.section('solve_imu'):
+            result_imu = getattr(imu_only, method)(*method_args)
+        if release:
+            imu_only.release_solver()
+
+        print('==> Solving VIO graph')
+        if args.warm_start:
+            vio_full.warm_start(result_imu)
+        method, method_args = solver(params, args.linear_solver, args.ordering)
+        with profiling.section('solve_vio'):
+            result_full = getattr(vio_full, method)(*method_args)
+
+    return result_imu, result_full
+
+
+def save_problem(path, imu_only, vio_full, measured_poses, keyframe_times, n_skip):
+    """
+    Save both graphs into the directory path, with the ground truth, the keyframe times and the frame
+    indices of the keyframes (every n_skip-th frame, or the array n_skip).
+    """
+    os.makedirs(path, exist_ok=True)
+    keyframes = keyframe_selection.keyframe_frames(n_skip, measured_poses.shape[0])
+    arrays = {'measured_poses': measured_poses, 'keyframe_times': keyframe_times, 'keyframes': keyframes}
+    imu_only.save(os.path.join(path, IMU_ONLY_FILE), **arrays)
+    vio_full.save(os.path.join(path, VIO_FILE), **arrays)
+
+
+def load_problem(path):
+    """ The graphs saved by save_problem, as (imu_only, vio_full) """
+    imu_only = vio.VisualInertialOdometryGraph.load(os.path.join(path, IMU_ONLY_FILE))
+    vio_full = vio.VisualInertialOdometryGraph.load(os.path.join(path, VIO_FILE))
+    return imu_only, vio_full
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the IMU-only and VIO graphs saved by main.py --save_problem.')
+    parser.add_argument('--problem', dest='problem', type=str, required=True,
+                        help='Directory written by main.py --save_problem.')
+    add_solver_arguments(parser)
+    args = parser.parse_args()
+    check_solver_arguments(parser, args)
+
+    start = time.perf_counter()
+    imu_only, vio_full = load_problem(args.problem)
+    print('==> Loaded %d + %d factors in %.2f s' % (imu_only.graph.size(), vio_full.graph.size(),
+                                                   time.perf_counter() - start))
+
+    start = time.perf_counter()
+    result_imu, result_full = solve(imu_only, vio_full, args, vio_full.arrays['keyframe_times'])
+    print('==> Solved in %.2f s' % (time.perf_counter() - start))
+
+    measured_poses = vio_full.arrays['measured_poses']
+    keyframes = vio_full.arrays['keyframes']
+    for name, values in (('IMU-only', result_imu), ('VIO', result_full)):
+        traj = trajectory.Trajectory.from_values(values)
+        metrics = evaluation.evaluate(traj.poses, measured_poses[keyframes][traj.index], alignment='se3',
+                                      rpe_delta=100., rpe_unit='meters')
+        print('==> %s: ATE %.3f m, RPE per 100 m %.3f m / %.3f deg' % (name, metrics['ate_rmse'],
+              metrics['rpe_trans_rmse'], np.degrees(metrics['rpe_rot_rmse'])))
@@ -0,0 +1,174 @@
+"""
+Landmark depth from the rectified KITTI stereo pairs (cam0/cam1 and cam2/cam3) instead of the annotated
+depth maps, which only cover part of the frames and are expensive to load.
+
+Only the head of every selected track, its first observation, is matched: the keypoint is searched along
+the same row of the partner image by zero-normalized cross correlation over the disparities of a depth
+range. Only the frames holding track heads are loaded.
+
+    rig = StereoRig(calibration.load_calibration(basedir, date, 1), calibration.load_calibration(basedir, date, 0))
+    heads = match_track_heads(vision_data, tracks, keyframe_frames, load_pair, rig)
+    graph.add_keypoints(vision_data, measured_poses, keyframe_frames, None, None, tracks=tracks, stereo=heads)
+"""
+
+import numpy as np
+import gtsam
+
+
+def load_gray(image):
+    """ A PIL image of pykitti (gray or color) as a float32 gray image in [0, 1] """
+    img = np.asarray(image, dtype=np.float32)
+    if img.ndim == 3:
+        img = img.mean(axis=2)
+    return img / 255.
+
+
+class StereoRig(object):
+    """
+    Rectified stereo pair of the tracked camera and its partner, e.g. cam1 and cam0. A point X in the
+    tracked camera frame is X + (offset, 0, 0) in the partner frame, so its partner pixel lies on the same
+    row at u + fx * offset / depth.
+    """
+
+    def __init__(self, calibration, partner):
+        self.calibration = calibration
+        self.partner = partner
+        cam_to_partner = np.linalg.inv(partner.imu_to_cam) @ calibration.imu_to_cam
+        self.offset = float(cam_to_partner[0, 3])
+        self.baseline = abs(self.offset)
+        self.fx = float(calibration.K_np[0, 0])
+        self._K_stereo = None
+
+    @property
+    def left(self):
+        """ Calibration of the left camera of the pair, the sensor of the stereo factors """
+        return self.partner if self.offset > 0 else self.calibration
+
+    @property
+    def K_stereo(self):
+        if self._K_stereo is None:
+            K_np = self.left.K_np
+            self._K_stereo = gtsam.Cal3_S2Stereo(K_np[0,0], K_np[1,1], K_np[0,1], K_np[0,2], K_np[1,2], self.baseline)
+        return self._K_stereo
+
+    def stereo_point(self, u, v, partner_u):
+        """ gtsam.StereoPoint2 (uL, uR, v) of a keypoint of the tracked camera and its partner column """
+        if self.offset > 0:
+            return gtsam.StereoPoint2(partner_u, u, v)
+        return gtsam.StereoPoint2(u, partner_u, v)
+
+
+def _normalize(patches):
+    patches = patches - patches.mean(axis=1, keepdims=True)
+    norm = np.sqrt(np.mean(patches ** 2, axis=1, keepdims=True))
+    return patches / np.maximum(norm, 1e-6)
+
+
+def match_rows(img, other, uv, offset, fx, min_depth=2., max_depth=80., radius=3, min_score=0.8, uniqueness=0.05):
+    """
+    Block matching of the pixels uv (N x 2) of the rectified image img along the same rows of other.
+
+    The ZNCC of (2 radius + 1)^2 patches is evaluated at every integer disparity of [min_depth, max_depth]
+    and the best one refined to subpixel by a parabola. A match needs a score of at least min_score, beating
+    every disparity outside its neighbors by uniqueness, and must not sit at the ends of the range.
+    Returns the N depths and matched columns in other, 0 and nan where there is no match.
+    """
+    H, W = img.shape
+    n = uv.shape[0]
+    depth = np.zeros(n)
+    partner_u = np.full(n, np.nan)
+
+    sign = 1 if offset > 0 else -1
+    d_min = max(int(np.floor(fx * abs(offset) / max_depth)), 1)
+    d_max = int(np.ceil(fx * abs(offset) / min_depth))
+    disparities = np.arange(d_min, d_max + 1)
+
+    u = uv[:, 0].astype(int)
+    v = uv[:, 1].astype(int)
+    idx = np.flatnonzero((v >= radius) & (v < H - radius) & (u >= radius) & (u < W - radius))
+    if idx.shape[0] == 0 or disparities.shape[0] < 3:
+        return depth, partner_u
+
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    rows = v[idx, None] + dy.ravel()
+    cols = u[idx, None] + dx.ravel()
+    ref = _normalize(img[rows, cols])
+
+    scores = np.full((idx.shape[0], disparities.shape[0]), -np.inf)
+    for k, d in enumerate(disparities):
+        shifted = cols + sign * d
+        inside = (shifted.min(axis=1) >= 0) & (shifted.max(axis=1) < W)
+        if not inside.any():
+            continue
+        scores[inside, k] = np.mean(ref[inside] * _normalize(other[rows[inside], shifted[inside]]), axis=1)
+
+    last = disparities.shape[0] - 1
+    best = np.argmax(scores, axis=1)
+    points = np.arange(idx.shape[0])
+    best_score = scores[points, best]
+    # Best score away from the peak
+    rest = scores.copy()
+    for shift in (-1, 0, 1):
+        rest[points, np.clip(best + shift, 0, last)] = -np.inf
+    second = rest.max(axis=1)
+
+    below = scores[points, np.maximum(best - 1, 0)]
+    above = scores[points, np.minimum(best + 1, last)]
+    # Pixels whose patches leave the partner image at every disparity only score -inf
+    with np.errstate(invalid='ignore'):
+        ok = ((best > 0) & (best < last) & np.isfinite(below) & np.isfinite(above)
+              & (best_score >= min_score) & (best_score - second >= uniqueness))
+        curvature = below - 2 * best_score + above
+    delta = np.zeros(idx.shape[0])
+    peaked = ok & (curvature < 0)
+    delta[peaked] = 0.5 * (below[peaked] - above[peaked]) / curvature[peaked]
+    disparity = disparities[best[ok]] + np.clip(delta[ok], -0.5, 0.5)
+
+    depth[idx[ok]] = fx * abs(offset) / disparity
+    partner_u[idx[ok]] = u[idx[ok]] + sign * disparity
+    return depth, partner_u
+
+
+class StereoHeads(object):
+    """
+    Stereo matches of the track heads, indexed by track like the rows of vision_data:
+
+      rig - the StereoRig
+      head - keyframe (column of vision_data) of the first observation, -1 for tracks not matched
+      depth - depth of the head in the tracked camera, 0 where there is no match
+      partner_u - matched column in the partner image, nan where there is no match
+    """
+
+    def __init__(self, rig, head, depth, partner_u):
+        self.rig = rig
+        self.head = head
+        self.depth = depth
+        self.partner_u = partner_u
+
+    def matched(self):
+        return int(np.sum(self.depth > 0))
+
+
+def match_track_heads(vision_data, tracks, frames, load_pair, rig, **kwargs):
+    """
+    Stereo depth at the head of each of the tracks. frames holds the frame index of every column of
+    vision_data and load_pair(frame) returns the rectified images of the tracked camera and its partner.
+    Keyword arguments go to match_rows.
+    """
+    M = vision_data.shape[0]
+    head = -1 * np.ones(M, dtype=int)
+    depth = np.zeros(M)
+    partner_u = np.full(M, np.nan)
+
+    tracks = np.asarray(tracks, dtype=int)
+    observed = vision_data[tracks, :-1, 0] >= 0
+    has_head = observed.any(axis=1)
+    tracks = tracks[has_head]
+    head[tracks] = np.argmax(observed[has_head], axis=1)
+
+    for j in np.unique(head[tracks]).tolist():
+        heads = tracks[head[tracks] == j]
+        img, other = load_pair(frames[j])
+        depth[heads], partner_u[heads] = match_rows(img, other, vision_data[heads, j], rig.offset, rig.fx, **kwargs)
+
+    return StereoHeads(rig, head, depth, partner_u)
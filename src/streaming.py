@@ -0,0 +1,104 @@
+"""
+Low-memory variants of the pipeline stages, used by main.py --memory_budget.
+
+LazyImages reads images on access and keeps only the last few, instead of holding the depth images of
+the whole drive. StreamingTracker builds the same tracks as a PointTracker covering the whole drive,
+but keeps only the descriptors of the last frame and the rounded keypoints of every track, instead of
+the dense tracks matrix, all the keypoints and their per-frame copies; its vision_data is int16, a
+quarter of the int64 array of main.get_vision_data.
+"""
+
+import collections
+
+import numpy as np
+
+
+class LazyImages(object):
+    """ Sequence of the images at paths, read by load(path) on access and cached for the cache_size last ones """
+
+    def __init__(self, paths, load, cache_size=8):
+        self.paths = paths
+        self.load = load
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        image = self.load(self.paths[index])
+        self.cache[index] = image
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return image
+
+
+class StreamingTracker(object):
+    """
+    Merges the keypoints of consecutive frames into tracks like PointTracker, whose nn_match_two_way
+    matcher matches the descriptors. A keypoint extends the track of its match in the previous frame or
+    starts a new one; tracks are numbered in the order they start, and their scores are the running
+    average of the match distances, max_score for tracks of a single keypoint. Unlike PointTracker, a
+    frame without keypoints is kept as an empty column and ends all tracks.
+    """
+
+    def __init__(self, matcher, nn_thresh, max_score=9999):
+        self.matcher = matcher
+        self.nn_thresh = nn_thresh
+        self.max_score = max_score
+        self.last_desc = None
+        # Track of every keypoint of the last frame
+        self.last_tracks = np.zeros(0, dtype=np.int64)
+        self.n_tracks = 0
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0)
+        # (track, u, v) of the keypoints of every frame
+        self.observations = []
+
+    def update(self, pts, desc):
+        """ Add the 3 x N keypoints and D x N descriptors of the next frame, which may be None if it has none. """
+        if pts is None or desc is None or pts.shape[1] == 0:
+            self.observations.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)))
+            self.last_desc = None
+            self.last_tracks = np.zeros(0, dtype=np.int64)
+            return
+
+        track = -np.ones(pts.shape[1], dtype=np.int64)
+        if self.last_desc is not None:
+            matches = self.matcher.nn_match_two_way(self.last_desc, desc, self.nn_thresh)
+            matched = matches[1].astype(int)
+            # Matches are two-way, so every track is extended at most once
+            extended = self.last_tracks[matches[0].astype(int)]
+            track[matched] = extended
+            self.lengths[extended] += 1
+            previous = self.scores[extended]
+            frac = 1. / (self.lengths[extended] - 1)
+            self.scores[extended] = np.where(previous == self.max_score, matches[2],
+                                             (1. - frac) * previous + frac * matches[2])
+
+        new = np.flatnonzero(track < 0)
+        track[new] = self.n_tracks + np.arange(new.shape[0])
+        self.n_tracks += new.shape[0]
+        self.lengths = np.concatenate((self.lengths, np.ones(new.shape[0], dtype=np.int64)))
+        self.scores = np.concatenate((self.scores, np.full(new.shape[0], float(self.max_score))))
+
+        self.observations.append((track, np.rint(pts[0]).astype(np.int16), np.rint(pts[1]).astype(np.int16)))
+        self.last_desc = desc
+        self.last_tracks = track
+
+    def vision_data(self, n_columns=None):
+        """
+        The M x n_columns x 2 int16 keypoint tracks in the layout of main.get_vision_data, column j being
+        the j-th frame and -1 where a track has no keypoint. By default there is one column per frame and an
+        empty last column.
+        """
+        if n_columns is None:
+            n_columns = len(self.observations) + 1
+        vision_data = -1 * np.ones((self.n_tracks, n_columns, 2), dtype=np.int16)
+        for frame, (track, u, v) in enumerate(self.observations[:n_columns]):
+            vision_data[track, frame, 0] = u
+            vision_data[track, frame, 1] = v
+        return vision_data
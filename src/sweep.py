@@ -0,0 +1,304 @@
+"""
+Parameter sweep of main.py that computes every stage once per distinct upstream configuration.
+
+The pipeline is a chain of stages, each reading some of the main.py options:
+
+    frontend  - loading the drive and running the keypoint frontend (FRONTEND_OPTIONS)
+    tracking  - merging the keypoints into tracks (TRACKING_OPTIONS)
+    graph     - keyframe and landmark selection and graph construction (every other option, and fixed_lag)
+    solve     - the IMU-only and VIO solves (the other options of solve.add_solver_arguments)
+
+A stage output is keyed by the options of its stage and of all the stages before it, so a sweep over the
+LM settings builds one graph and a sweep over the landmark stride tracks once. The frontend runs at the
+lowest conf_thresh of the configurations sharing it and the tracking stage drops the weaker keypoints,
+which gives the same tracks as running SuperPoint at every threshold (see main.track_features).
+
+The frontend and graph stages run in this process, where the network is loaded once and the graphs stay
+in memory; the tracking and solve stages of different configurations run in parallel in forked workers,
+which inherit the stage outputs without copying them. With --warm_start_neighbors, one configuration per
+set of keyframes is solved first and the others start their VIO solve from its solution, landmarks
+included when the graph is the same.
+
+The sweep is a JSON file of the base main.py options and of the lists of values to sweep, by dest:
+
+    {
+      "base": {"basedir": "/data/kitti", "date": "2011_09_26", "drive": "0022", "n_skip": 10, "n_frames": 701},
+      "grid": {"conf_thresh": [0.1, 0.15], "nn_thresh": [0.7, 0.9], "landmark_stride": [10, 20],
+               "lambda_initial": [1e-5, 1e-3]}
+    }
+
+    python src/sweep.py --sweep sweep.json --out /tmp/sweep --workers 8 --warm_start_neighbors
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import gtsam
+
+import batch
+import frontends
+import main
+import solve
+
+STAGES = ('frontend', 'tracking', 'graph', 'solve')
+FRONTEND_OPTIONS = ('basedir', 'date', 'drive', 'n_frames', 'camera', 'synthetic', 'n_skip', 'frontend', 'max_keypoints',
+                    'nms_dist', 'imu_stream', 'landmark_depth', 'feature_cache', 'feature_cache_size', 'cuda')
+TRACKING_OPTIONS = ('conf_thresh', 'nn_thresh', 'memory_budget')
+# Options that do not change any stage output
+IGNORED_OPTIONS = ('export', 'save_problem', 'viz_tracking', 'profile', 'cprofile', 'profile_memory')
+# Solver options of the graph stage: with --fixed_lag the graphs are streamed into the smoother instead of built
+GRAPH_SOLVER_OPTIONS = ('fixed_lag',)
+RESULTS_FILE = 'sweep.json'
+
+# Stage outputs, inherited by the forked workers
+_state = {}
+
+
+def load_sweep(path):
+    """ The configurations of a sweep file, as main.py option dicts in grid order """
+    with open(path) as f:
+        spec = json.load(f)
+    base = spec.get('base', {})
+    grid = spec.get('grid', {})
+    names = sorted(grid)
+    configs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        options = dict(base)
+        options.update(zip(names, values))
+        configs.append(options)
+    return configs, names
+
+
+def solver_options():
+    parser = argparse.ArgumentParser()
+    solve.add_solver_arguments(parser)
+    return tuple(sorted(vars(parser.parse_args([]))))
+
+
+def stage_keys(args):
+    """ Key of the output of every stage for the main.py arguments args, including the upstream options """
+    options = vars(args)
+    solver = solver_options()
+    stage_options = {
+        'frontend': FRONTEND_OPTIONS,
+        'tracking': TRACKING_OPTIONS,
+        'graph': tuple(sorted(set(options) - set(FRONTEND_OPTIONS) - set(TRACKING_OPTIONS)
+                              - (set(solver) - set(GRAPH_SOLVER_OPTIONS)) - set(IGNORED_OPTIONS))),
+        'solve': tuple(name for name in solver if name not in GRAPH_SOLVER_OPTIONS),
+    }
+    keys = {}
+    upstream = ()
+    for stage in STAGES:
+        upstream += tuple((name, repr(options[name])) for name in stage_options[stage])
+        keys[stage] = upstream
+    return keys
+
+
+def _frontend_loader(args):
+    def load():
+        if args.frontend != 'superpoint':
+            return frontends.load_frontend(args)
+        if args.cuda not in _state['networks']:
+            _state['networks'][args.cuda] = frontends.load_superpoint(args.cuda)
+        return _state['networks'][args.cuda]
+    return load
+
+
+def _log_path(name):
+    """ Log of a forked task in the log directory, discarded without one """
+    if _state['log_dir'] is None:
+        return os.devnull
+    return os.path.join(_state['log_dir'], name + '.txt')
+
+
+def _track(key):
+    args = _state['tracking_args'][key]
+    drive, features = _state['frontend'][_state['frontend_of'][key]][:2]
+    start = time.perf_counter()
+    with batch.redirect_output(_log_path('tracking_%d' % _state['first'][key])):
+        vision_data, track_scores = main.track_features(args, drive, features)
+    return key, vision_data, track_scores, time.perf_counter() - start
+
+
+def _solve(task):
+    index, warm, landmarks = task
+    args = _state['args'][index]
+    drive = _state['drives'][index]
+    keyframe_frames, imu_only, vio_full = _state['graph'][_state['keys'][index]['graph']][:3]
+    start = time.perf_counter()
+    if warm is not None:
+        values = gtsam.Values()
+        values.deserialize(warm)
+        # The forked worker owns its copy of the graph, so the shared initial estimate is left untouched
+        vio_full.warm_start(values, landmarks=landmarks)
+        args.warm_start = False
+    with batch.redirect_output(_log_path('solve_%d' % index)):
+        result_imu, result_full = solve.solve(imu_only, vio_full, args, drive.time[keyframe_frames])
+    elapsed = time.perf_counter() - start
+    optimizer = getattr(vio_full, 'optimizer', None)
+    iterations = optimizer.iterations() if optimizer is not None else None
+    return index, result_imu.serialize(), result_full.serialize(), iterations, vio_full.graph.error(result_full), elapsed
+
+
+def _map(fn, tasks, workers):
+    """ fn over the tasks in forked workers, which see the stage outputs of _state """
+    if not tasks:
+        return []
+    context = multiprocessing.get_context('fork')
+    with context.Pool(min(workers, len(tasks))) as pool:
+        return pool.map(fn, tasks, chunksize=1)
+
+
+def run_sweep(configs, workers, warm_start_neighbors=False, seed=0, log_dir=None):
+    """
+    Run the main.py option dicts configs, reusing the stage outputs between them. Returns one row per
+    configuration with its metrics, the iterations and final error of its VIO solve and the wall time of
+    each of its stages, with the stages it reused marked. The output of the forked tasks goes to log_dir, if given.
+    """
+    parser = main.build_parser()
+    args_list = [batch.run_arguments(parser, options) for options in configs]
+    for args in args_list:
+        args.viz_tracking = False
+    keys = [stage_keys(args) for args in args_list]
+    _state.clear()
+    _state.update(args=args_list, keys=keys, networks={}, frontend={}, graph={}, log_dir=log_dir)
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    timings = [{} for _ in configs]
+    computed = [set() for _ in configs]
+
+    # Frontend: in this process, at the lowest conf_thresh of the configurations sharing it
+    frontend_of = {}
+    for index, args in enumerate(args_list):
+        key = keys[index]['frontend']
+        frontend_of[keys[index]['tracking']] = key
+        if key not in _state['frontend']:
+            fargs = copy.copy(args)
+            fargs.conf_thresh = min(a.conf_thresh for a, k in zip(args_list, keys) if k['frontend'] == key)
+            start = time.perf_counter()
+            drive = main.load_drive(fargs)
+            features = None if fargs.synthetic else list(main.extract_features(fargs, drive, _frontend_loader(fargs)))
+            _state['frontend'][key] = (drive, features, time.perf_counter() - start)
+            computed[index].add('frontend')
+        timings[index]['frontend'] = _state['frontend'][key][2]
+    _state['frontend_of'] = frontend_of
+    _state['drives'] = [_state['frontend'][frontend_of[k['tracking']]][0] for k in keys]
+
+    # Tracking: one forked worker per distinct tracking configuration
+    tracking_args = {}
+    first = {}
+    for index, k in enumerate(keys):
+        tracking_args.setdefault(k['tracking'], args_list[index])
+        first.setdefault(k['tracking'], index)
+    _state['tracking_args'] = tracking_args
+    _state['first'] = first
+    tracking = {key: (vision_data, track_scores, elapsed) for key, vision_data, track_scores, elapsed
+                in _map(_track, list(tracking_args), workers)}
+    for index, k in enumerate(keys):
+        timings[index]['tracking'] = tracking[k['tracking']][2]
+        if first[k['tracking']] == index:
+            computed[index].add('tracking')
+
+    # Graph: in this process, where the forked solves inherit it
+    for index, (args, k) in enumerate(zip(args_list, keys)):
+        if k['graph'] not in _state['graph']:
+            vision_data, track_scores = tracking[k['tracking']][:2]
+            np.random.seed(seed)
+            start = time.perf_counter()
+            keyframe_frames, imu_only, vio_full = main.build_graphs(args, _state['drives'][index], vision_data, track_scores)
+            _state['graph'][k['graph']] = (keyframe_frames, imu_only, vio_full, time.perf_counter() - start)
+            computed[index].add('graph')
+        timings[index]['graph'] = _state['graph'][k['graph']][3]
+
+    # Solve: every configuration, in forked workers; neighbours with the same keyframes warm start from a seed
+    warm_from = {}
+    waves = [[(index, None, False) for index in range(len(configs))]]
+    if warm_start_neighbors:
+        seeds = {}
+        for index, k in enumerate(keys):
+            seeds.setdefault((k['tracking'], _state['graph'][k['graph']][0].tobytes()), index)
+        for index, k in enumerate(keys):
+            seed_index = seeds[(k['tracking'], _state['graph'][k['graph']][0].tobytes())]
+            if index != seed_index:
+                warm_from[index] = seed_index
+        waves = [[(index, None, False) for index in sorted(seeds.values())], sorted(warm_from)]
+    solutions = {}
+    for wave in waves:
+        tasks = []
+        for task in wave:
+            if isinstance(task, tuple):
+                tasks.append(task)
+            else:
+                seed_index = warm_from[task]
+                tasks.append((task, solutions[seed_index][1], keys[seed_index]['graph'] == keys[task]['graph']))
+        for index, imu, full, iterations, error, elapsed in _map(_solve, tasks, workers):
+            solutions[index] = (imu, full, iterations, error, elapsed)
+
+    rows = []
+    for index, (options, args, k) in enumerate(zip(configs, args_list, keys)):
+        imu, full, iterations, error, elapsed = solutions[index]
+        result_imu, result_full = gtsam.Values(), gtsam.Values()
+        result_imu.deserialize(imu)
+        result_full.deserialize(full)
+        keyframe_frames, imu_only = _state['graph'][k['graph']][:2]
+        result = main.evaluate_results(args, _state['drives'][index], keyframe_frames, imu_only.initial_states(),
+                                       result_imu, result_full)
+        timings[index]['solve'] = elapsed
+        computed[index].add('solve')
+        rows.append({'options': options, 'metrics': result['metrics'], 'iterations': iterations, 'error': error,
+                     'timings': timings[index], 'computed': sorted(computed[index], key=STAGES.index),
+                     'warm_start_from': warm_from.get(index)})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the options of main.py, reusing the stage outputs.')
+    parser.add_argument('--sweep', dest='sweep', type=str, required=True,
+                        help='JSON file of the base options and of the values to sweep, see the module docstring.')
+    parser.add_argument('--out', dest='out', type=str, default=None,
+                        help='Write the results of all configurations into OUT/sweep.json.')
+    parser.add_argument('--workers', dest='workers', type=int, default=os.cpu_count(),
+                        help='Forked workers of the tracking and solve stages.')
+    parser.add_argument('--warm_start_neighbors', dest='warm_start_neighbors', action='store_true',
+                        help='Start the VIO solves from the solution of a configuration with the same keyframes.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='Random seed of every graph, e.g. of the perturbed initial estimate.')
+    args = parser.parse_args()
+
+    configs, swept = load_sweep(args.sweep)
+    try:
+        batch.check_runs([('%d' % index, options) for index, options in enumerate(configs)])
+    except ValueError as e:
+        parser.error(str(e))
+    if any(options.get('concurrent') for options in configs):
+        parser.error('the solves of a sweep already run in parallel and cannot use --concurrent')
+
+    print('==> Sweeping', len(configs), 'configurations of', ', '.join(swept), 'on', args.workers, 'workers')
+    start = time.perf_counter()
+    rows = run_sweep(configs, args.workers, args.warm_start_neighbors, args.seed,
+                     None if args.out is None else os.path.join(args.out, 'logs'))
+    wall = time.perf_counter() - start
+
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+        with open(os.path.join(args.out, RESULTS_FILE), 'w') as f:
+            json.dump({'swept': swept, 'wall_s': wall, 'rows': rows}, f, indent=2)
+
+    # Stage times of reused outputs are shown in parentheses
+    header = ' '.join('%12s' % name[:12] for name in swept)
+    print('%4s %s %11s %11s %11s %11s %6s %10s %9s %9s' % ('#', header, 'frontend', 'tracking', 'graph', 'solve',
+                                                         'iters', 'VIO error', 'IMU ATE', 'VIO ATE'))
+    for index, row in enumerate(rows):
+        values = ' '.join('%12s' % str(row['options'][name])[:12] for name in swept)
+        stages = ' '.join(('%11.2f' if stage in row['computed'] else '%10.2f*') % row['timings'][stage] for stage in STAGES)
+        iterations = '-' if row['iterations'] is None else str(row['iterations'])
+        print('%4d %s %s %6s %10.4g %9.3f %9.3f' % (index, values, stages, iterations, row['error'],
+              row['metrics']['IMU-only']['ate_rmse'], row['metrics']['VIO']['ate_rmse']))
+    serial = sum(sum(row['timings'].values()) for row in rows)
+    print('==> %.1f s for the sweep, %.1f s of stages without reuse or parallelism (* reused)' % (wall, serial))
@@ -0,0 +1,314 @@
+"""
+Synthetic KITTI-like drives for offline testing and benchmarking.
+
+A scenario is a vehicle driving on a flat road with piecewise constant yaw rate (each segment is a
+gtsam.ConstantTwistScenario), landmarks scattered on both sides of the road and a camera mounted with
+the KITTI IMU-to-camera extrinsics. The scenario is written to
+
+    <basedir>/<date>/<date>_drive_<drive>_sync/synthetic.npz
+
+so that src/main.py can load it with --synthetic and the same --basedir/--date/--drive arguments
+used for real data. Observations are stored sparsely (one row per observation) so that drives with
+thousands of frames and landmarks stay small on disk; the dense keypoint tracks and the depth images
+are only built for the frame stride requested at load time.
+
+Example:
+    python src/synthetic.py --basedir /tmp/kitti --date 2011_09_26 --drive 9001 --n_frames 5000 --n_landmarks 20000
+"""
+
+import argparse
+import os
+
+import numpy as np
+import gtsam
+
+from VisualInertialOdometry import kitti_camera_calibration
+
+SCENARIO_FILE = 'synthetic.npz'
+
+
+def scenario_path(basedir, date, drive):
+    """ Location of the scenario file of a drive, laid out like the KITTI raw data. """
+    return os.path.join(basedir, date, date + '_drive_' + drive + '_sync', SCENARIO_FILE)
+
+
+def segment_phases(rng, speed, yaw_rate, segment_duration, stop_probability=0.):
+    """
+    Phases of one segment of the drive, as (make_scenario(start_pose), duration) pairs: driving at a yaw
+    rate drawn in [-yaw_rate, yaw_rate], or with probability stop_probability braking to a stop, standing
+    still and accelerating back to speed, for a quarter, a half and a quarter of the segment.
+    """
+    w = np.array([0., 0., rng.uniform(-yaw_rate, yaw_rate)])
+    v = np.array([speed, 0., 0.])
+    if not (stop_probability > 0. and rng.random() < stop_probability):
+        return [(lambda pose: gtsam.ConstantTwistScenario(w, v, pose), segment_duration)]
+
+    ramp = segment_duration / 4.
+
+    def brake(pose):
+        v_n = pose.rotation().matrix() @ v
+        return gtsam.AcceleratingScenario(pose.rotation(), pose.translation(), v_n, -v_n / ramp, np.zeros(3))
+
+    def accelerate(pose):
+        a_n = pose.rotation().matrix() @ v / ramp
+        return gtsam.AcceleratingScenario(pose.rotation(), pose.translation(), np.zeros(3), a_n, np.zeros(3))
+
+    return [(brake, ramp),
+            (lambda pose: gtsam.ConstantTwistScenario(np.zeros(3), np.zeros(3), pose), segment_duration - 2 * ramp),
+            (accelerate, ramp)]
+
+
+def simulate_trajectory(n_frames, rate=10., speed=10., yaw_rate=0.05, segment_duration=20., stop_probability=0.,
+                        rng=None):
+    """
+    Simulate a planar drive at constant forward speed whose yaw rate is redrawn in [-yaw_rate, yaw_rate]
+    every segment_duration seconds. With stop_probability a segment is a stop instead, see segment_phases.
+
+    Returns
+      time - N array of timestamps in seconds.
+      poses - Nx4x4 array of IMU poses in the world frame.
+      vel_b, acc_b, omega_b - Nx3 arrays of body velocity, specific force and angular rate, in the
+        forward/left/up convention of the OXTS vf/vl/vu, af/al/au and wf/wl/wu fields.
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+
+    time = np.arange(n_frames) / rate
+    n_gravity = np.array([0., 0., -9.81])
+
+    poses = np.zeros((n_frames, 4, 4))
+    vel_b = np.zeros((n_frames, 3))
+    acc_b = np.zeros((n_frames, 3))
+    omega_b = np.zeros((n_frames, 3))
+
+    phase_start = 0.
+    phase_pose = gtsam.Pose3()
+    phases = []
+    scenario = None
+    for k, t in enumerate(time):
+        if scenario is None or t - phase_start >= duration:
+            if scenario is not None:
+                phase_pose = scenario.pose(t - phase_start)
+                phase_start = t
+            if not phases:
+                phases = segment_phases(rng, speed, yaw_rate, segment_duration, stop_probability)
+            make_scenario, duration = phases.pop(0)
+            scenario = make_scenario(phase_pose)
+
+        dt = t - phase_start
+        nRb = scenario.rotation(dt).matrix()
+        poses[k] = scenario.pose(dt).matrix()
+        vel_b[k] = scenario.velocity_b(dt)
+        acc_b[k] = scenario.acceleration_b(dt) - nRb.T @ n_gravity
+        omega_b[k] = scenario.omega_b(dt)
+
+    return time, poses, vel_b, acc_b, omega_b
+
+
+def scatter_landmarks(poses, n_landmarks, road_width=8., max_offset=30., max_height=8., rng=None):
+    """ Place landmarks next to the road: beside a random trajectory pose, left or right of the lane. """
+    if rng is None:
+        rng = np.random.default_rng(0)
+
+    anchor = poses[rng.integers(0, poses.shape[0], n_landmarks)]
+    along = rng.uniform(-5., 5., n_landmarks)
+    side = rng.choice([-1., 1.], n_landmarks) * rng.uniform(road_width, max_offset, n_landmarks)
+    height = rng.uniform(-1.5, max_height, n_landmarks)
+    local = np.stack((along, side, height, np.ones(n_landmarks)), axis=1)
+    return np.einsum('nij,nj->ni', anchor, local)[:, :3]
+
+
+def project_landmarks(poses, landmarks, K_np, imu_to_cam, image_size, max_range=80.):
+    """
+    Project every landmark into every camera, frame by frame.
+
+    Returns the observations in coordinate format: frame index, landmark index, pixel (u, v) and depth
+    along the optical axis, each as one row per visible landmark.
+    """
+    H, W = image_size
+    frames, landmark_ids, uvs, depths = [], [], [], []
+    world_to_cam = np.linalg.inv(poses @ imu_to_cam)
+    for k in range(poses.shape[0]):
+        p_cam = landmarks @ world_to_cam[k, :3, :3].T + world_to_cam[k, :3, 3]
+        z = p_cam[:, 2]
+        in_front = (z > 1.) & (z < max_range)
+        idx = np.flatnonzero(in_front)
+        uv = (p_cam[idx] @ K_np.T)[:, :2] / z[idx, None]
+        in_image = (uv[:, 0] >= 0) & (uv[:, 0] < W) & (uv[:, 1] >= 0) & (uv[:, 1] < H)
+        idx = idx[in_image]
+        frames.append(np.full(idx.shape[0], k, dtype=np.int32))
+        landmark_ids.append(idx.astype(np.int32))
+        uvs.append(uv[in_image])
+        depths.append(z[idx])
+
+    return (np.concatenate(frames), np.concatenate(landmark_ids),
+            np.concatenate(uvs), np.concatenate(depths))
+
+
+def generate_scenario(n_frames=1000, n_landmarks=5000, rate=10., speed=10., yaw_rate=0.05,
+                      pixel_noise=1., outlier_ratio=0., depth_noise=0.1, depth_ratio=1.,
+                      imu_noise=(0.05, 0.005), imu_factor=10, max_range=80., image_size=(375, 1242),
+                      stop_probability=0., seed=0):
+    """
+    Generate a synthetic drive.
+
+    pixel_noise is the standard deviation of the keypoint noise in pixels and outlier_ratio the fraction
+    of observations replaced by a uniformly random pixel, none by default: main.py keeps every observation
+    unless --gate or --robust_kernel is given. depth_ratio is the fraction of observations
+    with a valid depth (annotated KITTI depth is sparse), the rest read as 0. imu_noise holds the white
+    noise standard deviations of the accelerometer and the gyroscope. stop_probability is the fraction of
+    the 20 s segments where the vehicle stops.
+
+    The IMU is simulated at imu_factor times the camera rate, like the 100 Hz unsynced OXTS stream of
+    KITTI; the per-frame IMU arrays hold the sample taken with each frame, like the synced data.
+
+    Returns a dict of numpy arrays, see save_scenario.
+    """
+    rng = np.random.default_rng(seed)
+    K_np, imu_to_cam = kitti_camera_calibration()
+    H, W = image_size
+
+    imu_time, imu_poses, imu_vel, imu_acc, imu_omega = simulate_trajectory(n_frames * imu_factor, rate * imu_factor,
+                                                                           speed, yaw_rate,
+                                                                           stop_probability=stop_probability, rng=rng)
+    imu_acc = imu_acc + imu_noise[0] * rng.standard_normal(imu_acc.shape)
+    imu_omega = imu_omega + imu_noise[1] * rng.standard_normal(imu_omega.shape)
+    time, poses, vel = imu_time[::imu_factor], imu_poses[::imu_factor], imu_vel[::imu_factor]
+    acc, omega = imu_acc[::imu_factor], imu_omega[::imu_factor]
+    landmarks = scatter_landmarks(poses, n_landmarks, rng=rng)
+    obs_frame, obs_landmark, obs_uv, obs_depth = project_landmarks(poses, landmarks, K_np, imu_to_cam,
+                                                                   image_size, max_range)
+
+    # Keypoint noise and outliers
+    n_obs = obs_frame.shape[0]
+    obs_uv = obs_uv + pixel_noise * rng.standard_normal((n_obs, 2))
+    outlier = rng.random(n_obs) < outlier_ratio
+    obs_uv[outlier] = rng.uniform((0., 0.), (W, H), (int(outlier.sum()), 2))
+    obs_uv = np.clip(np.round(obs_uv), 0, (W - 1, H - 1)).astype(np.int32)
+
+    # Depth at the observed pixel, missing for part of the observations
+    obs_depth = obs_depth + depth_noise * rng.standard_normal(n_obs)
+    obs_depth[outlier] = rng.uniform(1., max_range, int(outlier.sum()))
+    obs_depth[rng.random(n_obs) >= depth_ratio] = 0.
+
+    return {
+        'time': time,
+        'poses': poses,
+        'vel': vel,
+        'acc': acc,
+        'omega': omega,
+        'imu_time': imu_time,
+        'imu_acc': imu_acc,
+        'imu_omega': imu_omega,
+        'landmarks': landmarks,
+        'obs_frame': obs_frame,
+        'obs_landmark': obs_landmark,
+        'obs_uv': obs_uv,
+        'obs_depth': obs_depth.astype(np.float32),
+        'obs_outlier': outlier,
+        'K': K_np,
+        'imu_to_cam': imu_to_cam,
+        'image_size': np.array(image_size),
+    }
+
+
+def save_scenario(path, scenario):
+    """ Write a scenario dict as a compressed npz file, creating the drive directory. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **scenario)
+
+
+class SparseDepthImage(object):
+    """ Depth image holding only the observed pixels, indexed like the dense cv2 images: depth[v, u, c]. """
+
+    def __init__(self, uv, depth, width):
+        self.width = width
+        self.lut = dict(zip((uv[:, 1].astype(np.int64) * width + uv[:, 0]).tolist(), depth.tolist()))
+
+    def __getitem__(self, index):
+        v, u = int(index[0]), int(index[1])
+        return self.lut.get(v * self.width + u, 0.)
+
+
+class SyntheticDrive(object):
+    """ A synthetic scenario loaded from disk, exposing the same quantities main.py reads from pykitti. """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.__dict__.update({key: data[key] for key in data.files})
+        self.timestamps = self.time
+
+    def imu_stream(self):
+        """ The high-rate IMU samples as (times, acc, omega), times relative to the first frame. """
+        return self.imu_time, self.imu_acc, self.imu_omega
+
+    def vision_data(self, n_skip, n_frames=None):
+        """
+        Dense keypoint tracks for every n_skip-th frame in the layout of main.get_vision_data: an M x (K + 1) x 2
+        int array for the K frames 0, n_skip, ... below n_frames, column j holding frame j * n_skip, with -1
+        where a track has no observation and an empty last column.
+        """
+        if n_frames is None:
+            n_frames = self.time.shape[0]
+        keep = (self.obs_frame < n_frames) & (self.obs_frame % n_skip == 0)
+        landmark = self.obs_landmark[keep]
+        tracks, track_idx = np.unique(landmark, return_inverse=True)
+        vision_data = -1 * np.ones((tracks.shape[0], len(range(0, n_frames, n_skip)) + 1, 2), dtype=int)
+        vision_data[track_idx, self.obs_frame[keep] // n_skip] = self.obs_uv[keep]
+        return vision_data
+
+    def track_scores(self, n_skip, n_frames=None):
+        """
+        Stand-in for the average descriptor distance PointTracker keeps per track, for the tracks of
+        vision_data: 0.4 for a clean track, growing with the fraction of outlier observations.
+        """
+        if n_frames is None:
+            n_frames = self.time.shape[0]
+        keep = (self.obs_frame < n_frames) & (self.obs_frame % n_skip == 0)
+        _, track_idx, length = np.unique(self.obs_landmark[keep], return_inverse=True, return_counts=True)
+        outliers = np.bincount(track_idx, weights=self.obs_outlier[keep], minlength=length.shape[0])
+        return 0.4 + 0.5 * outliers / length
+
+    def depth(self, n_frames=None):
+        """ List of sparse depth images, one per frame. """
+        if n_frames is None:
+            n_frames = self.time.shape[0]
+        order = np.argsort(self.obs_frame, kind='stable')
+        bounds = np.searchsorted(self.obs_frame[order], np.arange(n_frames + 1))
+        W = int(self.image_size[1])
+        depth = []
+        for k in range(n_frames):
+            idx = order[bounds[k]:bounds[k + 1]]
+            depth.append(SparseDepthImage(self.obs_uv[idx], self.obs_depth[idx], W))
+        return depth
+
+
+def load_scenario(basedir, date, drive):
+    return SyntheticDrive(scenario_path(basedir, date, drive))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic KITTI-like drive.')
+    parser.add_argument('--basedir', dest='basedir', type=str)
+    parser.add_argument('--date', dest='date', type=str, default='2011_09_26')
+    parser.add_argument('--drive', dest='drive', type=str, default='9001')
+    parser.add_argument('--n_frames', dest='n_frames', type=int, default=1000)
+    parser.add_argument('--n_landmarks', dest='n_landmarks', type=int, default=5000)
+    parser.add_argument('--speed', dest='speed', type=float, default=10.)
+    parser.add_argument('--pixel_noise', dest='pixel_noise', type=float, default=1.)
+    parser.add_argument('--outlier_ratio', dest='outlier_ratio', type=float, default=0.,
+                        help='Fraction of the observations replaced by a random pixel, to run main.py with --gate and --robust_kernel.')
+    parser.add_argument('--depth_ratio', dest='depth_ratio', type=float, default=1.)
+    parser.add_argument('--stop_probability', dest='stop_probability', type=float, default=0.,
+                        help='Fraction of the 20 s segments where the vehicle stops.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scenario = generate_scenario(n_frames=args.n_frames, n_landmarks=args.n_landmarks, speed=args.speed,
+                                 pixel_noise=args.pixel_noise, outlier_ratio=args.outlier_ratio,
+                                 depth_ratio=args.depth_ratio, stop_probability=args.stop_probability,
+                                 seed=args.seed)
+    path = scenario_path(args.basedir, args.date, args.drive)
+    save_scenario(path, scenario)
+    print('==> Wrote', scenario['obs_frame'].shape[0], 'observations of', args.n_landmarks,
+          'landmarks over', args.n_frames, 'frames to', path)
@@ -0,0 +1,93 @@
+"""
+Trajectories as arrays: the keyframe poses, velocities and IMU biases of a solution pulled out of a
+gtsam.Values, and their export to the KITTI odometry and TUM trajectory formats.
+"""
+
+import numpy as np
+import gtsam
+from gtsam.symbol_shorthand import B
+from scipy.spatial.transform import Rotation
+
+
+class Trajectory(object):
+    """
+    Keyframe states of a solution, ordered by keyframe index:
+
+      index - N keyframe indices
+      poses - N x 4 x 4 poses of the IMU in the world frame
+      vel - N x 3 velocities, or None if the values hold none
+      bias - N x 6 accelerometer and gyroscope biases, or None if the values hold none
+    """
+
+    def __init__(self, index, poses, vel=None, bias=None):
+        self.index = index
+        self.poses = poses
+        self.vel = vel
+        self.bias = bias
+
+    @classmethod
+    def from_values(cls, values):
+        """ Extract the X/V/B keys of values, using GTSAM's bulk extraction for poses and velocities. """
+        chars = {ord('x'): [], ord('v'): [], ord('b'): []}
+        for key in values.keys():
+            chars.get(gtsam.symbolChr(key), []).append(gtsam.symbolIndex(key))
+
+        index = np.array(chars[ord('x')], dtype=int)
+        flat = gtsam.utilities.extractPose3(values)
+        poses = np.tile(np.eye(4), (flat.shape[0], 1, 1))
+        poses[:, :3, :3] = flat[:, :9].reshape(-1, 3, 3)
+        poses[:, :3, 3] = flat[:, 9:]
+
+        vel = None
+        if len(chars[ord('v')]) == index.shape[0] > 0:
+            vel = gtsam.utilities.extractVectors(values, 'v')
+
+        bias = None
+        if len(chars[ord('b')]) == index.shape[0] > 0:
+            bias = np.array([values.atConstantBias(B(k)).vector() for k in chars[ord('b')]])
+
+        return cls(index, poses, vel, bias)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    @property
+    def positions(self):
+        return self.poses[:, :3, 3]
+
+    def euler(self):
+        """ N x 3 xyz Euler angles of the poses """
+        return Rotation.from_matrix(self.poses[:, :3, :3]).as_euler('xyz')
+
+    def save_kitti(self, path):
+        save_kitti(path, self.poses)
+
+    def save_tum(self, path, timestamps):
+        save_tum(path, timestamps, self.poses)
+
+
+def save_kitti(path, poses):
+    """ KITTI odometry format: the first three rows of every pose, row-major, one pose per line. """
+    np.savetxt(path, poses[:, :3, :].reshape(-1, 12), fmt='%.9e')
+
+
+def load_kitti(path):
+    flat = np.loadtxt(path, ndmin=2)
+    poses = np.tile(np.eye(4), (flat.shape[0], 1, 1))
+    poses[:, :3, :] = flat.reshape(-1, 3, 4)
+    return poses
+
+
+def save_tum(path, timestamps, poses):
+    """ TUM format: 'timestamp tx ty tz qx qy qz qw' per line. """
+    quat = Rotation.from_matrix(poses[:, :3, :3]).as_quat()
+    np.savetxt(path, np.column_stack((timestamps, poses[:, :3, 3], quat)), fmt='%.9f')
+
+
+def load_tum(path):
+    """ Timestamps and N x 4 x 4 poses of a TUM trajectory file. """
+    data = np.loadtxt(path, ndmin=2)
+    poses = np.tile(np.eye(4), (data.shape[0], 1, 1))
+    poses[:, :3, :3] = Rotation.from_quat(data[:, 4:8]).as_matrix()
+    poses[:, :3, 3] = data[:, 1:4]
+    return data[:, 0], poses
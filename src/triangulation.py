@@ -0,0 +1,94 @@
+"""
+Multi-view triangulation of the keypoint tracks, to initialize the landmarks from all their observations
+and the initial keyframe poses instead of the depth at a single pixel.
+
+All tracks are triangulated at once: every observation contributes the two rows of the linear (DLT)
+system of its track, the 4 x 4 normal matrices are summed per track and the points are their smallest
+eigenvectors, from one batched eigendecomposition. Points are solved relative to the first observing
+camera of their track, which keeps the homogeneous system well conditioned kilometers away from the
+origin. A single mismatched keypoint drags the linear solution away, so the tracks are solved a second
+time from the observations that reproject within max_error pixels of the first solution.
+"""
+
+import numpy as np
+
+
+def _solve(rows, track, n_tracks, weights):
+    """ Smallest eigenvector of the weighted normal matrix of every track with at least two weighted observations """
+    normal = np.zeros((n_tracks, 4, 4))
+    np.add.at(normal, track, weights[:, None, None] * np.einsum('nki,nkj->nij', rows, rows))
+    candidates = np.flatnonzero(np.bincount(track, weights=weights, minlength=n_tracks) >= 2)
+    _, vectors = np.linalg.eigh(normal[candidates])
+    homogeneous = vectors[:, :, 0]
+    finite = np.abs(homogeneous[:, 3]) > 1.e-9 * np.linalg.norm(homogeneous[:, :3], axis=1)
+    candidates, homogeneous = candidates[finite], homogeneous[finite]
+    local = np.zeros((n_tracks, 3))
+    local[candidates] = homogeneous[:, :3] / homogeneous[:, 3, None]
+    solved = np.zeros(n_tracks, dtype=bool)
+    solved[candidates] = True
+    return local, solved
+
+
+def triangulate(uv, world_from_cam, K_np, track, n_tracks, min_depth=1., min_parallax=np.radians(1.), max_error=4.):
+    """
+    Triangulate many tracks from their observations.
+
+    Inputs
+      uv - N x 2 observed keypoints.
+      world_from_cam - N x 4 x 4 poses of the observing cameras.
+      K_np - 3 x 3 camera intrinsics.
+      track - N track index of every observation, in [0, n_tracks).
+      min_depth - cheirality: the point must lie at least min_depth meters in front of every inlier camera.
+      min_parallax - the largest angle in radians between the ray of the first observation and the other
+        inlier rays of the track; below it the depth along the rays is unobservable.
+      max_error - reprojection error in pixels of the inlier observations the points are refined from.
+    Returns
+      n_tracks x 3 points in the world frame, the n_tracks mask of the tracks that passed, which need at
+      least two inlier observations, and the N mask of the inlier observations of the tracks that passed.
+    """
+    points = np.zeros((n_tracks, 3))
+    valid = np.zeros(n_tracks, dtype=bool)
+    if uv.shape[0] == 0:
+        return points, valid, np.zeros(0, dtype=bool)
+
+    # First observation of every track, whose camera center is the origin of the track
+    order = np.argsort(track, kind='stable')
+    tracks, first = np.unique(track[order], return_index=True)
+    first = order[first]
+    origin = np.zeros((n_tracks, 3))
+    origin[tracks] = world_from_cam[first, :3, 3]
+
+    # Projection rows in normalized image coordinates, with the camera translated by the track origin
+    R = np.transpose(world_from_cam[:, :3, :3], (0, 2, 1))
+    t = np.einsum('nij,nj->ni', R, origin[track] - world_from_cam[:, :3, 3])
+    P = np.concatenate((R, t[:, :, None]), axis=2)
+    x = np.c_[uv, np.ones(uv.shape[0])] @ np.linalg.inv(K_np).T
+    rows = np.stack((x[:, 0, None] * P[:, 2] - P[:, 0], x[:, 1, None] * P[:, 2] - P[:, 1]), axis=1)
+    rows /= np.linalg.norm(rows, axis=2, keepdims=True)
+
+    # Solve from all observations, then again from those reprojecting within max_error pixels
+    local, solved = _solve(rows, track, n_tracks, np.ones(uv.shape[0]))
+    projected = np.einsum('nij,nj->ni', P[:, :, :3], local[track]) + P[:, :, 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.linalg.norm(K_np[0, 0] * (projected[:, :2] / projected[:, 2, None] - x[:, :2]), axis=1)
+    inlier = solved[track] & (projected[:, 2] > 0) & (error <= max_error)
+    local, valid = _solve(rows, track, n_tracks, inlier.astype(float))
+    points = local + origin
+    inlier &= valid[track]
+
+    # Cheirality: in front of every inlier camera
+    depth = np.einsum('nj,nj->n', P[:, 2, :3], local[track]) + P[:, 2, 3]
+    closest = np.full(n_tracks, np.inf)
+    np.minimum.at(closest, track[inlier], depth[inlier])
+    valid &= closest >= min_depth
+
+    # Parallax: angle between the ray of the first observation and the other inlier rays
+    rays = points[track] - world_from_cam[:, :3, 3]
+    rays /= np.maximum(np.linalg.norm(rays, axis=1, keepdims=True), 1.e-12)
+    cos_angle = np.clip(np.einsum('nj,nj->n', rays, rays[first][np.searchsorted(tracks, track)]), -1., 1.)
+    parallax = np.zeros(n_tracks)
+    np.maximum.at(parallax, track[inlier], np.arccos(cos_angle[inlier]))
+    valid &= parallax >= min_parallax
+
+    points[~valid] = 0.
+    return points, valid, inlier & valid[track]
@@ -0,0 +1,7 @@
+import os
+import sys
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO, 'src'))
+# download_kitti_raw.py
+sys.path.insert(0, REPO)
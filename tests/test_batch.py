@@ -0,0 +1,20 @@
+import json
+
+import batch
+
+
+def test_load_manifest_names_repeated_drives(tmp_path):
+    manifest = {
+        'defaults': {'date': '2011_09_26', 'n_skip': 10},
+        'drives': [{'drive': '0022', 'camera': 0}, {'drive': '0022', 'camera': 1}, {'drive': '0005'}],
+        'parameters': {'baseline': {}, 'gated': {'gate': 30.}},
+    }
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(manifest))
+
+    runs = batch.load_manifest(str(path))
+    assert [name for name, _ in runs] == ['2011_09_26_0022_0_baseline', '2011_09_26_0022_0_gated',
+                                          '2011_09_26_0022_1_baseline', '2011_09_26_0022_1_gated',
+                                          '2011_09_26_0005_baseline', '2011_09_26_0005_gated']
+    assert runs[2][1] == {'date': '2011_09_26', 'n_skip': 10, 'drive': '0022', 'camera': 1}
+    assert runs[5][1]['gate'] == 30.
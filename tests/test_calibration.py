@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+import calibration
+
+
+def rotation_z(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0.], [s, c, 0.], [0., 0., 1.]])
+
+
+def rotation_x(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[1., 0., 0.], [0., c, -s], [0., s, c]])
+
+
+R_RECT_00 = rotation_x(0.01)
+R_VELO_TO_CAM = rotation_x(-np.pi / 2) @ rotation_z(-np.pi / 2)
+T_VELO_TO_CAM = np.array([-0.004, -0.076, -0.27])
+R_IMU_TO_VELO = rotation_z(0.02)
+T_IMU_TO_VELO = np.array([-0.81, 0.32, -0.8])
+FX, CX, CY = 721.5, 609.6, 172.9
+BASELINE = -0.54
+
+
+def values(a):
+    return ' '.join('%.12e' % x for x in np.ravel(a))
+
+
+def write_calibration(calib_dir, fx=FX):
+    P_rect_00 = np.array([[fx, 0., CX, 0.], [0., fx, CY, 0.], [0., 0., 1., 0.]])
+    P_rect_01 = P_rect_00.copy()
+    P_rect_01[0, 3] = fx * BASELINE
+    with open(os.path.join(calib_dir, 'calib_cam_to_cam.txt'), 'w') as f:
+        f.write('calib_time: 09-Jan-2012 13:57:47\n')
+        f.write('R_rect_00: %s\n' % values(R_RECT_00))
+        f.write('S_rect_00: 1.242000e+03 3.750000e+02\n')
+        f.write('P_rect_00: %s\n' % values(P_rect_00))
+        f.write('S_rect_01: 1.242000e+03 3.750000e+02\n')
+        f.write('P_rect_01: %s\n' % values(P_rect_01))
+    with open(os.path.join(calib_dir, 'calib_velo_to_cam.txt'), 'w') as f:
+        f.write('calib_time: 15-Mar-2012 11:37:16\n')
+        f.write('R: %s\nT: %s\n' % (values(R_VELO_TO_CAM), values(T_VELO_TO_CAM)))
+    with open(os.path.join(calib_dir, 'calib_imu_to_velo.txt'), 'w') as f:
+        f.write('calib_time: 25-May-2012 16:47:16\n')
+        f.write('R: %s\nT: %s\n' % (values(R_IMU_TO_VELO), values(T_IMU_TO_VELO)))
+
+
+@pytest.fixture
+def calib_dir(tmp_path):
+    calibration._cache.clear()
+    path = tmp_path / '2011_09_26'
+    path.mkdir()
+    write_calibration(str(path))
+    yield str(path)
+    calibration._cache.clear()
+
+
+@pytest.mark.parametrize('camera', [0, 1])
+def test_transform_chain(calib_dir, camera):
+    T_rect = np.eye(4)
+    T_rect[0, 3] = BASELINE if camera == 1 else 0.
+    R_rect = np.eye(4)
+    R_rect[:3, :3] = R_RECT_00
+    T_cam_velo = np.eye(4)
+    T_cam_velo[:3, :3] = R_VELO_TO_CAM
+    T_cam_velo[:3, 3] = T_VELO_TO_CAM
+    T_velo_imu = np.eye(4)
+    T_velo_imu[:3, :3] = R_IMU_TO_VELO
+    T_velo_imu[:3, 3] = T_IMU_TO_VELO
+    cam_to_imu = T_rect @ R_rect @ T_cam_velo @ T_velo_imu
+
+    calib = calibration.parse_kitti_calibration(calib_dir, camera)
+    np.testing.assert_allclose(calib.imu_to_cam, np.linalg.inv(cam_to_imu), atol=1.e-9)
+    np.testing.assert_allclose(calib.K_np, [[FX, 0., CX], [0., FX, CY], [0., 0., 1.]])
+    assert calib.image_size == (375, 1242)
+
+
+def test_cache_rebuilt_when_a_file_is_touched(calib_dir):
+    basedir, date = os.path.split(calib_dir)
+    calibration.load_calibration(basedir, date, 0)
+    cache_path = os.path.join(calib_dir, 'calib_cam0.npz')
+    assert os.path.exists(cache_path)
+    cached = os.path.getmtime(cache_path)
+
+    # An edit that leaves the files older than the cache is not seen
+    path = os.path.join(calib_dir, 'calib_cam_to_cam.txt')
+    write_calibration(calib_dir, fx=700.)
+    for name in calibration.CALIB_FILES:
+        os.utime(os.path.join(calib_dir, name), (cached - 10., cached - 10.))
+    calibration._cache.clear()
+    assert calibration.load_calibration(basedir, date, 0).K_np[0, 0] == FX
+
+    # Touching one file rebuilds the cache from the files
+    os.utime(path, (cached + 10., cached + 10.))
+    calibration._cache.clear()
+    assert calibration.load_calibration(basedir, date, 0).K_np[0, 0] == 700.
+    assert calibration.CameraCalibration.load(cache_path).K_np[0, 0] == 700.
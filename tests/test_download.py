@@ -0,0 +1,100 @@
+import hashlib
+import http.server
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+import download_kitti_raw
+
+MEMBERS = {
+    '2011_09_26/calib_cam_to_cam.txt': b'P_rect_00: 1 0 0 0 0 1 0 0 0 0 1 0\n' * 500,
+    '2011_09_26/2011_09_26_drive_0001_sync/oxts/data/0000000000.txt': os.urandom(20000),
+}
+
+
+def archive(compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as z:
+        for name, data in MEMBERS.items():
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves server.data. The first request is cut off after half of the body; with server.ranges the next
+    ones answer range requests, otherwise they send the whole body again.
+    """
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        server.requests.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range') and server.ranges:
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        end = len(data) // 2 if len(server.requests) == 1 else len(data)
+        self.wfile.write(data[start:end])
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    server.requests = []
+    server.ranges = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server, out_dir, data):
+    server.data = data
+    entry = {'name': 'test.zip', 'path': 'test.zip', 'layout': 'raw', 'sha256': hashlib.sha256(data).hexdigest()}
+    return download_kitti_raw.download(entry, 'http://127.0.0.1:%d' % server.server_address[1], str(out_dir))
+
+
+def assert_extracted(out_dir):
+    for name, data in MEMBERS.items():
+        with open(os.path.join(str(out_dir), name), 'rb') as f:
+            assert f.read() == data
+    assert os.path.exists(os.path.join(str(out_dir), 'test.zip.done'))
+    assert not os.path.exists(os.path.join(str(out_dir), 'test.zip.part'))
+
+
+def test_truncated_body_resumes_with_range(server, tmp_path):
+    data = archive()
+    fetch(server, tmp_path, data)
+    assert server.requests == [None, 'bytes=%d-' % (len(data) // 2)]
+    assert_extracted(tmp_path)
+
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    server.ranges = False
+    data = archive()
+    fetch(server, tmp_path, data)
+    assert server.requests == [None, 'bytes=%d-' % (len(data) // 2)]
+    assert_extracted(tmp_path)
+
+
+def test_crc_mismatch(server, tmp_path):
+    data = bytearray(archive(zipfile.ZIP_STORED))
+    # Flip a byte inside the stored data of the last member
+    data[data.index(list(MEMBERS.values())[-1][:64]) + 100] ^= 0xff
+    with pytest.raises(IOError, match='CRC mismatch'):
+        fetch(server, tmp_path, bytes(data))
+    assert not os.path.exists(os.path.join(str(tmp_path), 'test.zip.done'))
@@ -0,0 +1,20 @@
+import numpy as np
+
+import evaluation
+
+
+def test_associate_nearest():
+    est, gt = evaluation.associate([0., 0.11, 0.19, 0.5], [0., 0.1, 0.2, 0.3])
+    np.testing.assert_array_equal(est, [0, 1, 2])
+    np.testing.assert_array_equal(gt, [0, 1, 2])
+
+
+def test_associate_single_ground_truth_pose():
+    est, gt = evaluation.associate([0., 0.01, 0.5], [0.01])
+    np.testing.assert_array_equal(est, [0, 1])
+    np.testing.assert_array_equal(gt, [0, 0])
+
+
+def test_associate_no_ground_truth():
+    est, gt = evaluation.associate([0., 0.1], [])
+    assert est.shape == (0,) and gt.shape == (0,)
@@ -0,0 +1,103 @@
+import fcntl
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import feature_cache
+
+FRAMES = 200
+
+
+def frame(i):
+    """ Image, keypoints and descriptors of frame i, all derived from i """
+    img = np.full((8, 8), i, dtype=np.float32)
+    n = 1 + i % 7
+    pts = np.full((3, n), i, dtype=np.float32)
+    desc = np.full((4, n), -i, dtype=np.float32)
+    return img, pts, desc
+
+
+def fill(cache_dir, frames, delay=0.):
+    cache = feature_cache.FeatureCache(cache_dir, 'drive', 'frontend')
+    for i in frames:
+        cache.put(*frame(i))
+        time.sleep(delay)
+    cache.close()
+
+
+def assert_cached_frames_match(cache_dir, frames):
+    """ Every frame found in the pack has its own keypoints and descriptors. Returns the frames found. """
+    cache = feature_cache.FeatureCache(cache_dir, 'drive', 'frontend')
+    found = []
+    for i in frames:
+        img, pts, desc = frame(i)
+        cached = cache.get(img)
+        if cached is not None:
+            np.testing.assert_array_equal(cached[0], pts)
+            np.testing.assert_array_equal(cached[1], desc)
+            found.append(i)
+    cache.close()
+    return found
+
+
+def test_processes_filling_one_pack(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=fill, args=(str(tmp_path), range(start, FRAMES, 2))) for start in (0, 1)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = feature_cache.FeatureCache(str(tmp_path), 'drive', 'frontend')
+    for i in range(FRAMES):
+        img, pts, desc = frame(i)
+        cached = cache.get(img)
+        assert cached is not None, i
+        np.testing.assert_array_equal(cached[0], pts)
+        np.testing.assert_array_equal(cached[1], desc)
+    cache.close()
+
+
+def test_evict_while_another_process_writes(tmp_path):
+    cache_dir = str(tmp_path)
+    fill(cache_dir, range(FRAMES // 4))
+    pack = feature_cache.FeatureCache(cache_dir, 'drive', 'frontend')
+    written = os.path.getsize(pack.data_path)
+    pack.close()
+
+    context = multiprocessing.get_context('spawn')
+    writer = context.Process(target=fill, args=(cache_dir, range(FRAMES // 4, FRAMES), 0.005))
+    writer.start()
+    other = feature_cache.FeatureCache(cache_dir, 'other', 'frontend')
+    # Evict the pack once the writer appended to it, while it keeps writing
+    while os.path.getsize(pack.data_path) == written:
+        time.sleep(0.001)
+    while os.path.exists(pack.index_path):
+        other.evict(0)
+    writer.join()
+    assert writer.exitcode == 0
+    other.close()
+    assert len(assert_cached_frames_match(cache_dir, range(FRAMES))) < FRAMES
+
+    # Entries written before the eviction must not point into the pack filled after it
+    fill(cache_dir, range(FRAMES, 2 * FRAMES))
+    found = assert_cached_frames_match(cache_dir, range(2 * FRAMES))
+    assert set(range(FRAMES, 2 * FRAMES)) <= set(found)
+
+
+def test_evict_skips_locked_pack(tmp_path):
+    cache_dir = str(tmp_path)
+    fill(cache_dir, range(10))
+    pack = feature_cache.FeatureCache(cache_dir, 'drive', 'frontend')
+    pack.close()
+    other = feature_cache.FeatureCache(cache_dir, 'other', 'frontend')
+    with open(pack.data_path, 'rb') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        other.evict(0)
+        assert os.path.exists(pack.index_path) and os.path.exists(pack.data_path)
+    other.evict(0)
+    assert not os.path.exists(pack.index_path) and not os.path.exists(pack.data_path)
+    other.close()
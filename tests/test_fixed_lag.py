@@ -0,0 +1,109 @@
+import gtsam
+import numpy as np
+import pytest
+from gtsam.symbol_shorthand import L, X
+
+import evaluation
+import keyframe_selection
+import synthetic
+import trajectory
+import VisualInertialOdometry as vio
+
+N_SKIP = 5
+LAG = 3.
+
+
+@pytest.fixture(scope='module')
+def drive(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('kitti') / synthetic.SCENARIO_FILE)
+    synthetic.save_scenario(path, synthetic.generate_scenario(n_frames=1500, n_landmarks=12000, seed=5))
+    return synthetic.SyntheticDrive(path)
+
+
+def streamed_graph(drive, n_frames):
+    measured_poses = np.linalg.inv(drive.poses[0]) @ drive.poses[:n_frames]
+    IMU_PARAMS = gtsam.PreintegrationParams.MakeSharedU(9.81)
+    IMU_PARAMS.setAccelerometerCovariance(np.eye(3) * 0.2)
+    IMU_PARAMS.setGyroscopeCovariance(np.eye(3) * 0.2)
+    IMU_PARAMS.setIntegrationCovariance(np.eye(3) * 0.2)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS,
+                                            BIAS_COVARIANCE=gtsam.noiseModel.Isotropic.Variance(6, 0.4))
+    imu_args = (measured_poses, drive.acc[:n_frames], drive.omega[:n_frames], drive.vel[:n_frames],
+                np.diff(drive.time[:n_frames]), N_SKIP)
+    vision_data = drive.vision_data(N_SKIP, n_frames)
+    depth = drive.depth(n_frames)
+    graph.updates = lambda: graph.keypoint_updates(graph.imu_updates(*imu_args, initialization='imu'),
+                                                   vision_data, None, N_SKIP, depth)
+    keyframes = keyframe_selection.keyframe_frames(N_SKIP, n_frames)
+    return graph, imu_args, measured_poses[keyframes], drive.time[keyframes]
+
+
+def isam2_params():
+    ISAM2_PARAMS = gtsam.ISAM2Params()
+    ISAM2_PARAMS.setFactorization('QR')
+    return ISAM2_PARAMS
+
+
+def test_window_stays_bounded(drive):
+    graph, _, keyframe_poses, keyframe_times = streamed_graph(drive, 1500)
+    window = []
+
+    def marginalized(key, value):
+        window.append(graph.smoother.getLinearizationPoint().size())
+
+    graph.estimate_fixed_lag(keyframe_times, LAG, isam2_params(), marginalized=marginalized)
+    assert graph.graph.size() == 0 and graph.initial_estimate.size() == 0
+    # Once the window is full, the number of keys in the smoother does not grow with the drive
+    third = len(window) // 3
+    assert max(window[-third:]) <= 1.5 * max(window[third:2 * third])
+    assert max(window) < 0.1 * len(window)
+
+
+def test_states_streamed_out(drive):
+    graph, _, keyframe_poses, keyframe_times = streamed_graph(drive, 600)
+    result = graph.estimate_fixed_lag(keyframe_times, LAG, isam2_params())
+
+    # Every keyframe state leaves the window into the result, without the landmarks
+    traj = trajectory.Trajectory.from_values(result)
+    np.testing.assert_array_equal(traj.index, np.arange(keyframe_times.shape[0]))
+    assert traj.vel is not None and traj.bias is not None
+    assert result.size() == 3 * keyframe_times.shape[0]
+    assert evaluation.evaluate(traj.poses, keyframe_poses, alignment='se3')['ate_rmse'] < 2.
+
+
+def test_streamed_graph_solves_like_built_graph(drive):
+    graph, imu_args, _, keyframe_times = streamed_graph(drive, 600)
+    result = graph.estimate_fixed_lag(keyframe_times, LAG, isam2_params())
+
+    built = vio.VisualInertialOdometryGraph(IMU_PARAMS=graph.IMU_PARAMS, BIAS_COVARIANCE=graph.BIAS_COVARIANCE)
+    built.add_imu_measurements(*imu_args, initialization='imu')
+    built.add_keypoints(drive.vision_data(N_SKIP, 600), None, N_SKIP, drive.depth(600), None)
+    built_result = built.estimate_fixed_lag(keyframe_times, LAG, isam2_params())
+
+    np.testing.assert_allclose(trajectory.Trajectory.from_values(result).poses,
+                               trajectory.Trajectory.from_values(built_result).poses, atol=1.e-6)
+
+
+def test_landmarks_on_marginalized_poses_left_out(drive):
+    graph, imu_args, keyframe_poses, keyframe_times = streamed_graph(drive, 200)
+    K, IMU_TO_CAM_POSE = graph.CALIBRATION.K, graph.CALIBRATION.IMU_TO_CAM_POSE
+    noise = gtsam.noiseModel.Isotropic.Sigma(2, 10.)
+    last = keyframe_times.shape[0] - 1
+    camera = gtsam.PinholeCameraCal3_S2(gtsam.Pose3(keyframe_poses[last]).compose(IMU_TO_CAM_POSE), K)
+    point = camera.backproject(gtsam.Point2(600., 180.), 20.)
+
+    def updates():
+        for keyframe, factors, values in graph.imu_updates(*imu_args, initialization='imu'):
+            if keyframe == last:
+                # Seen from a pose marginalized long ago and from the last one: a single factor is left
+                for j in (0, last):
+                    factors.push_back(gtsam.GenericProjectionFactorCal3_S2(
+                        camera.project(point) if j == last else gtsam.Point2(600., 180.), noise, X(j), L(0), K, IMU_TO_CAM_POSE))
+                values.insert(L(0), point)
+            yield keyframe, factors, values
+
+    landmarks = []
+    graph.updates = updates
+    graph.estimate_fixed_lag(keyframe_times, LAG, isam2_params(), LANDMARK_SIGMA=None,
+                             marginalized=lambda key, value: landmarks.append(key) if gtsam.symbolChr(key) == ord('l') else None)
+    assert L(0) not in landmarks
@@ -0,0 +1,59 @@
+import gtsam
+import numpy as np
+import pytest
+
+import synthetic
+import VisualInertialOdometry as vio
+
+N_SKIP = 5
+
+
+@pytest.fixture(scope='module')
+def drive(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('kitti') / synthetic.SCENARIO_FILE)
+    synthetic.save_scenario(path, synthetic.generate_scenario(n_frames=101, n_landmarks=2000, seed=4))
+    return synthetic.SyntheticDrive(path)
+
+
+def build_graph(drive):
+    measured_poses = np.linalg.inv(drive.poses[0]) @ drive.poses
+    IMU_PARAMS = gtsam.PreintegrationParams.MakeSharedU(9.81)
+    IMU_PARAMS.setAccelerometerCovariance(np.eye(3) * 0.2)
+    IMU_PARAMS.setGyroscopeCovariance(np.eye(3) * 0.2)
+    IMU_PARAMS.setIntegrationCovariance(np.eye(3) * 0.2)
+    np.random.seed(0)
+    graph = vio.VisualInertialOdometryGraph(IMU_PARAMS=IMU_PARAMS,
+                                            BIAS_COVARIANCE=gtsam.noiseModel.Isotropic.Variance(6, 0.4))
+    graph.add_imu_measurements(measured_poses, drive.acc, drive.omega, drive.vel, np.diff(drive.time), N_SKIP)
+    graph.add_keypoints(drive.vision_data(N_SKIP), measured_poses, N_SKIP, drive.depth(), None)
+    return graph, measured_poses
+
+
+def solver_params():
+    params = gtsam.LevenbergMarquardtParams()
+    params.setMaxIterations(10)
+    return params
+
+
+def test_save_load_round_trip(drive, tmp_path):
+    graph, measured_poses = build_graph(drive)
+    path = str(tmp_path / 'vio.npz')
+    graph.save(path, measured_poses=measured_poses)
+    loaded = vio.VisualInertialOdometryGraph.load(path)
+
+    assert loaded.graph.size() == graph.graph.size()
+    assert loaded.initial_estimate.size() == graph.initial_estimate.size()
+    np.testing.assert_array_equal(loaded.arrays['measured_poses'], measured_poses)
+    np.testing.assert_array_equal(loaded.CALIBRATION.K_np, graph.CALIBRATION.K_np)
+    np.testing.assert_array_equal(loaded.CALIBRATION.imu_to_cam, graph.CALIBRATION.imu_to_cam)
+    assert loaded.graph.error(loaded.initial_estimate) == pytest.approx(graph.graph.error(graph.initial_estimate))
+
+    result = graph.estimate(solver_params())
+    loaded_result = loaded.estimate(solver_params())
+    assert loaded.graph.error(loaded_result) == pytest.approx(graph.graph.error(result), rel=1.e-9)
+
+
+def test_reserved_array_names(drive, tmp_path):
+    graph, _ = build_graph(drive)
+    with pytest.raises(ValueError):
+        graph.save(str(tmp_path / 'vio.npz'), graph=np.zeros(1))
@@ -0,0 +1,82 @@
+import gtsam
+import numpy as np
+
+import imu
+
+
+def stream(n):
+    """ n samples one second apart, the sample index in every axis of acc and minus it in omega """
+    times = np.arange(float(n))
+    acc = np.repeat(times[:, None], 3, axis=1)
+    return times, acc, -acc
+
+
+def test_segment_boundaries():
+    times, acc, omega = stream(10)
+    segments = imu.imu_segments(np.array([0.5, 3.5, 7.5]), times, acc, omega)
+    assert len(segments) == 2
+
+    # The sample before the keyframe is held until the first sample of the interval
+    a, w, dt = segments[0]
+    np.testing.assert_array_equal(a[:, 0], [0., 1., 2., 3.])
+    np.testing.assert_array_equal(w, -a)
+    np.testing.assert_allclose(dt, [0.5, 1., 1., 0.5])
+    a, w, dt = segments[1]
+    np.testing.assert_array_equal(a[:, 0], [3., 4., 5., 6., 7.])
+    np.testing.assert_allclose(dt, [0.5, 1., 1., 1., 0.5])
+
+
+def test_samples_on_keyframe_timestamps():
+    times, acc, omega = stream(31)
+    keyframe_times = np.array([0., 10., 20., 30.])
+    segments = imu.imu_segments(keyframe_times, times, acc, omega)
+
+    # A sample at a keyframe starts the next interval and is not integrated twice
+    for k, (a, w, dt) in enumerate(segments):
+        np.testing.assert_array_equal(a[:, 0], np.arange(10. * k, 10. * (k + 1)))
+        np.testing.assert_array_equal(dt, np.ones(10))
+
+
+def test_keyframes_before_the_stream():
+    times, acc, omega = stream(5)
+    a, w, dt = imu.imu_segments(np.array([-1., 2.]), times, acc, omega)[0]
+    # Without an earlier sample the first one covers the gap to the stream start
+    np.testing.assert_array_equal(a[:, 0], [0., 0., 1.])
+    np.testing.assert_allclose(dt, [1., 1., 1.])
+
+
+def test_empty_segments():
+    times, acc, omega = stream(5)
+    segments = imu.imu_segments(np.array([1., 1.25, 1.5, 1.5, 3.]), times, acc, omega)
+    assert len(segments) == 4
+
+    # No sample inside the interval: the last sample before it is held throughout
+    a, w, dt = segments[0]
+    np.testing.assert_array_equal(a[:, 0], [1.])
+    np.testing.assert_allclose(dt, [0.25])
+    # Keyframes at the same time have no measurement at all
+    a, w, dt = segments[2]
+    assert a.shape == (0, 3) and w.shape == (0, 3) and dt.shape == (0,)
+
+    params = gtsam.PreintegrationParams.MakeSharedU(9.81)
+    accum = gtsam.PreintegratedImuMeasurements(params, gtsam.imuBias.ConstantBias())
+    imu.integrate_measurements(accum, a, w, dt)
+    assert accum.deltaTij() == 0.
+
+
+def test_integrate_measurements():
+    times, acc, omega = stream(12)
+    keyframe_times = np.array([0.5, 11.])
+    a, w, dt = imu.imu_segments(keyframe_times, times, 0.1 * acc, 0.01 * omega)[0]
+    params = gtsam.PreintegrationParams.MakeSharedU(9.81)
+
+    accum = gtsam.PreintegratedImuMeasurements(params, gtsam.imuBias.ConstantBias())
+    imu.integrate_measurements(accum, a, w, dt)
+    expected = gtsam.PreintegratedImuMeasurements(params, gtsam.imuBias.ConstantBias())
+    for i in range(a.shape[0]):
+        expected.integrateMeasurement(a[i], w[i], dt[i])
+
+    assert np.isclose(accum.deltaTij(), keyframe_times[1] - keyframe_times[0])
+    np.testing.assert_allclose(accum.deltaPij(), expected.deltaPij())
+    np.testing.assert_allclose(accum.deltaVij(), expected.deltaVij())
+    np.testing.assert_allclose(accum.deltaRij().matrix(), expected.deltaRij().matrix())
@@ -0,0 +1,53 @@
+import numpy as np
+
+import landmark_selection
+
+IMAGE_SIZE = (100, 200)
+GRID = (2, 4)
+
+
+def tracks(heads, lengths, n_frames=20):
+    """ vision_data of tracks starting at the (u, v) heads in frame 0, observed in their first lengths frames """
+    vision_data = -np.ones((len(heads), n_frames, 2), dtype=int)
+    for i, ((u, v), length) in enumerate(zip(heads, lengths)):
+        vision_data[i, :length] = (u, v)
+    return vision_data
+
+
+def test_per_bucket_cap():
+    # Six tracks in the top left cell, two in the bottom right one
+    heads = [(10, 10)] * 6 + [(190, 90)] * 2
+    lengths = [2, 3, 4, 5, 6, 7, 3, 4]
+    selected = landmark_selection.select_tracks(tracks(heads, lengths), image_size=IMAGE_SIZE, grid=GRID, per_bucket=3)
+    # The three longest of the crowded cell, both of the other one
+    np.testing.assert_array_equal(selected, [3, 4, 5, 6, 7])
+
+
+def test_buckets_split_by_head_keyframe():
+    vision_data = tracks([(10, 10)] * 4, [5] * 4)
+    vision_data[2:] = np.roll(vision_data[2:], 3, axis=1)
+    selected = landmark_selection.select_tracks(vision_data, image_size=IMAGE_SIZE, grid=GRID, per_bucket=1)
+    assert selected.shape[0] == 2 and selected[0] < 2 <= selected[1]
+
+
+def test_max_factors_cap():
+    heads = [(10 + 50 * i, 10) for i in range(4)]
+    lengths = [9, 7, 5, 3]
+    vision_data = tracks(heads, lengths)
+
+    # The budget is spent by decreasing priority, as long as the observations fit
+    selected = landmark_selection.select_tracks(vision_data, image_size=IMAGE_SIZE, grid=GRID, max_factors=16)
+    np.testing.assert_array_equal(selected, [0, 1])
+    assert landmark_selection.track_lengths(vision_data[selected]).sum() <= 16
+    selected = landmark_selection.select_tracks(vision_data, image_size=IMAGE_SIZE, grid=GRID, max_factors=15)
+    np.testing.assert_array_equal(selected, [0])
+    selected = landmark_selection.select_tracks(vision_data, image_size=IMAGE_SIZE, grid=GRID, max_landmarks=3,
+                                                max_factors=100)
+    np.testing.assert_array_equal(selected, [0, 1, 2])
+
+
+def test_invalid_tracks_never_selected():
+    # A single observation, and a track seen in more than max_length_ratio of the frames
+    vision_data = tracks([(10, 10), (60, 10), (110, 10)], [1, 15, 4])
+    selected = landmark_selection.select_tracks(vision_data, image_size=IMAGE_SIZE, grid=GRID)
+    np.testing.assert_array_equal(selected, [2])
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import synthetic
+
+
+@pytest.fixture(scope='module')
+def drive(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('kitti') / synthetic.SCENARIO_FILE)
+    synthetic.save_scenario(path, synthetic.generate_scenario(n_frames=120, n_landmarks=3000, seed=3))
+    return synthetic.SyntheticDrive(path)
+
+
+def test_no_outliers_by_default(drive):
+    assert not drive.obs_outlier.any()
+
+
+@pytest.mark.parametrize('n_frames, n_skip', [(23, 3), (24, 3), (24, 1)])
+def test_vision_data_columns(drive, n_frames, n_skip):
+    vision_data = drive.vision_data(n_skip, n_frames)
+    frames = range(0, n_frames, n_skip)
+    assert vision_data.shape[1] == len(frames) + 1
+    assert np.all(vision_data[:, -1] == -1)
+    assert drive.track_scores(n_skip, n_frames).shape[0] == vision_data.shape[0]
+    # Column j holds the observations of frame j * n_skip, the last one included
+    for j, frame in enumerate(frames):
+        observed = vision_data[:, j][vision_data[:, j, 0] >= 0]
+        expected = drive.obs_uv[drive.obs_frame == frame]
+        assert observed.shape[0] == expected.shape[0] > 0
+        np.testing.assert_array_equal(np.unique(observed, axis=0), np.unique(expected, axis=0))
@@ -0,0 +1,51 @@
+import argparse
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('cv2')
+pytest.importorskip('pykitti')
+
+import main
+import synthetic
+
+
+def synthetic_features(scenario, n_frames, n_skip):
+    """ (frame, pts, desc) of every n_skip-th frame, a landmark having the same unit descriptor in every frame """
+    rng = np.random.default_rng(1)
+    descriptors = rng.standard_normal((256, scenario['landmarks'].shape[0]))
+    descriptors /= np.linalg.norm(descriptors, axis=0)
+    for i in range(0, n_frames, n_skip):
+        seen = scenario['obs_frame'] == i
+        uv = scenario['obs_uv'][seen].T
+        pts = np.vstack((uv, np.ones(uv.shape[1])))
+        yield i, pts, descriptors[:, scenario['obs_landmark'][seen]]
+
+
+@pytest.mark.parametrize('n_frames, n_skip', [(23, 3), (24, 3), (23, 1)])
+def test_streaming_tracks_match_point_tracker(n_frames, n_skip):
+    scenario = synthetic.generate_scenario(n_frames=n_frames, n_landmarks=3000, outlier_ratio=0., seed=2)
+    drive = types.SimpleNamespace(n_frames=n_frames)
+    args = argparse.Namespace(synthetic=False, n_skip=n_skip, nn_thresh=0.7, conf_thresh=0.15, frontend='superpoint',
+                              viz_tracking=False, memory_budget=None)
+    vision_data, scores = main.track_features(args, drive, synthetic_features(scenario, n_frames, n_skip))
+    args.memory_budget = 1024.
+    streamed, streamed_scores = main.track_features(args, drive, synthetic_features(scenario, n_frames, n_skip))
+
+    n_keyframes = len(range(0, n_frames, n_skip))
+    assert vision_data.shape[1] == n_keyframes + 1
+    assert np.all(vision_data[:, -1] == -1)
+    # Same tracks, up to their order
+    order = np.lexsort(vision_data.reshape(vision_data.shape[0], -1).T)
+    streamed_order = np.lexsort(streamed.reshape(streamed.shape[0], -1).T)
+    np.testing.assert_array_equal(streamed[streamed_order], vision_data[order])
+    np.testing.assert_allclose(streamed_scores[streamed_order], scores[order], atol=1.e-6)
+
+    # Column j holds the keypoints of frame j * n_skip
+    first = scenario['obs_frame'] == 0
+    assert set(map(tuple, vision_data[:, 0][vision_data[:, 0, 0] >= 0])) == set(map(tuple, scenario['obs_uv'][first]))
+    last = scenario['obs_frame'] == (n_keyframes - 1) * n_skip
+    assert (set(map(tuple, vision_data[:, n_keyframes - 1][vision_data[:, n_keyframes - 1, 0] >= 0]))
+            == set(map(tuple, scenario['obs_uv'][last])))
@@ -0,0 +1,37 @@
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+import trajectory
+
+
+def random_poses(n, seed=0):
+    rng = np.random.default_rng(seed)
+    poses = np.tile(np.eye(4), (n, 1, 1))
+    poses[:, :3, :3] = Rotation.random(n, random_state=seed).as_matrix()
+    poses[:, :3, 3] = rng.uniform(-500., 500., (n, 3))
+    return poses
+
+
+def test_kitti_round_trip(tmp_path):
+    poses = random_poses(25)
+    path = str(tmp_path / 'poses_kitti.txt')
+    trajectory.Trajectory(np.arange(25), poses).save_kitti(path)
+    np.testing.assert_allclose(trajectory.load_kitti(path), poses, rtol=1.e-8, atol=1.e-8)
+
+
+def test_tum_round_trip(tmp_path):
+    poses = random_poses(25, seed=1)
+    timestamps = 1317000000. + 0.1 * np.arange(25)
+    path = str(tmp_path / 'poses_tum.txt')
+    trajectory.Trajectory(np.arange(25), poses).save_tum(path, timestamps)
+    loaded_times, loaded = trajectory.load_tum(path)
+    np.testing.assert_allclose(loaded_times, timestamps, atol=1.e-6)
+    np.testing.assert_allclose(loaded, poses, atol=1.e-8)
+
+
+def test_single_pose(tmp_path):
+    poses = random_poses(1)
+    trajectory.save_kitti(str(tmp_path / 'kitti.txt'), poses)
+    trajectory.save_tum(str(tmp_path / 'tum.txt'), np.zeros(1), poses)
+    assert trajectory.load_kitti(str(tmp_path / 'kitti.txt')).shape == (1, 4, 4)
+    np.testing.assert_allclose(trajectory.load_tum(str(tmp_path / 'tum.txt'))[1], poses, atol=1.e-8)
@@ -0,0 +1,88 @@
+import numpy as np
+
+import triangulation
+
+K_np = np.array([[700., 0., 620.], [0., 700., 190.], [0., 0., 1.]])
+
+
+def camera(x, yaw=0.):
+    """ Camera at (x, 0, 0) looking along +z, turned by yaw around the y axis """
+    c, s = np.cos(yaw), np.sin(yaw)
+    world_from_cam = np.eye(4)
+    world_from_cam[:3, :3] = [[c, 0., s], [0., 1., 0.], [-s, 0., c]]
+    world_from_cam[0, 3] = x
+    return world_from_cam
+
+
+def project(points, world_from_cam):
+    cam_from_world = np.linalg.inv(world_from_cam)
+    p = points @ cam_from_world[:3, :3].T + cam_from_world[:3, 3]
+    uv = p @ K_np.T
+    return uv[:, :2] / uv[:, 2, None]
+
+
+def observations(points, cameras):
+    """ Every point seen by every camera: uv, poses and track of each observation """
+    uv = np.concatenate([project(points, c) for c in cameras])
+    poses = np.repeat(np.array(cameras), points.shape[0], axis=0)
+    track = np.tile(np.arange(points.shape[0]), len(cameras))
+    return uv, poses, track
+
+
+def test_noiseless_points():
+    rng = np.random.default_rng(0)
+    points = np.column_stack((rng.uniform(-5., 5., 20), rng.uniform(-2., 2., 20), rng.uniform(8., 40., 20)))
+    # Far from the origin, where the track-relative solve keeps the system well conditioned
+    offset = np.array([3000., 0., 0.])
+    cameras = [camera(3000. + x, yaw) for x, yaw in ((0., 0.), (1.5, 0.02), (3., -0.01))]
+    uv, poses, track = observations(points + offset, cameras)
+
+    result, valid, inlier = triangulation.triangulate(uv, poses, K_np, track, points.shape[0])
+    assert valid.all() and inlier.all()
+    np.testing.assert_allclose(result, points + offset, atol=1.e-6)
+
+
+def test_outlier_observation_is_rejected():
+    points = np.array([[1., 0.5, 15.], [-2., 0., 25.]])
+    cameras = [camera(x) for x in (0., 1., 2., 3., 4., 5.)]
+    uv, poses, track = observations(points, cameras)
+    # Off by 10 pixels, more than max_error: the track is solved again without it
+    uv[2] += (8., -6.)
+
+    result, valid, inlier = triangulation.triangulate(uv, poses, K_np, track, points.shape[0])
+    assert valid.all()
+    assert not inlier[2] and inlier.sum() == uv.shape[0] - 1
+    np.testing.assert_allclose(result, points, atol=1.e-6)
+
+
+def test_cheirality():
+    # Behind the cameras: the rays meet, but at negative depth
+    points = np.array([[1., 0., -20.]])
+    cameras = [camera(0.), camera(2.)]
+    uv, poses, track = observations(points, cameras)
+    result, valid, inlier = triangulation.triangulate(uv, poses, K_np, track, 1)
+    assert not valid[0] and not inlier.any()
+    np.testing.assert_array_equal(result, 0.)
+
+
+def test_parallax():
+    # 10 cm baseline at 30 m: 0.2 degrees of parallax
+    points = np.array([[0., 0., 30.]])
+    uv, poses, track = observations(points, [camera(0.), camera(0.1)])
+    _, valid, _ = triangulation.triangulate(uv, poses, K_np, track, 1)
+    assert not valid[0]
+    _, valid, _ = triangulation.triangulate(uv, poses, K_np, track, 1, min_parallax=np.radians(0.1))
+    assert valid[0]
+
+
+def test_single_observation_and_empty_input():
+    points = np.array([[0., 0., 10.], [1., 0., 12.]])
+    uv, poses, track = observations(points, [camera(0.), camera(1.)])
+    # Track 1 keeps a single observation
+    result, valid, inlier = triangulation.triangulate(uv[:3], poses[:3], K_np, track[:3], 2)
+    np.testing.assert_array_equal(valid, [True, False])
+    np.testing.assert_array_equal(inlier, [True, False, True])
+
+    result, valid, inlier = triangulation.triangulate(np.zeros((0, 2)), np.zeros((0, 4, 4)), K_np,
+                                                      np.zeros(0, dtype=int), 3)
+    assert result.shape == (3, 3) and not valid.any() and inlier.shape == (0,)